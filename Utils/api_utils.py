@@ -1,10 +1,15 @@
 from datetime import datetime
 from planet import Auth
 import rasterio
-import geopandas as gpd
-from planet import Session, data_filter,reporting
+import shapely
+from shapely import STRtree
+from shapely.geometry import Point, shape, mapping
+from planet import Session, data_filter,reporting, order_request
+from pathlib import Path
 import os
+import time
 import asyncio
+from email.utils import parsedate_to_datetime
 import pandas as pd
 import json
 from datetime import timedelta
@@ -14,19 +19,69 @@ import requests
 script_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.abspath(os.path.join(script_dir, '..'))
 sys.path.append(parent_dir)
-from Utils.database_utils import check_area_coverage, add_new_image
+from Utils.database_utils import find_covering_images, add_new_image
+from Utils.cog_utils import convert_to_cog, is_cog
+from Utils.downloader import download_file, is_verified, mark_verified
+from Utils.scene_catalog import get_scene_catalog
+from Utils.geometry_service import transform_points
 
-connection_params = {
-    'database': 'postgres',
-    'user': 'smurfs',
-    'password': 'smurfs123',  
-    'host': 'localhost',
-    'port': '5432'
-}
+# Concurrent activations/downloads per PlanetData instance (override with PLANET_MAX_CONCURRENCY)
+PLANET_MAX_CONCURRENCY = int(os.environ.get("PLANET_MAX_CONCURRENCY", 8))
+# Default download mode: "scene" (whole assets) or "clip" (AOI-clipped Orders API deliveries)
+PLANET_DOWNLOAD_MODE = os.environ.get("PLANET_DOWNLOAD_MODE", "scene")
+# Seconds between aggregate activation polls, and how long an asset may take to become active
+ASSET_POLL_INTERVAL = 5
+ASSET_ACTIVATION_TIMEOUT = 1800
+# Attempts per asset for activation requests (exponential backoff) and consecutive failed status polls
+ASSET_RETRIES = 3
+
+def parse_retry_after(value, default=5.0):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+class PlanetSession(Session):
+    """
+    Planet Session that honours Retry-After on HTTP 429. The SDK already retries 429s with
+    exponential backoff; here a 429 additionally pauses every request of the session until the
+    Retry-After time has passed, so concurrent tasks back off together instead of re-triggering
+    the limit.
+
+    Relies on planet SDK 3.x internals (Session._send and the httpx client's event hooks), so
+    the SDK is pinned to 3.7.x in requirements.txt; check this class when upgrading it.
+    """
+
+    def __init__(self, auth=None):
+        super().__init__(auth=auth)
+        self._resume_at = 0.0
+        self.rate_limited = 0
+        self._client.event_hooks['response'].insert(0, self._note_retry_after)
+
+    async def _note_retry_after(self, response):
+        if response.status_code == 429:
+            self.rate_limited += 1
+            delay = parse_retry_after(response.headers.get("Retry-After"))
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            print(f"Planet API rate limit hit, pausing requests for {delay:.1f}s")
+
+    async def _send(self, request, stream=False):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return await super()._send(request, stream=stream)
 
 class PlanetData():
     
-    def __init__(self,credentials,clear_percent_filter_value, date_range=None,cloud_cover_filter_value=0.1,item_types=None,limit=100,directory="output", interval = None):
+    def __init__(self,credentials,clear_percent_filter_value, date_range=None,cloud_cover_filter_value=0.1,item_types=None,limit=100,directory="output", interval = None, ingest_cog=True, max_concurrency=None, search_mode="consolidated",
+                 download_mode=None, orders_base_url=None, product_bundle="analytic_8b_sr_udm2", clip_bands=None, catalog=None):
 
         self.clear_percent_filter_value=clear_percent_filter_value
         self.cloud_cover_filter_value=cloud_cover_filter_value
@@ -36,12 +91,28 @@ class PlanetData():
         self.item_types=item_types
         self.limit=limit
         self.interval=interval
+        self.ingest_cog=ingest_cog
+        self.max_concurrency=max_concurrency or PLANET_MAX_CONCURRENCY
+        # "consolidated": one quick search over all date windows; "per_window": one saved search per window
+        self.search_mode=search_mode
+        # "scene": download whole assets; "clip": one Orders API order per AOI, clipped to the AOI
+        self.download_mode=download_mode or PLANET_DOWNLOAD_MODE
+        self.orders_base_url=orders_base_url  # e.g. a local stub server; None uses Planet's
+        self.product_bundle=product_bundle
+        # Optional band subset for clip orders, e.g. ['b2', 'b4', 'b6', 'b8']. The output then only
+        # has these bands (in this order), so band indexes used downstream must match
+        self.clip_bands=clip_bands
+        # Local scene catalog answering already-searched areas/dates (None: shared one, False: disabled)
+        self.catalog=get_scene_catalog() if catalog is None else (catalog or None)
         self.client=self.__get_client__()
+        # One pooled HTTP session per instance, opened on first use (see get_session/close)
+        self._session=None
+        self._slots=None
 
-    def __get_combined_filter__(self):
+    def __get_base_filters__(self, include_geometry=True):
         base_filters = []
 
-        if self.geom:
+        if self.geom and include_geometry:
             geom_filter = data_filter.geometry_filter(self.geom)
             base_filters.append(geom_filter)
 
@@ -55,6 +126,11 @@ class PlanetData():
         quality_filter = data_filter.string_in_filter('quality_category', ['standard'])
         base_filters.append(quality_filter)
 
+        return base_filters
+
+    def __get_combined_filter__(self):
+        base_filters = self.__get_base_filters__()
+
         # Use generate_date_ranges to get datetime objects for filters
         date_ranges = self.generate_date_ranges(self.date_range['gte'], self.date_range['lte'], self.interval)
 
@@ -68,6 +144,32 @@ class PlanetData():
         # print("combined filters", combined_filters)
 
         return combined_filters
+
+    def __get_consolidated_filter__(self):
+        # All date windows in one filter: overlapping/touching windows are merged (interval 1 becomes a
+        # single range), the rest are OR-ed together
+        windows = self.generate_date_ranges(self.date_range['gte'], self.date_range['lte'], self.interval)
+        date_ranges = self.merge_date_ranges(windows)
+        date_filters = [data_filter.date_range_filter("acquired", gte=date_range['gte'], lte=date_range['lte'])
+                        for date_range in date_ranges]
+        date_filter = date_filters[0] if len(date_filters) == 1 else data_filter.or_filter(date_filters)
+        # Number of windows before merging: per_window mode searches (and limits) each of them
+        return data_filter.and_filter([date_filter] + self.__get_base_filters__()), len(windows)
+
+    def __get_filter_key__(self):
+        # Identifies the non-spatial, non-temporal filters of __get_base_filters__ in the catalog
+        return json.dumps({'clear_percent': list(self.clear_percent_filter_value or []),
+                           'publishing_stage': ['finalized'], 'quality_category': ['standard']})
+
+    @staticmethod
+    def merge_date_ranges(date_ranges):
+        merged = []
+        for date_range in sorted(date_ranges, key=lambda window: window['gte']):
+            if merged and date_range['gte'] <= merged[-1]['lte']:
+                merged[-1]['lte'] = max(merged[-1]['lte'], date_range['lte'])
+            else:
+                merged.append(dict(date_range))
+        return merged
     
     def generate_date_ranges(self, start_date, end_date, interval):
         date_ranges = []
@@ -97,33 +199,59 @@ class PlanetData():
         client = Auth.from_key(API_KEY)
         return client
     
+    async def get_session(self):
+        # Long-lived session: its connection pool is reused by every search, activation and download
+        if self._session is None:
+            self._session = PlanetSession(auth=self.client)
+        return self._session
+
+    def __get_slots__(self):
+        # Bounds concurrent activations/downloads; created lazily inside the running event loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._slots
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.aclose()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
     async def __create_request__(self):
         combined_filter=self.__get_combined_filter__()
-        async with Session() as sess:
-            cl = sess.client('data')
-            request = await cl.create_search(name='planet_client_demo',search_filter=combined_filter, item_types=self.item_types)
+        sess = await self.get_session()
+        cl = sess.client('data')
+        request = await cl.create_search(name='planet_client_demo',search_filter=combined_filter, item_types=self.item_types)
         return request   
 
     async def search(self):
+        if self.search_mode == "consolidated":
+            return await self.search_consolidated()
+
         combined_filters = self.__get_combined_filter__()
         item_list_total = []
         new_item_list = []
         search_df_total = pd.DataFrame()
 
-        async with Session() as sess:
-            cl = sess.client('data')
-            for each_combined_filter in combined_filters:
-                # print("Current combined filter:", each_combined_filter)
-                request = await cl.create_search(name='planet_client_demo', search_filter=each_combined_filter, item_types=self.item_types)
-                items = cl.run_search(search_id=request['id'], limit=self.limit)
-                item_list = [i async for i in items]
-                if item_list:
-                    # changed item list total from _ to ensure 1 image per day
-                    item_list_total, search_df = self.filter_search_result(item_list, new_item_list)
-                    # item_list_total.extend(item_list)
-                    search_df_total = pd.concat([search_df_total, search_df], ignore_index=True)
-                else:
-                    print("No images found for the days given that satisfy the filters")
+        sess = await self.get_session()
+        cl = sess.client('data')
+        for each_combined_filter in combined_filters:
+            # print("Current combined filter:", each_combined_filter)
+            request = await cl.create_search(name='planet_client_demo', search_filter=each_combined_filter, item_types=self.item_types)
+            items = cl.run_search(search_id=request['id'], limit=self.limit)
+            item_list = [i async for i in items]
+            if item_list:
+                # changed item list total from _ to ensure 1 image per day
+                item_list_total, search_df = self.filter_search_result(item_list, new_item_list)
+                # item_list_total.extend(item_list)
+                search_df_total = pd.concat([search_df_total, search_df], ignore_index=True)
+            else:
+                print("No images found for the days given that satisfy the filters")
 
         if len(item_list_total) == 0:
             print("No images found for the days given that satisfy the filters base.")
@@ -131,20 +259,94 @@ class PlanetData():
 
         return item_list_total, search_df_total
     
-    async def activate_assets(self,item_id,item_type,asset_type_id):
+    async def search_items(self):
+        # One quick search (no saved search) over all date windows; result pages are streamed
+        search_filter, n_windows = self.__get_consolidated_filter__()
+        # self.limit applies to each date window in per_window mode; keep the same overall cap
+        limit = self.limit * n_windows if self.limit else 0
 
-        async with Session() as sess:
+        if self.catalog is not None and self.geom and self.item_types:
+            items = await self.search_catalog(limit)
+        else:
+            sess = await self.get_session()
             cl = sess.client('data')
-            # Get Asset
-            asset_desc = await cl.get_asset(item_type_id=item_type,item_id=item_id,asset_type_id=asset_type_id)
-            # Activate Asset
-            await cl.activate_asset(asset=asset_desc)
-            # Wait Asset
-            with reporting.StateBar(state='creating') as bar:
-                bar.update(state='created', order_id=item_id)
-                await cl.wait_asset(asset=asset_desc, callback=bar.update_state)
-
-            return asset_desc
+            items = [item async for item in cl.search(item_types=self.item_types, search_filter=search_filter, limit=limit)]
+        if limit and len(items) >= limit:
+            print(f"Search stopped at the limit of {limit} scenes ({self.limit} per date window); later results were dropped")
+        return items
+
+    async def search_items_per_window(self):
+        # One saved search per date window (search_mode="per_window"), items of all windows without
+        # the per-day selection; scenes found in several windows are kept once
+        sess = await self.get_session()
+        cl = sess.client('data')
+        items = {}
+        for each_combined_filter in self.__get_combined_filter__():
+            request = await cl.create_search(name='planet_client_demo', search_filter=each_combined_filter, item_types=self.item_types)
+            async for item in cl.run_search(search_id=request['id'], limit=self.limit):
+                items.setdefault(item['id'], item)
+        return list(items.values())
+
+    async def search_catalog(self, limit=0):
+        """
+        Consolidated search through the local scene catalog: only the (area, date) parts of the
+        query never searched with the same filters go to Planet, in one quick search. Its results are
+        stored and the parts recorded as searched (unless the result hit `limit`, i.e. may be
+        incomplete). The whole query is then answered from the catalog.
+        """
+        date_ranges = self.merge_date_ranges(
+            self.generate_date_ranges(self.date_range['gte'], self.date_range['lte'], self.interval))
+        filter_key = self.__get_filter_key__()
+        gaps = []
+        for date_range in date_ranges:
+            gaps += await asyncio.to_thread(self.catalog.gaps, self.geom, date_range['gte'], date_range['lte'],
+                                            self.item_types, filter_key)
+
+        if gaps:
+            gap_filters = [data_filter.and_filter([
+                data_filter.date_range_filter("acquired", gte=datetime.fromisoformat(gte), lte=datetime.fromisoformat(lte)),
+                data_filter.geometry_filter(mapping(geom))]) for geom, gte, lte in gaps]
+            gap_filter = gap_filters[0] if len(gap_filters) == 1 else data_filter.or_filter(gap_filters)
+            search_filter = data_filter.and_filter([gap_filter] + self.__get_base_filters__(include_geometry=False))
+
+            sess = await self.get_session()
+            cl = sess.client('data')
+            items = [item async for item in cl.search(item_types=self.item_types, search_filter=search_filter, limit=limit)]
+            await asyncio.to_thread(self.catalog.add_items, items)
+            if not limit or len(items) < limit:
+                await asyncio.to_thread(self.catalog.record_coverage, gaps, self.item_types, filter_key)
+            print(f"Catalog: searched {len(gaps)} uncovered windows on Planet ({len(items)} scenes)")
+        else:
+            print("Catalog: search answered locally")
+
+        return await asyncio.to_thread(self.catalog.query, self.geom, [(r['gte'], r['lte']) for r in date_ranges],
+                                       self.item_types, self.clear_percent_filter_value, limit=limit)
+
+    async def search_consolidated(self):
+        # Consolidated search, then one local best-scene-per-day selection over all items
+        item_list = await self.search_items()
+
+        if not item_list:
+            print("No images found for the days given that satisfy the filters base.")
+            sys.exit(1)
+
+        return self.filter_search_result(item_list)
+
+    async def activate_assets(self,item_id,item_type,asset_type_id):
+
+        sess = await self.get_session()
+        cl = sess.client('data')
+        # Get Asset
+        asset_desc = await cl.get_asset(item_type_id=item_type,item_id=item_id,asset_type_id=asset_type_id)
+        # Activate Asset
+        await cl.activate_asset(asset=asset_desc)
+        # Wait Asset
+        with reporting.StateBar(state='creating') as bar:
+            bar.update(state='created', order_id=item_id)
+            # wait_asset returns the refreshed description, which carries the download location
+            asset_desc = await cl.wait_asset(asset=asset_desc, callback=bar.update_state)
+
+        return asset_desc
     
     def filter_search_result(self,item_list, new_item_list=None):
         if new_item_list is None:
@@ -157,8 +359,9 @@ class PlanetData():
             all_properties.append(properties)
         search_df=pd.DataFrame(all_properties)
         # print(search_df)
+        # Least cloudy scene per acquisition day, in one vectorized sort + de-duplication
         search_df_filtered=search_df.sort_values('cloud_cover', ascending=True).drop_duplicates(['date'])
-        filtered_item_ids=search_df_filtered['id'].tolist()
+        filtered_item_ids=set(search_df_filtered['id'])
 
         for item in item_list:
             if item['id'] in filtered_item_ids:
@@ -166,57 +369,288 @@ class PlanetData():
         search_df_filtered['acquired']=pd.to_datetime(search_df_filtered['acquired'])  
         return new_item_list,search_df_filtered
 
+    async def ingest_asset(self, asset_path):
+        # Rewrite GeoTIFFs as tiled, compressed COGs with overviews; runs off the event loop
+        if self.ingest_cog and str(asset_path).lower().endswith((".tif", ".tiff")) \
+                and not await asyncio.to_thread(is_cog, asset_path):
+            await asyncio.to_thread(convert_to_cog, asset_path)
+            mark_verified(asset_path)  # keep the download record valid for the rewritten file
+            print(f"Converted {asset_path} to COG")
+
+    def asset_path(self, item_id, asset_type_id):
+        return os.path.join(self.directory, f"{item_id}_{asset_type_id}.tif")
+
+    async def fetch_asset(self, item_id, item_type, asset_type_id):
+        """
+        Activate and download one asset with the resumable, checksum-verified downloader
+        (Utils/downloader.py). A verified file from an earlier download is reused without activating.
+        """
+        asset_path = self.asset_path(item_id, asset_type_id)
+        if os.path.exists(asset_path) and is_verified(asset_path):
+            print(f"Asset {item_id} already downloaded to {asset_path}")
+            return asset_path
+        async with self.__get_slots__():
+            asset_desc = await self.activate_assets(item_id, item_type, asset_type_id)
+            await asyncio.to_thread(download_file, asset_desc['location'], asset_path,
+                                    md5=asset_desc.get('md5_digest'), auth=(self.credentials['API_KEY'], ''))
+        return asset_path
+
     async def download_asset(self, item_id=None, asset_type_id=None, item_type='PSScene', retries=3):
         attempt = 0
         while attempt < retries:
             try:
-                await self.activate_assets(item_id, item_type, asset_type_id)
-                async with Session() as sess:
-                    cl = sess.client('data')
-                    asset_desc = await cl.get_asset(item_type_id=item_type, item_id=item_id, asset_type_id=asset_type_id)
-                    asset_path = await cl.download_asset(asset=asset_desc, directory=self.directory, overwrite=True)
-                    print(f"Downloaded asset {item_id} to {asset_path}")
-                    return asset_path
+                asset_path = await self.fetch_asset(item_id, item_type, asset_type_id)
+                print(f"Downloaded asset {item_id} to {asset_path}")
+                await self.ingest_asset(asset_path)
+                return asset_path
             except Exception as e:
                 print(f"Failed to download asset {item_id}, attempt {attempt+1} of {retries}: {str(e)}")
                 attempt += 1
                 await asyncio.sleep(2**attempt)  # exponential backoff
         raise Exception(f"Failed to download asset {item_id} after {retries} attempts")
     
-    async def download_asset_w_dbcheck(self,item_id=None, asset_type_id=None, date=None, filter_df_name = None, item_type='PSScene', retries=3):
+    async def download_asset_w_dbcheck(self,item_id=None, asset_type_id=None, date=None, filter_df_name = None, item_type='PSScene', retries=3, polygon=None):
         attempt = 0
-        asset_path = check_area_coverage(polygon = self.geom, date = date, connection_params=connection_params )
+        # polygon: area the image must cover for the database check (defaults to the search geometry)
+        asset_path = (await find_covering_images([(polygon or self.geom, date)]))[0]
         if asset_path is not None:
             print("Getting file form Database")
             return asset_path
         else:
             while attempt < retries:
                     try:
-                        await self.activate_assets(item_id, item_type, asset_type_id)
-                        async with Session() as sess:
-
-                            print("getting file from planet, attempt =", attempt)
-                            cl = sess.client('data')
-                            asset_desc = await cl.get_asset(item_type_id=item_type, item_id=item_id, asset_type_id=asset_type_id)
-                            asset_path = await cl.download_asset(asset=asset_desc, directory=self.directory, overwrite=True)
-                            print(f"Downloaded asset {item_id} to {asset_path}")
-                            coordinates = extract_corner_coordinates(asset_path)
-                            
-                            add_new_image(
-                                tile_id = item_id, 
-                                acquisition_date = date, 
-                                coordinates=coordinates, 
-                                image_path = asset_path, 
-                                filter_df_name = filter_df_name, 
-                                connection_params=connection_params)                 
-                            
-                            return asset_path
+                        print("getting file from planet, attempt =", attempt)
+                        asset_path = await self.fetch_asset(item_id, item_type, asset_type_id)
+                        print(f"Downloaded asset {item_id} to {asset_path}")
+                        await self.ingest_asset(asset_path)
+                        coordinates = extract_corner_coordinates(asset_path)
+                        
+                        await add_new_image(
+                            tile_id = item_id, 
+                            acquisition_date = date, 
+                            coordinates=coordinates, 
+                            image_path = asset_path, 
+                            filter_df_name = filter_df_name)
+                        
+                        return asset_path
                     except Exception as e:
                         print(f"Failed to download asset {item_id}, attempt {attempt+1} of {retries}: {str(e)}")
                         attempt += 1
                         await asyncio.sleep(2**attempt)  # exponential backoff
             raise Exception(f"Failed to download asset {item_id} after {retries} attempts")
     
+    async def order_clipped_scenes(self, item_ids, aoi, item_type='PSScene', name=None):
+        """
+        Order scenes through the Orders API, clipped to `aoi` (and band-subset if clip_bands is set),
+        as one batched order. Only the AOI pixels are delivered.
+
+        Returns:
+        dict: {item_id: path of the delivered (COG-converted) GeoTIFF}; items without output are missing
+        """
+        tools = [order_request.clip_tool(aoi)]
+        if self.clip_bands:
+            tools.append(order_request.band_math_tool(*self.clip_bands))
+        request = order_request.build_request(
+            name=name or f"clip_{len(item_ids)}_scenes",
+            products=[order_request.product(list(item_ids), self.product_bundle, item_type)],
+            tools=tools)
+
+        sess = await self.get_session()
+        cl = sess.client('orders', base_url=self.orders_base_url)
+        async with self.__get_slots__():
+            order = await cl.create_order(request)
+            print(f"Created clip order {order['id']} for {len(item_ids)} scenes")
+            state = await cl.wait(order['id'])
+            if state not in ('success', 'partial'):
+                raise Exception(f"Clip order {order['id']} finished in state {state}")
+            order = await cl.get_order(order['id'])
+            # Same resumable, verified downloader as scene assets; files keep the order's layout
+            results = [result for result in order['_links'].get('results') or [] if result]
+            paths = await asyncio.gather(*(asyncio.to_thread(
+                download_file, result['location'], os.path.join(self.directory, result['name']))
+                for result in results))
+
+        delivered = {}
+        for path in map(Path, paths):
+            # Skip the UDM2 masks and metadata; scene files are named <item_id>_...
+            if path.suffix.lower() != '.tif' or 'udm' in path.name.lower():
+                continue
+            item_id = next((item_id for item_id in item_ids if path.name.startswith(item_id)), None)
+            if item_id is not None:
+                await self.ingest_asset(path)
+                delivered[item_id] = path
+        return delivered
+
+    async def download_scenes(self, scenes, asset_type_id=None, filter_df_name=None, item_type='PSScene'):
+        """
+        Get every scene, from the database when an image already covers its polygon on its date,
+        otherwise from Planet (whole assets through download_pipeline or, in clip mode, one clipped
+        order for all of them).
+
+        Parameters:
+        scenes (list): Dicts with 'id', 'date' (YYYYMMDD) and 'polygon' (area the image must cover)
+
+        Returns:
+        list: Path or Exception per scene, in input order
+        """
+        # One round trip for the database check of every scene
+        try:
+            results = await find_covering_images([(scene['polygon'], scene['date']) for scene in scenes])
+        except Exception as e:
+            print(f"Image coverage lookup failed, getting every scene from Planet: {e}")
+            results = [None] * len(scenes)
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        missing_ids = [scenes[i]['id'] for i in missing]
+        if self.download_mode == "clip":
+            try:
+                delivered = await self.order_clipped_scenes(missing_ids, self.geom, item_type,
+                                                            name=f"clip_{filter_df_name}")
+            except Exception as e:
+                print(f"Clip order failed: {e}")
+                delivered = {}
+        else:
+            delivered = dict(zip(missing_ids, await self.download_pipeline(missing_ids, asset_type_id, item_type)))
+
+        for i in missing:
+            scene = scenes[i]
+            asset_path = delivered.get(scene['id'])
+            if asset_path is None or isinstance(asset_path, Exception):
+                results[i] = asset_path or Exception(f"Scene {scene['id']} was not delivered by the clip order")
+                continue
+            await add_new_image(
+                tile_id = scene['id'],
+                acquisition_date = scene['date'],
+                coordinates=extract_corner_coordinates(asset_path),
+                image_path = asset_path,
+                filter_df_name = filter_df_name)
+            results[i] = asset_path
+        return results
+
+    async def download_pipeline(self, item_ids, asset_type_id, item_type='PSScene',
+                                poll_interval=ASSET_POLL_INTERVAL, activation_timeout=ASSET_ACTIVATION_TIMEOUT):
+        """
+        Activate, poll and download many assets as three overlapping stages:
+        1. Activation: every asset is looked up and activated up front (max_concurrency requests at a time)
+        2. Polling: one loop refreshes all still-activating assets every `poll_interval` seconds
+        3. Download: max_concurrency workers take ready assets from a bounded queue, download them
+           with the resumable downloader and convert them to COGs
+        Downloads of assets that are already active start while the others are still activating.
+        Assets with a verified file on disk are neither activated nor downloaded again.
+        Failures are handled per asset: activation requests are retried ASSET_RETRIES times with
+        exponential backoff, and an asset fails after ASSET_RETRIES failed status polls in a row,
+        without affecting the rest of the batch.
+
+        Returns:
+        list: Path or Exception per item id, in input order
+        """
+        item_ids = list(item_ids)
+        if not item_ids:
+            return []
+        sess = await self.get_session()
+        cl = sess.client('data')
+        slots = self.__get_slots__()
+        queue = asyncio.Queue(maxsize=self.max_concurrency)
+        pending = {}  # item_id -> asset description, while activating
+        poll_failures = {}  # item_id -> consecutive failed status polls
+        results = {}
+
+        async def activate(item_id):
+            asset_path = self.asset_path(item_id, asset_type_id)
+            if os.path.exists(asset_path) and is_verified(asset_path):
+                results[item_id] = asset_path
+                return
+            for attempt in range(ASSET_RETRIES):
+                try:
+                    async with slots:
+                        asset_desc = await cl.get_asset(item_type_id=item_type, item_id=item_id, asset_type_id=asset_type_id)
+                        await cl.activate_asset(asset=asset_desc)
+                    status = asset_desc['status']
+                    break
+                except Exception as e:
+                    print(f"Failed to activate asset {item_id}, attempt {attempt+1} of {ASSET_RETRIES}: {e}")
+                    if attempt + 1 == ASSET_RETRIES:
+                        results[item_id] = e
+                        return
+                    await asyncio.sleep(2**(attempt+1))  # exponential backoff
+            if status == 'active':
+                await queue.put((item_id, asset_desc))
+            else:
+                pending[item_id] = asset_desc
+
+        async def refresh(asset_desc):
+            async with slots:
+                response = await sess.request(method='GET', url=asset_desc['_links']['_self'])
+            return response.json()
+
+        async def poll(activations):
+            deadline = time.monotonic() + activation_timeout
+            while not (activations.done() and not pending):
+                if activations.done():
+                    await asyncio.sleep(poll_interval)
+                else:
+                    # Wakes up early once the last activation request is answered
+                    await asyncio.wait([activations], timeout=poll_interval)
+                polled = list(pending.items())
+                refreshed = await asyncio.gather(*(refresh(asset_desc) for _, asset_desc in polled),
+                                                 return_exceptions=True)
+                ready = 0
+                for (item_id, _), asset_desc in zip(polled, refreshed):
+                    try:
+                        if isinstance(asset_desc, Exception):
+                            raise asset_desc
+                        status = asset_desc['status']
+                    except Exception as e:
+                        # Polled again next round; the asset fails after ASSET_RETRIES failures in a row
+                        poll_failures[item_id] = poll_failures.get(item_id, 0) + 1
+                        print(f"Failed to poll asset {item_id}, attempt {poll_failures[item_id]} of {ASSET_RETRIES}: {e}")
+                        if poll_failures[item_id] >= ASSET_RETRIES:
+                            results[item_id] = e
+                            del pending[item_id]
+                        continue
+                    poll_failures.pop(item_id, None)
+                    if status == 'active':
+                        del pending[item_id]
+                        ready += 1
+                        await queue.put((item_id, asset_desc))
+                    else:
+                        pending[item_id] = asset_desc
+                if polled:
+                    print(f"Activation: {ready} of {len(polled)} polled assets ready, {len(pending)} still activating")
+                if time.monotonic() > deadline:
+                    for item_id in list(pending):
+                        results[item_id] = Exception(f"Asset {item_id} not active after {activation_timeout}s")
+                        del pending[item_id]
+
+        async def download_worker():
+            while (job := await queue.get()) is not None:
+                item_id, asset_desc = job
+                asset_path = self.asset_path(item_id, asset_type_id)
+                try:
+                    await asyncio.to_thread(download_file, asset_desc['location'], asset_path,
+                                            md5=asset_desc.get('md5_digest'), auth=(self.credentials['API_KEY'], ''))
+                    print(f"Downloaded asset {item_id} to {asset_path}")
+                    await self.ingest_asset(asset_path)
+                    results[item_id] = asset_path
+                except Exception as e:
+                    print(f"Failed to download asset {item_id}: {e}")
+                    results[item_id] = e
+
+        workers = [asyncio.create_task(download_worker()) for _ in range(min(self.max_concurrency, len(item_ids)))]
+        activations = asyncio.ensure_future(asyncio.gather(*(activate(item_id) for item_id in dict.fromkeys(item_ids))))
+        try:
+            await poll(activations)
+            await activations
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers + [activations]:
+                task.cancel()
+        return [results.get(item_id, Exception(f"Asset {item_id} was not downloaded")) for item_id in item_ids]
+
     async def download_multiple_assets(self, geom=None, asset_type_id=None, item_type='PSScene', id_list=None):
         self.geom = geom
         # print("self geom",self.geom)
@@ -233,14 +667,86 @@ class PlanetData():
             download_tasks = [self.download_asset(idx, asset_type_id) for idx in id_list]
             item_list = id_list'''
 
-        download_tasks = [self.download_asset_w_dbcheck(
-            item['id'], 
-            asset_type_id, 
-            item['properties']['date'], 
-            filter_df_name) for item in item_list]
+        scenes = [{'id': item['id'], 'date': item['properties']['date'], 'polygon': self.geom} for item in item_list]
 
-        results = await asyncio.gather(*download_tasks, return_exceptions=True)  # retry logic inside download_asset
+        # At most max_concurrency items activate/download at once; retry logic inside download_asset
+        results = await self.download_scenes(scenes, asset_type_id, filter_df_name, item_type)
         return results, item_list, search_df
+
+    async def download_for_plots(self, geoms, asset_type_id=None, item_type='PSScene'):
+        """
+        Search once for all plots and download every needed scene exactly once.
+
+        The search covers the union of the plot footprints (consolidated quick search, or one saved
+        search per date window with search_mode="per_window"). Scenes are then matched to the plots they
+        intersect with an STRtree, and each plot keeps its least cloudy scene per day, as a per-plot
+        search would. The selected scenes are downloaded (or found in the database) once, and the
+        paths are fanned back out to the plots.
+
+        Parameters:
+        geoms (list): GeoJSON geometries of the plots
+        asset_type_id (str): Asset to download, e.g. 'ortho_analytic_8b_sr'
+
+        Returns:
+        tuple: (list with, per plot, the downloaded paths in date order; selection DataFrame with one
+                row per plot/day and columns plot, id, date, cloud_cover, path)
+        """
+        plot_shapes = [shape(geom) for geom in geoms]
+        footprint = shapely.union_all(plot_shapes)
+        self.geom = mapping(footprint)
+        hull = mapping(footprint.convex_hull)
+        filter_df_name = extract_last_three_digits_string(hull)
+
+        if self.search_mode == "per_window":
+            item_list = await self.search_items_per_window()
+        else:
+            item_list = await self.search_items()
+        empty = pd.DataFrame(columns=['plot', 'id', 'date', 'cloud_cover', 'path'])
+        if not item_list:
+            print("No images found for the days given that satisfy the filters base.")
+            return [[] for _ in geoms], empty
+
+        # Scene -> plot matching with a spatial index over the scene footprints
+        tree = STRtree([shape(item['geometry']) for item in item_list])
+        plot_idx, item_idx = tree.query(plot_shapes, predicate='intersects')
+        candidates = pd.DataFrame({
+            'plot': plot_idx,
+            'item': item_idx,
+            'id': [item_list[i]['id'] for i in item_idx],
+            'date': [item_list[i]['id'].split("_")[0] for i in item_idx],
+            'cloud_cover': [item_list[i]['properties'].get('cloud_cover') for i in item_idx],
+        })
+        # Least cloudy scene per plot and day, like the per-plot search + filter_search_result
+        selection = candidates.sort_values('cloud_cover', kind='stable').drop_duplicates(['plot', 'date'])
+        selection = selection.sort_values(['plot', 'date']).reset_index(drop=True)
+
+        os.makedirs("planet_csv", exist_ok=True)
+        csv_file_path = os.path.join("planet_csv", f"{filter_df_name}_filter_df.csv")
+        search_df = pd.DataFrame([dict(item['properties'], id=item['id']) for item in item_list])
+        search_df[search_df['id'].isin(set(selection['id']))].to_csv(csv_file_path, index=False)
+        print(f"DataFrame saved to {csv_file_path}")
+
+        # One download per scene; the database check uses the hull of the plots needing that scene
+        scenes = selection.groupby('item', sort=False)['plot'].agg(list)
+        scene_requests = [{
+            'id': item_list[item]['id'],
+            'date': item_list[item]['id'].split("_")[0],
+            'polygon': mapping(shapely.union_all([plot_shapes[plot] for plot in plots]).convex_hull),
+        } for item, plots in scenes.items()]
+        print(f"{len(scene_requests)} scenes for {len(geoms)} plots ({len(selection)} plot/day pairs)")
+        results = await self.download_scenes(scene_requests, asset_type_id, filter_df_name, item_type)
+
+        paths = {item: result for item, result in zip(scenes.index, results)}
+        selection['path'] = [None if isinstance(paths[item], Exception) else paths[item] for item in selection['item']]
+        for item, result in paths.items():
+            if isinstance(result, Exception):
+                print(f"Failed to get scene {item_list[item]['id']}: {result}")
+
+        plot_paths = [[] for _ in geoms]
+        for plot, path in zip(selection['plot'], selection['path']):
+            if path is not None:
+                plot_paths[plot].append(path)
+        return plot_paths, selection.drop(columns='item')
     
     
 def read_geojson(file_path):
@@ -290,23 +796,20 @@ def extract_corner_coordinates(tif_file):
         bottom_left = (transform[2], transform[5] + num_rows * transform[4])
         bottom_right = (transform[2] + num_cols * transform[0], transform[5] + num_rows * transform[4])
 
-        # Create a GeoDataFrame with corner coordinates
-        corner_df = gpd.GeoDataFrame(geometry=gpd.points_from_xy(
+        # Reproject the four corners to lat/lon with the cached transformer
+        lons, lats = transform_points(
             [top_left[0], top_right[0], bottom_left[0], bottom_right[0]],
-            [top_left[1], top_right[1], bottom_left[1], bottom_right[1]]
-        ))
+            [top_left[1], top_right[1], bottom_left[1], bottom_right[1]],
+            "EPSG:4326", src.crs
+        )
+        corners = [Point(lon, lat) for lon, lat in zip(lons, lats)]
 
-        # Set the CRS of the GeoDataFrame
-        corner_df.crs = f'EPSG:{epsg_code}'
-        corner_df = corner_df.to_crs(epsg=4326)
-        # print("corner cordinates",corner_df)
-        
         return {
             "epsg_code": epsg_code,
-            "top_left": corner_df.geometry.iloc[0],
-            "top_right": corner_df.geometry.iloc[1],
-            "bottom_left": corner_df.geometry.iloc[2],
-            "bottom_right": corner_df.geometry.iloc[3]
+            "top_left": corners[0],
+            "top_right": corners[1],
+            "bottom_left": corners[2],
+            "bottom_right": corners[3]
         }
     
 def get_sugarcane_stage(date_of_planting, forecast_time):
@@ -0,0 +1,207 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.coords import BoundingBox
+from rasterio.windows import Window, transform as window_transform_of
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+BAND_CACHE_DIR = os.path.join(os.path.dirname(script_dir), 'Data', 'band_cache')
+
+# Opt-in: decoding a scene into the cache costs one full read and its uncompressed size on disk,
+# which pays off for scenes read repeatedly (several farms, previews, calculators)
+BAND_CACHE_ENABLED = os.environ.get("BAND_CACHE", "0").lower() in ("1", "true", "yes")
+BAND_CACHE_MAX_BYTES = int(os.environ.get("BAND_CACHE_MAX_BYTES", 0)) or 16 * 1024 * 1024 * 1024
+
+_band_cache = None
+
+class CachedRaster:
+    """
+    Read-only stand-in for an open rasterio dataset, backed by a memory-mapped (bands, rows, cols)
+    .npy file. Supports the subset of the dataset API used here and by rasterio.mask.mask: read()
+    with indexes/window/masked/out_dtype, window_transform() and the georeferencing attributes.
+    Pages are shared through the OS page cache by every process mapping the same file.
+    """
+
+    def __init__(self, npy_path, meta):
+        self.name = meta["source"]
+        self._bands = np.load(npy_path, mmap_mode="r")
+        self.count, self.height, self.width = self._bands.shape
+        self.shape = (self.height, self.width)
+        self.dtypes = (meta["dtype"],) * self.count
+        self.crs = CRS.from_wkt(meta["crs"]) if meta["crs"] else None
+        self.transform = Affine(*meta["transform"])
+        self.nodata = meta["nodata"]
+        self.descriptions = tuple(meta["descriptions"])
+        self.res = (abs(self.transform.a), abs(self.transform.e))
+        left, top = self.transform * (0, 0)
+        right, bottom = self.transform * (self.width, self.height)
+        self.bounds = BoundingBox(min(left, right), min(top, bottom), max(left, right), max(top, bottom))
+        self.profile = {"driver": "NPY", "count": self.count, "width": self.width, "height": self.height,
+                        "dtype": meta["dtype"], "crs": self.crs, "transform": self.transform,
+                        "nodata": self.nodata}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # Dropping the reference unmaps the file once no returned view uses it anymore
+        self._bands = None
+
+    def window_transform(self, window):
+        return window_transform_of(window, self.transform)
+
+    def read(self, indexes=None, window=None, masked=False, out_dtype=None, out_shape=None, **kwargs):
+        """
+        Same semantics as DatasetReader.read for in-bounds windows. Without masked/out_dtype, a
+        single band is returned as a read-only view of the mapped file (no copy).
+        """
+        rows, cols = slice(None), slice(None)
+        if window is not None:
+            if not isinstance(window, Window):
+                window = Window.from_slices(*window)
+            (row_start, row_stop), (col_start, col_stop) = window.round_offsets().round_lengths().toranges()
+            rows = slice(max(0, row_start), min(self.height, row_stop))
+            cols = slice(max(0, col_start), min(self.width, col_stop))
+
+        if indexes is None:
+            data = self._bands[:, rows, cols]
+        elif isinstance(indexes, int):
+            data = self._bands[indexes - 1, rows, cols]
+        else:
+            data = self._bands[[index - 1 for index in indexes], rows, cols]
+
+        if out_shape is not None and tuple(out_shape)[-2:] != data.shape[-2:]:
+            raise ValueError("CachedRaster does not resample; read the source file for decimated reads")
+        if out_dtype is not None and np.dtype(out_dtype) != data.dtype:
+            data = data.astype(out_dtype)
+        if masked:
+            if self.nodata is None:
+                nodata_mask = np.zeros(data.shape, dtype=bool)
+            elif np.isnan(self.nodata):
+                nodata_mask = np.isnan(data)
+            else:
+                nodata_mask = data == self.nodata
+            # Masked reads are writable copies, like rasterio's (callers normalize them in place)
+            data = np.ma.MaskedArray(data if data.flags.writeable else np.array(data), mask=nodata_mask)
+        return data
+
+class BandCache:
+    """
+    Decoded band cache: each scene is decompressed once into Data/band_cache/<stem>-<key>.npy
+    (all bands, native dtype, band-sequential) plus a JSON sidecar with its georeferencing.
+    Entries are keyed by the source path, size and mtime, so re-downloaded scenes get new entries.
+    The least recently opened entries are evicted beyond `max_bytes`.
+    """
+
+    def __init__(self, directory=BAND_CACHE_DIR, max_bytes=BAND_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_base(self, tif_file):
+        stat = os.stat(tif_file)
+        identity = f"{os.path.abspath(tif_file)}|{stat.st_size}|{stat.st_mtime_ns}"
+        key = hashlib.sha1(identity.encode()).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(tif_file))[0]
+        return os.path.join(self.directory, f"{stem}-{key}")
+
+    def open(self, tif_file):
+        """Map the cached bands of `tif_file`, decoding the scene first if it is not cached yet."""
+        base = self.entry_base(tif_file)
+        npy_path, meta_path = base + ".npy", base + ".json"
+        if not os.path.exists(meta_path):
+            self._build(tif_file, npy_path, meta_path)
+        os.utime(meta_path)  # LRU position
+        with open(meta_path) as f:
+            meta = json.load(f)
+        return CachedRaster(npy_path, meta)
+
+    def _build(self, tif_file, npy_path, meta_path):
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with rasterio.open(tif_file) as src:
+            size = src.count * src.height * src.width * np.dtype(src.dtypes[0]).itemsize
+            if size > self.max_bytes:
+                raise ValueError(f"{tif_file} ({size} bytes decoded) exceeds the band cache budget")
+            self._evict(size)
+
+            # Decode block by block straight into the mapped file, so memory use stays bounded
+            bands = np.lib.format.open_memmap(npy_path + suffix, mode="w+", dtype=src.dtypes[0],
+                                              shape=(src.count, src.height, src.width))
+            for _, window in src.block_windows(1):
+                (row_start, row_stop), (col_start, col_stop) = window.toranges()
+                bands[:, row_start:row_stop, col_start:col_stop] = src.read(window=window)
+            bands.flush()
+            del bands
+
+            meta = {
+                "source": os.path.abspath(tif_file),
+                "dtype": src.dtypes[0],
+                "crs": src.crs.to_wkt() if src.crs else None,
+                "transform": list(src.transform)[:6],
+                "nodata": src.nodata,
+                "descriptions": [description or "" for description in src.descriptions],
+            }
+
+        # The sidecar is written last: its presence marks a complete entry
+        os.replace(npy_path + suffix, npy_path)
+        with open(meta_path + suffix, "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + suffix, meta_path)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                base = os.path.join(self.directory, name[:-len(".json")])
+                try:
+                    entries.append((base, os.path.getsize(base + ".npy"), os.path.getmtime(base + ".json")))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    def _evict(self, incoming=0):
+        # Least recently opened first. Processes still mapping an evicted file keep reading it:
+        # the data is only released once the last mapping is closed.
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries) + incoming
+            for base, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                for path in (base + ".json", base + ".npy"):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+
+    def stats(self):
+        entries = self._entries()
+        return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries), "budget_bytes": self.max_bytes}
+
+def get_band_cache():
+    global _band_cache
+    if _band_cache is None:
+        _band_cache = BandCache()
+    return _band_cache
+
+def open_raster(tif_file, use_cache=None):
+    """
+    Open a scene for reading: from the decoded band cache when it is enabled (BAND_CACHE=1 or
+    use_cache=True), otherwise, or if caching fails, with rasterio.open. Use as a context manager.
+    """
+    if BAND_CACHE_ENABLED if use_cache is None else use_cache:
+        try:
+            return get_band_cache().open(tif_file)
+        except Exception as e:
+            print(f"Band cache unavailable for {tif_file}, reading the GeoTIFF: {e}")
+    return rasterio.open(tif_file)
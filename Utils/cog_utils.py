@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import rasterio
+import rasterio.shutil
+from affine import Affine
+from rasterio.enums import Resampling
+
+# Layout used for every downloaded scene
+COG_BLOCKSIZE = 512
+COG_COMPRESS = "DEFLATE"
+
+def is_cog(tif_file):
+    """True if the GeoTIFF is internally tiled and already carries an overview pyramid."""
+    with rasterio.open(tif_file) as src:
+        tiled = src.profile.get("tiled", False)
+        has_overviews = bool(src.overviews(1)) or max(src.width, src.height) <= COG_BLOCKSIZE
+        return tiled and has_overviews
+
+def convert_to_cog(tif_file, dst_path=None, overview_resampling="average", blocksize=COG_BLOCKSIZE,
+                   compress=COG_COMPRESS):
+    """
+    Rewrite a GeoTIFF as a Cloud-Optimized GeoTIFF: internally tiled, compressed and with an
+    overview pyramid.
+
+    The COG is written to a temporary file in the destination directory and moved into place
+    with os.replace, so readers only ever see the old file or the complete new one.
+
+    Parameters:
+    tif_file (str): GeoTIFF to convert
+    dst_path (str): Output path (defaults to rewriting `tif_file` in place)
+    overview_resampling (str): 'average' for reflectance, 'nearest' for categorical layers (SCL)
+    blocksize (int): Internal tile size in pixels
+    compress (str): GDAL compression codec
+
+    Returns:
+    str: Path of the COG
+    """
+    dst_path = str(dst_path or tif_file)
+    tmp_path = f"{dst_path}.{os.getpid()}.cog.tmp"
+
+    try:
+        with rasterio.open(tif_file) as src:
+            # Horizontal differencing for integers, floating point predictor for floats
+            predictor = 3 if np.issubdtype(np.dtype(src.dtypes[0]), np.floating) else 2
+            rasterio.shutil.copy(
+                src,
+                tmp_path,
+                driver="COG",
+                BLOCKSIZE=blocksize,
+                COMPRESS=compress,
+                PREDICTOR=predictor,
+                OVERVIEWS="AUTO",
+                RESAMPLING=overview_resampling.upper(),
+                BIGTIFF="IF_SAFER",
+                NUM_THREADS="ALL_CPUS",
+            )
+        os.replace(tmp_path, dst_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return dst_path
+
+def ensure_cog(tif_file, overview_resampling="average"):
+    """Convert to COG in place unless the file already is one. Returns the path."""
+    if not is_cog(tif_file):
+        convert_to_cog(tif_file, overview_resampling=overview_resampling)
+    return str(tif_file)
+
+def decimated_shape(src, max_size):
+    """(rows, cols) no larger than max_size on the long side, keeping the aspect ratio."""
+    factor = max(src.width, src.height) / float(max_size)
+    if factor <= 1:
+        return src.height, src.width
+    return max(1, int(round(src.height / factor))), max(1, int(round(src.width / factor)))
+
+def read_decimated(src, indexes=None, max_size=1024, masked=True, out_dtype=None,
+                   resampling=Resampling.nearest):
+    """
+    Read a decimated version of an open dataset, at most max_size pixels on the long side.
+
+    For COGs GDAL serves the read from the closest overview level, so previews and
+    village-level statistics never decode the full-resolution raster.
+
+    Returns:
+    tuple: (array, transform of the decimated grid)
+    """
+    rows, cols = decimated_shape(src, max_size)
+    count = src.count if indexes is None else (len(indexes) if isinstance(indexes, (list, tuple)) else None)
+    out_shape = (rows, cols) if count is None else (count, rows, cols)
+    data = src.read(indexes, out_shape=out_shape, masked=masked, out_dtype=out_dtype, resampling=resampling)
+    transform = src.transform * Affine.scale(src.width / cols, src.height / rows)
+    return data, transform
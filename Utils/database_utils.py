@@ -1,59 +1,70 @@
-import psycopg2
+import json
+from datetime import datetime
 from geojson import Polygon
+from Utils.db_pool import acquire
 
-def check_area_coverage(polygon, date, connection_params):
-    date = '-'.join([date[:4], date[4:6], date[6:]])
-
-    # Convert GeoJSON to WKT (Well-Known Text)
-    wkt = f"POLYGON(({', '.join([' '.join(map(str, coord)) for coord in polygon['coordinates'][0]])}))"
-
-    # Connect to the database
-    conn = psycopg2.connect(**connection_params)
-    cur = conn.cursor()
-    
-    # SQL query to check for existence of the data and get the image path
-    try:
-        cur.execute("SELECT image_path FROM satellite_images WHERE ST_Intersects(geometry, ST_GeomFromText(%s, 4326)) AND acquisition_date = %s",(wkt, date))
-        result = cur.fetchone()
-    except Exception as e:
-        print("Error:", e)
-        result = [None]
-
-    print("\nresult from query:", result)
-    cur.close()
-    conn.close()
-    return result[0] if result else None
-
-def add_new_image(tile_id, acquisition_date, coordinates, image_path, filter_df_name, connection_params):
-    # Convert date string from 'YYYYMMDD' to a date object
-    acquisition_date = '-'.join([acquisition_date[:4], acquisition_date[4:6], acquisition_date[6:]])
-
-    # Convert GeoJSON to WKT (Well-Known Text)
-    wkt_geometry = f"POLYGON((\
-        {coordinates['top_left'].x} {coordinates['top_left'].y}, \
-        {coordinates['top_right'].x} {coordinates['top_right'].y}, \
-        {coordinates['bottom_right'].x} {coordinates['bottom_right'].y}, \
-        {coordinates['bottom_left'].x} {coordinates['bottom_left'].y}, \
-        {coordinates['top_left'].x} {coordinates['top_left'].y}\
-    ))"
-
-    image_path = str(image_path)
-    print("Image Path:", image_path)
-    print("Image Path Type", type(image_path))
-    print("Polygon",wkt_geometry)
-
-    # Connect to the database
-    conn = psycopg2.connect(**connection_params)
-    cur = conn.cursor()
-    
-    # SQL command to insert new data
-    cur.execute(
-        "INSERT INTO satellite_images (tile_id, acquisition_date, geometry, image_path, filter_df_name) VALUES (%s, %s, ST_GeomFromText(%s, 4326), %s, %s)",
-        (tile_id, acquisition_date, wkt_geometry, image_path, filter_df_name))
-    
-    # Commit changes
-    conn.commit()
-    
-    # Close the database connection
-    cur.close()
-    conn.close()
\ No newline at end of file
+# One row per (polygon, date) request: unnest keeps them in order (WITH ORDINALITY) and the LATERAL
+# subquery picks the best image per request through the GiST index on satellite_images.geometry
+# (migrations/001_satellite_images_indexes.sql): images covering the whole polygon first, then the
+# largest overlap
+COVERAGE_QUERY = """
+    SELECT q.ord, best.image_path
+    FROM unnest($1::text[], $2::date[]) WITH ORDINALITY AS q(geojson, acquisition_date, ord)
+    CROSS JOIN LATERAL (SELECT ST_SetSRID(ST_GeomFromGeoJSON(q.geojson), 4326) AS geom) g
+    LEFT JOIN LATERAL (
+        SELECT s.image_path
+        FROM satellite_images s
+        WHERE s.acquisition_date = q.acquisition_date
+          AND ST_Intersects(s.geometry, g.geom)
+        ORDER BY ST_Covers(s.geometry, g.geom) DESC, ST_Area(ST_Intersection(s.geometry, g.geom)) DESC
+        LIMIT 1
+    ) best ON true
+    ORDER BY q.ord
+"""
+
+INSERT_IMAGE_QUERY = """
+    INSERT INTO satellite_images (tile_id, acquisition_date, geometry, image_path, filter_df_name)
+    VALUES ($1, $2, ST_GeomFromText($3, 4326), $4, $5)
+"""
+
+async def add_new_image(tile_id, acquisition_date, coordinates, image_path, filter_df_name):
+    """
+    Register a downloaded image in satellite_images, on a pooled connection of the 'imagery' database.
+
+    Parameters:
+    tile_id (str): Planet item id
+    acquisition_date (str): Acquisition date as 'YYYYMMDD'
+    coordinates (dict): Corner points (see extract_corner_coordinates)
+    image_path (str): Local path of the GeoTIFF
+    filter_df_name (str): Name of the search's filter CSV
+    """
+    corners = [coordinates[corner] for corner in ('top_left', 'top_right', 'bottom_right', 'bottom_left', 'top_left')]
+    wkt_geometry = f"POLYGON(({', '.join(f'{point.x} {point.y}' for point in corners)}))"
+
+    async with acquire("imagery") as conn:
+        await conn.execute(INSERT_IMAGE_QUERY, tile_id, datetime.strptime(acquisition_date, "%Y%m%d").date(),
+                           wkt_geometry, str(image_path), filter_df_name)
+
+async def find_covering_images(requests):
+    """
+    Find already downloaded images for many (polygon, date) pairs in a single query, on a pooled
+    connection of the 'imagery' database.
+
+    Parameters:
+    requests (list): (GeoJSON geometry or Feature, date as 'YYYYMMDD') pairs
+
+    Returns:
+    list: Best cached image path per pair (None if no image intersects it), in input order
+    """
+    if not requests:
+        return []
+    geometries, dates = [], []
+    for polygon, date in requests:
+        if polygon.get('type') == 'Feature':
+            polygon = polygon['geometry']
+        geometries.append(json.dumps(polygon))
+        dates.append(datetime.strptime(date, "%Y%m%d").date())
+
+    async with acquire("imagery") as conn:
+        rows = await conn.fetch(COVERAGE_QUERY, geometries, dates)
+    return [row['image_path'] for row in rows]
@@ -0,0 +1,112 @@
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+import asyncpg
+
+# Shared connection settings; each named pool picks its database
+DB_HOST = os.environ.get("DB_HOST", "localhost")
+DB_PORT = os.environ.get("DB_PORT", "5432")
+DB_USER = os.environ.get("DB_USER", "smurfs")
+DB_PASSWORD = os.environ.get("DB_PASSWORD", "smurfs123")
+
+DATABASES = {
+    "smurf": os.environ.get("DB_NAME", "smurf"),              # villages, farms, officers
+    "imagery": os.environ.get("IMAGERY_DB_NAME", "postgres"),  # downloaded image coverage (database_utils)
+}
+
+# Pool sizing: connections kept open, upper bound, and how long a request may wait for one
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", 30))
+# Prepared statements cached per connection (asyncpg's statement cache)
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 256))
+
+_pools = {}
+_creating = {}
+_metrics = {}
+
+def _new_metrics():
+    return {"acquisitions": 0, "timeouts": 0, "in_use": 0, "peak_in_use": 0,
+            "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+async def _create_pool(name):
+    return await asyncpg.create_pool(
+        user=DB_USER, password=DB_PASSWORD, database=DATABASES[name], host=DB_HOST, port=DB_PORT,
+        min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, statement_cache_size=DB_STATEMENT_CACHE_SIZE)
+
+async def get_pool(name="smurf"):
+    """
+    Named asyncpg pool, created on first use (concurrent first users share one creation). Pools
+    belong to the event loop that created them, so a pool left over from an earlier asyncio.run()
+    (cron scripts) is replaced.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _pools.get(name)
+    if entry is not None and entry[1] is loop:
+        return entry[0]
+
+    creating = _creating.get(name)
+    if creating is None or creating[1] is not loop:
+        creating = _creating[name] = (loop.create_task(_create_pool(name)), loop)
+    try:
+        pool = await creating[0]
+    finally:
+        if _creating.get(name) is creating:
+            del _creating[name]
+    if name not in _pools or _pools[name][1] is not loop:
+        _pools[name] = (pool, loop)
+        _metrics.setdefault(name, _new_metrics())
+    return pool
+
+@asynccontextmanager
+async def acquire(name="smurf"):
+    """Connection from the named pool, recording how long the request waited for it."""
+    pool = await get_pool(name)
+    metrics = _metrics[name]
+    start = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics["timeouts"] += 1
+        raise
+    waited = time.perf_counter() - start
+    metrics["acquisitions"] += 1
+    metrics["wait_seconds_total"] += waited
+    metrics["wait_seconds_max"] = max(metrics["wait_seconds_max"], waited)
+    metrics["in_use"] += 1
+    metrics["peak_in_use"] = max(metrics["peak_in_use"], metrics["in_use"])
+    try:
+        yield conn
+    finally:
+        metrics["in_use"] -= 1
+        await pool.release(conn)
+
+async def init_pools(*names):
+    """Open the named pools (all by default), e.g. at application startup."""
+    for name in names or DATABASES:
+        await get_pool(name)
+
+async def close_pools():
+    for name, (pool, loop) in list(_pools.items()):
+        if loop is asyncio.get_running_loop():
+            await pool.close()
+        del _pools[name]
+
+def pool_stats():
+    """Size, utilisation and acquire wait times of every open pool."""
+    stats = {}
+    for name, (pool, _) in _pools.items():
+        metrics = _metrics[name]
+        acquisitions = metrics["acquisitions"]
+        stats[name] = {
+            **metrics,
+            "size": pool.get_size(),
+            "idle": pool.get_idle_size(),
+            "min_size": pool.get_min_size(),
+            "max_size": pool.get_max_size(),
+            "utilisation": metrics["in_use"] / pool.get_max_size(),
+            "wait_ms_avg": 1000 * metrics["wait_seconds_total"] / acquisitions if acquisitions else None,
+            "wait_ms_max": 1000 * metrics["wait_seconds_max"],
+        }
+    return stats
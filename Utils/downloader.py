@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Streamed chunk size, retries on connection errors/5xx and per-request timeout (connect, read)
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", 5))
+DOWNLOAD_TIMEOUT = (10, 120)
+
+_local = threading.local()
+
+class DownloadError(Exception):
+    """The downloaded bytes do not match the expected size or checksum."""
+
+def get_http_session():
+    """Pooled requests.Session, one per thread (sessions are not thread-safe)."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+    return session
+
+def _sidecar_path(path):
+    return f"{path}.download.json"
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def is_verified(path, expected_size=None, md5=None):
+    """
+    True if `path` is a completed download: its sidecar exists, the file was not changed since it
+    was recorded, and the recorded size/checksum of the downloaded bytes match the expected ones.
+    """
+    try:
+        with open(_sidecar_path(path)) as f:
+            record = json.load(f)
+        if record["file"] != _file_stamp(path):
+            return False
+    except (FileNotFoundError, ValueError, KeyError):
+        return False
+    if expected_size is not None and record["bytes"] != expected_size:
+        return False
+    if md5 is not None and record["md5"] != md5:
+        return False
+    return True
+
+def mark_verified(path, nbytes=None, md5=None):
+    """
+    Record `path` as a completed download. Call again after rewriting the file in place (e.g. COG
+    conversion) so the record keeps matching it; the size/checksum of the original bytes are kept.
+    """
+    sidecar = _sidecar_path(path)
+    record = {"bytes": nbytes, "md5": md5}
+    if nbytes is None and md5 is None and os.path.exists(sidecar):
+        with open(sidecar) as f:
+            record = json.load(f)
+    record["file"] = _file_stamp(path)
+    tmp_path = f"{sidecar}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, sidecar)
+
+def _total_size(response, offset):
+    # "Content-Range: bytes 100-199/200" on partial responses, Content-Length otherwise
+    content_range = response.headers.get("Content-Range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    return int(length) + offset if length is not None else None
+
+def download_file(url, path, expected_size=None, md5=None, session=None, headers=None, auth=None,
+                  retries=DOWNLOAD_RETRIES, chunk_size=DOWNLOAD_CHUNK_SIZE, timeout=DOWNLOAD_TIMEOUT):
+    """
+    Download `url` to `path`, resumably and verified.
+
+    Bytes are streamed to `<path>.part`. After a dropped connection the download resumes from the
+    end of the part file with an HTTP Range request (starting over if the server ignores it).
+    The result is checked against `expected_size`/`md5` and against the size announced by the
+    server, and only then renamed to `path`, so a truncated file never appears under its final
+    name. A path already recorded as a verified download (see is_verified) is not downloaded again.
+
+    Parameters:
+    url (str): Source URL
+    path (str): Destination file
+    expected_size (int): Expected size in bytes, if known
+    md5 (str): Expected MD5 hex digest, if known (e.g. Planet's md5_digest)
+    session (requests.Session): Session to use (defaults to a pooled per-thread session)
+    headers (dict), auth: Extra request headers and requests auth
+    retries (int): Attempts on connection errors, 5xx responses and incomplete transfers
+
+    Returns:
+    str: `path`
+    """
+    path = str(path)
+    if os.path.exists(path) and is_verified(path, expected_size, md5):
+        return path
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    session = session or get_http_session()
+    part_path = f"{path}.part"
+    last_error = None
+
+    for attempt in range(retries):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers or {})
+        if offset:
+            request_headers["Range"] = f"bytes={offset}-"
+        try:
+            with session.get(url, headers=request_headers, auth=auth, stream=True, timeout=timeout) as response:
+                if response.status_code == 416 and offset:
+                    # The part file already holds every byte (or is longer than the resource)
+                    total = _total_size(response, 0)
+                    if total is None or total != offset:
+                        os.remove(part_path)
+                        raise requests.ConnectionError(f"Part file of {path} does not match the remote size")
+                elif response.status_code >= 500:
+                    raise requests.ConnectionError(f"Server error {response.status_code} for {url}")
+                else:
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        offset = 0  # Range not honoured: the body is the whole file
+                    total = _total_size(response, offset)
+                    with open(part_path, "ab" if offset else "wb") as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+
+            size = os.path.getsize(part_path)
+            if total is not None and size < total:
+                raise requests.ConnectionError(f"Incomplete download of {url}: {size} of {total} bytes")
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            last_error = e
+            print(f"Download of {url} interrupted, attempt {attempt+1} of {retries}: {e}")
+            time.sleep(min(2**attempt, 30))
+    else:
+        raise DownloadError(f"Failed to download {url} after {retries} attempts: {last_error}")
+
+    digest = hashlib.md5()
+    with open(part_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    size = os.path.getsize(part_path)
+    problems = []
+    if total is not None and size != total:
+        problems.append(f"{size} bytes instead of the announced {total}")
+    if expected_size is not None and size != expected_size:
+        problems.append(f"{size} bytes instead of the expected {expected_size}")
+    if md5 is not None and digest.hexdigest() != md5.lower():
+        problems.append(f"MD5 {digest.hexdigest()} instead of {md5}")
+    if problems:
+        # A corrupt part file cannot be resumed; the next call starts over
+        os.remove(part_path)
+        raise DownloadError(f"Download of {url} failed verification: {'; '.join(problems)}")
+
+    os.replace(part_path, path)
+    mark_verified(path, size, digest.hexdigest())
+    return path
@@ -0,0 +1,118 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from pyproj import CRS, Transformer
+
+# Reprojected farm geometries kept in memory: one entry per (farm, geometry version, CRS)
+FARM_GEOMETRY_CACHE_SIZE = 100_000
+
+# pyproj Transformers are not thread-safe, so every thread keeps its own
+_local = threading.local()
+_farm_geometries = OrderedDict()
+_farm_lock = threading.Lock()
+
+def crs_key(crs):
+    """Hashable, normalized form of a CRS given as 'EPSG:xxxx', an EPSG int, a pyproj or a rasterio CRS."""
+    if isinstance(crs, str):
+        return crs.upper() if crs.upper().startswith("EPSG:") else crs
+    if isinstance(crs, int):
+        return f"EPSG:{crs}"
+    epsg = crs.to_epsg()
+    return f"EPSG:{epsg}" if epsg else crs.to_wkt()
+
+def get_transformer(src_crs, dst_crs):
+    """Cached always_xy Transformer for a CRS pair (built once per pair and thread)."""
+    transformers = getattr(_local, "transformers", None)
+    if transformers is None:
+        transformers = _local.transformers = {}
+    key = (crs_key(src_crs), crs_key(dst_crs))
+    if key not in transformers:
+        transformers[key] = Transformer.from_crs(CRS.from_user_input(key[0]), CRS.from_user_input(key[1]),
+                                                 always_xy=True)
+    return transformers[key]
+
+def to_shapely(geoms):
+    """Object array of shapely geometries from GeoJSON dicts (Features allowed) or shapely geometries; None stays None."""
+    out = np.empty(len(geoms), dtype=object)
+    for i, geom in enumerate(geoms):
+        if geom is None or isinstance(geom, shapely.Geometry):
+            out[i] = geom
+        elif geom:
+            out[i] = shape(geom)
+    return out
+
+def transform_geometries(geoms, dst_crs, src_crs="EPSG:4326"):
+    """
+    Reproject many geometries with one cached Transformer call over all their coordinates.
+
+    Parameters:
+    geoms (list): GeoJSON geometry dicts/Features or shapely geometries (None entries stay None)
+    dst_crs: Target CRS (e.g. the raster's src.crs)
+    src_crs: CRS of the input geometries
+
+    Returns:
+    ndarray: Object array of reprojected shapely geometries, in input order
+    """
+    geometries = to_shapely(geoms)
+    if crs_key(src_crs) == crs_key(dst_crs):
+        return geometries
+    transformer = get_transformer(src_crs, dst_crs)
+
+    def project(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack((x, y))
+
+    return shapely.transform(geometries, project)
+
+def transform_points(xs, ys, dst_crs, src_crs):
+    """Reproject coordinate arrays with the cached Transformer; returns (xs, ys) arrays."""
+    return get_transformer(src_crs, dst_crs).transform(np.asarray(xs, dtype=np.float64),
+                                                       np.asarray(ys, dtype=np.float64))
+
+def geometry_version(geom):
+    """Content hash of a geometry, used as its version when the caller does not track one."""
+    if isinstance(geom, shapely.Geometry):
+        return hashlib.md5(shapely.to_wkb(geom)).hexdigest()
+    if isinstance(geom, dict) and geom.get("type") == "Feature":
+        geom = geom.get("geometry")
+    return hashlib.md5(json.dumps(geom, sort_keys=True).encode()).hexdigest()
+
+def farm_geometries(farm_ids, geoms, dst_crs, versions=None, src_crs="EPSG:4326"):
+    """
+    Reprojected farm geometries, cached per (farm_id, geometry version, target CRS).
+
+    A farm seen in several UTM zones has one entry per zone. Cache misses are reprojected together
+    in a single transform_geometries call. Without explicit `versions` (e.g. an updated_at
+    timestamp), the geometry's content hash is the version, so edited boundaries get new entries.
+
+    Returns:
+    ndarray: Object array of reprojected shapely geometries, in input order
+    """
+    dst_key, src_key = crs_key(dst_crs), crs_key(src_crs)
+    if versions is None:
+        versions = [geometry_version(geom) if geom is not None else None for geom in geoms]
+    keys = [(farm_id, version, src_key, dst_key) for farm_id, version in zip(farm_ids, versions)]
+
+    out = np.empty(len(keys), dtype=object)
+    missing = []
+    with _farm_lock:
+        for i, key in enumerate(keys):
+            if key in _farm_geometries:
+                _farm_geometries.move_to_end(key)
+                out[i] = _farm_geometries[key]
+            elif geoms[i] is not None:
+                missing.append(i)
+
+    if missing:
+        projected = transform_geometries([geoms[i] for i in missing], dst_crs, src_crs)
+        with _farm_lock:
+            for i, geom in zip(missing, projected):
+                out[i] = geom
+                _farm_geometries[keys[i]] = geom
+            while len(_farm_geometries) > FARM_GEOMETRY_CACHE_SIZE:
+                _farm_geometries.popitem(last=False)
+    return out
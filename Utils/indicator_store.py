@@ -0,0 +1,250 @@
+import os
+import uuid
+import fcntl
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(script_dir), 'Data', 'indicator_store')
+
+# Long format: one row per farm, date and indicator. Partitions are village_id=<id>/month=<YYYY-MM>.
+INDICATOR_SCHEMA = pa.schema([
+    ("farm_id", pa.int64()),
+    ("date", pa.date32()),
+    ("indicator", pa.dictionary(pa.int8(), pa.string())),
+    ("value", pa.float64()),
+    ("source", pa.dictionary(pa.int8(), pa.string())),
+    ("recorded_at", pa.timestamp("ns")),
+])
+
+PARTITIONING = ds.partitioning(pa.schema([("village_id", pa.int64()), ("month", pa.string())]), flavor="hive")
+
+DATASET_SCHEMA = pa.schema(list(INDICATOR_SCHEMA) + list(PARTITIONING.schema))
+
+FARM_INDEX_FILE = "_farm_index.parquet"
+FARM_INDEX_LOCK_FILE = "_farm_index.lock"
+
+def _as_date(value):
+    if value is None or isinstance(value, date) and not isinstance(value, datetime):
+        return value
+    return pd.Timestamp(value).date()
+
+def _months(start, end):
+    """'YYYY-MM' partition values covering [start, end]."""
+    return [period.strftime("%Y-%m") for period in pd.period_range(start, end, freq="M")]
+
+class IndicatorStore:
+    """
+    Append-only, partitioned Parquet store of per-farm indicator time series (NDVI, NDWI, LAI, SWIR, ...).
+
+    Every append writes new part files under village_id=<id>/month=<YYYY-MM>/, sorted by farm and date;
+    existing files are never modified (compact() only merges parts, keeping every row).
+    A small farm_id -> village_id index lets single-farm reads open one village's partitions only.
+    Several processes may append at once (the GEE calculators, the API): index updates hold a file
+    lock, and readers reload the index whenever the file changes.
+    When the same farm/date/indicator is recorded more than once, reads return the latest value.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._farm_index = None
+        self._farm_index_stamp = None
+        os.makedirs(root, exist_ok=True)
+
+    # Writing
+
+    def append(self, records, source="gee"):
+        """
+        Append indicator observations.
+
+        Parameters:
+        records (list or DataFrame): Rows with farm_id, village_id, date, indicator, value and
+                                     optionally source
+        source (str): Default source label for rows without one
+
+        Returns:
+        int: Number of rows written
+        """
+        df = pd.DataFrame(records)
+        if df.empty:
+            return 0
+        missing = {"farm_id", "village_id", "date", "indicator", "value"} - set(df.columns)
+        if missing:
+            raise ValueError(f"Indicator records are missing columns: {sorted(missing)}")
+
+        df = df.dropna(subset=["farm_id", "village_id", "date", "indicator"])
+        df["farm_id"] = df["farm_id"].astype(np.int64)
+        df["village_id"] = df["village_id"].astype(np.int64)
+        df["date"] = pd.to_datetime(df["date"]).dt.normalize()
+        df["indicator"] = df["indicator"].astype(str).str.lower()
+        df["value"] = pd.to_numeric(df["value"], errors="coerce").astype(np.float64)
+        df["source"] = df["source"].fillna(source) if "source" in df.columns else source
+        # Nanoseconds, so the latest of several appends within one second still wins on read
+        df["recorded_at"] = pd.Timestamp.now()
+        df["month"] = df["date"].dt.strftime("%Y-%m")
+
+        part_name = f"part-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        with self._lock:
+            for (village_id, month), part in df.groupby(["village_id", "month"], sort=False):
+                directory = os.path.join(self.root, f"village_id={village_id}", f"month={month}")
+                os.makedirs(directory, exist_ok=True)
+                part = part.sort_values(["farm_id", "date", "indicator"], kind="stable")
+                table = pa.Table.from_pandas(part[INDICATOR_SCHEMA.names], schema=INDICATOR_SCHEMA,
+                                             preserve_index=False)
+                self._write_atomic(table, os.path.join(directory, part_name))
+            self._update_farm_index(df)
+        return len(df)
+
+    @staticmethod
+    def _write_atomic(table, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path, compression="zstd", row_group_size=64 * 1024)
+        os.replace(tmp_path, path)
+
+    @contextmanager
+    def _index_lock(self):
+        # Exclusive across processes: the read-merge-replace of the index must not interleave
+        with open(os.path.join(self.root, FARM_INDEX_LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _update_farm_index(self, df):
+        new = df.groupby("farm_id").agg(village_id=("village_id", "last"), first_date=("date", "min"),
+                                        last_date=("date", "max")).reset_index()
+        with self._index_lock():
+            # Merge into the file's current contents, which another process may have just rewritten
+            index = self.farm_index()
+            if not index.empty:
+                new = pd.concat([index, new]).groupby("farm_id").agg(
+                    village_id=("village_id", "last"), first_date=("first_date", "min"),
+                    last_date=("last_date", "max")).reset_index()
+            table = pa.Table.from_pandas(new, preserve_index=False)
+            self._write_atomic(table, os.path.join(self.root, FARM_INDEX_FILE))
+            self._farm_index = None
+            self.farm_index()
+
+    def compact(self, village_id, month):
+        """Merge the part files of one partition into a single sorted file (no rows are dropped)."""
+        directory = os.path.join(self.root, f"village_id={village_id}", f"month={month}")
+        parts = sorted(name for name in os.listdir(directory) if name.endswith(".parquet"))
+        if len(parts) < 2:
+            return
+        with self._lock:
+            table = pa.concat_tables([pq.read_table(os.path.join(directory, name), schema=INDICATOR_SCHEMA)
+                                      for name in parts])
+            table = table.sort_by([("farm_id", "ascending"), ("date", "ascending")])
+            self._write_atomic(table, os.path.join(directory, f"compacted-{uuid.uuid4().hex[:8]}.parquet"))
+            for name in parts:
+                os.remove(os.path.join(directory, name))
+
+    # Reading
+
+    def farm_index(self):
+        """
+        DataFrame of farm_id, village_id, first_date, last_date for every farm in the store.
+        Reloaded whenever the index file changed, e.g. after another process appended.
+        """
+        path = os.path.join(self.root, FARM_INDEX_FILE)
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        except FileNotFoundError:
+            stamp = None
+        if self._farm_index is None or stamp != self._farm_index_stamp:
+            if stamp is not None:
+                self._farm_index = pq.read_table(path).to_pandas()
+            else:
+                self._farm_index = pd.DataFrame({"farm_id": pd.Series(dtype=np.int64),
+                                                 "village_id": pd.Series(dtype=np.int64),
+                                                 "first_date": pd.Series(dtype="datetime64[ns]"),
+                                                 "last_date": pd.Series(dtype="datetime64[ns]")})
+            self._farm_index_stamp = stamp
+        return self._farm_index
+
+    def _dataset(self, village_ids=None, months=None):
+        """Dataset over the part files of the selected partitions only (None selects all)."""
+        if village_ids is None:
+            village_dirs = [name for name in os.listdir(self.root) if name.startswith("village_id=")]
+        else:
+            village_dirs = [f"village_id={int(village_id)}" for village_id in village_ids]
+
+        files = []
+        for village_dir in village_dirs:
+            village_path = os.path.join(self.root, village_dir)
+            if not os.path.isdir(village_path):
+                continue
+            month_dirs = os.listdir(village_path) if months is None else [f"month={month}" for month in months]
+            for month_dir in month_dirs:
+                month_path = os.path.join(village_path, month_dir)
+                if os.path.isdir(month_path):
+                    files.extend(os.path.join(month_path, name) for name in os.listdir(month_path)
+                                 if name.endswith(".parquet"))
+        if not files:
+            return None
+        return ds.dataset(files, schema=DATASET_SCHEMA, format="parquet", partitioning=PARTITIONING,
+                          partition_base_dir=self.root)
+
+    def read(self, farm_ids=None, village_ids=None, start=None, end=None, indicators=None, latest_only=True):
+        """
+        Read observations filtered by farm, village, date range (inclusive) and indicator.
+
+        Month partitions outside [start, end] are never opened, and farm filters use the farm index
+        to open only the farms' villages.
+
+        Returns:
+        DataFrame: farm_id, village_id, date, indicator, value, source, recorded_at sorted by farm and date
+        """
+        start, end = _as_date(start), _as_date(end)
+        index = self.farm_index()
+        if farm_ids is not None and village_ids is None:
+            village_ids = index.loc[index["farm_id"].isin(list(farm_ids)), "village_id"].unique().tolist()
+
+        months = None
+        if (start is not None or end is not None) and not index.empty:
+            months = _months(start or index["first_date"].min(), end or index["last_date"].max())
+
+        columns = INDICATOR_SCHEMA.names + ["village_id"]
+        dataset = self._dataset(village_ids, months)
+        if dataset is None:
+            return pd.DataFrame(columns=columns)
+
+        expression = ds.scalar(True)
+        if start is not None:
+            expression &= ds.field("date") >= pa.scalar(start, pa.date32())
+        if end is not None:
+            expression &= ds.field("date") <= pa.scalar(end, pa.date32())
+        if farm_ids is not None:
+            expression &= ds.field("farm_id").isin([int(f) for f in farm_ids])
+        if indicators is not None:
+            expression &= ds.field("indicator").isin([name.lower() for name in indicators])
+
+        df = dataset.to_table(columns=columns, filter=expression).to_pandas(date_as_object=False)
+        df["indicator"] = df["indicator"].astype(str)
+        df["source"] = df["source"].astype(str)
+
+        df = df.sort_values(["farm_id", "date", "indicator", "recorded_at"], kind="stable")
+        if latest_only:
+            df = df.drop_duplicates(["farm_id", "date", "indicator"], keep="last")
+        return df.reset_index(drop=True)[columns]
+
+    def read_farm(self, farm_id, start=None, end=None, indicators=None):
+        """Time series of one farm."""
+        return self.read(farm_ids=[farm_id], start=start, end=end, indicators=indicators)
+
+    def read_village(self, village_id, start=None, end=None, indicators=None):
+        """Time series of every farm in one village."""
+        return self.read(village_ids=[village_id], start=start, end=end, indicators=indicators)
+
+    def read_date(self, day, indicators=None, village_ids=None):
+        """All farms' observations on one date (a single month partition per village)."""
+        return self.read(village_ids=village_ids, start=day, end=day, indicators=indicators)
@@ -0,0 +1,244 @@
+import os
+import math
+import json
+import hashlib
+import threading
+from functools import lru_cache
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds as transform_from_bounds
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import Window, from_bounds
+from Utils.spectral_indices import SENSOR_BANDS, compile_index, detect_sensor
+from Utils.render_utils import apply_colormap, stretch_to_uint8, encode_png
+from Utils.cog_utils import read_decimated
+
+TILE_SIZE = 256
+WEB_MERCATOR = "EPSG:3857"
+WEB_MERCATOR_HALF_EXTENT = 20037508.342789244
+MAX_ZOOM = 22
+
+# Layer name -> rendering style. Changing a style changes its cache key, so old tiles are never served.
+TILE_STYLES = {
+    "rgb": {"bands": ["red", "green", "blue"], "percentiles": [2, 98]},
+    "ndvi": {"index": "NDVI", "colormap": "RdYlGn", "vmin": 0.0, "vmax": 1.0},
+    "ndwi": {"index": "NDWI", "colormap": "RdYlBu", "vmin": -0.5, "vmax": 0.5},
+}
+
+# Default on-disk tile cache budget
+TILE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+def style_key(layer):
+    """Cache key of a layer's style: layer name plus a short hash of its settings."""
+    if layer not in TILE_STYLES:
+        raise ValueError(f"Unknown tile layer {layer}. Available: {', '.join(TILE_STYLES)}")
+    digest = hashlib.md5(json.dumps(TILE_STYLES[layer], sort_keys=True).encode()).hexdigest()[:8]
+    return f"{layer}-{digest}"
+
+def image_key(tif_file):
+    """Cache key of a raster: file name plus modification time, so rewritten files get fresh tiles."""
+    stem = os.path.splitext(os.path.basename(tif_file))[0]
+    return f"{stem}-{int(os.path.getmtime(tif_file))}"
+
+def tile_bounds(z, x, y):
+    """(left, bottom, right, top) of an XYZ tile in Web Mercator metres."""
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"Invalid tile {z}/{x}/{y}")
+    size = 2 * WEB_MERCATOR_HALF_EXTENT / 2 ** z
+    left = -WEB_MERCATOR_HALF_EXTENT + x * size
+    top = WEB_MERCATOR_HALF_EXTENT - y * size
+    return left, top - size, left + size, top
+
+def read_tile_bands(src, indexes, z, x, y):
+    """
+    Read bands of an open raster resampled onto a Web Mercator tile grid.
+
+    Only the source window under the tile is read, decimated to about the tile's resolution
+    so low zoom levels are served from the COG overviews.
+
+    Returns:
+    ndarray: float32 (len(indexes), TILE_SIZE, TILE_SIZE) with NaN outside the raster/nodata,
+             or None if the tile does not overlap the raster
+    """
+    bounds = tile_bounds(z, x, y)
+    left, bottom, right, top = transform_bounds(WEB_MERCATOR, src.crs, *bounds, densify_pts=21)
+    clipped = (max(left, src.bounds.left), max(bottom, src.bounds.bottom),
+               min(right, src.bounds.right), min(top, src.bounds.top))
+    if clipped[0] >= clipped[2] or clipped[1] >= clipped[3]:
+        return None
+
+    window = from_bounds(*clipped, transform=src.transform)
+    col_off, row_off = max(0, math.floor(window.col_off)), max(0, math.floor(window.row_off))
+    col_end = min(src.width, math.ceil(window.col_off + window.width))
+    row_end = min(src.height, math.ceil(window.row_off + window.height))
+    if col_end <= col_off or row_end <= row_off:
+        return None
+    window = Window(col_off, row_off, col_end - col_off, row_end - row_off)
+
+    # Source pixels spanned by the whole tile -> output pixels needed for the window
+    tile_cols = (right - left) / src.res[0]
+    tile_rows = (top - bottom) / src.res[1]
+    out_cols = max(1, min(window.width, math.ceil(window.width * TILE_SIZE / tile_cols)))
+    out_rows = max(1, min(window.height, math.ceil(window.height * TILE_SIZE / tile_rows)))
+
+    data = src.read(indexes, window=window, out_shape=(len(indexes), out_rows, out_cols),
+                    masked=True, out_dtype="float32", resampling=Resampling.nearest)
+    data = data.filled(np.nan)
+    data_transform = src.window_transform(window) * Affine.scale(window.width / out_cols, window.height / out_rows)
+
+    tile = np.full((len(indexes), TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+    reproject(
+        source=data,
+        destination=tile,
+        src_transform=data_transform,
+        src_crs=src.crs,
+        src_nodata=np.nan,
+        dst_transform=transform_from_bounds(*bounds, TILE_SIZE, TILE_SIZE),
+        dst_crs=WEB_MERCATOR,
+        dst_nodata=np.nan,
+        resampling=Resampling.nearest,
+    )
+    return tile
+
+@lru_cache(maxsize=64)
+def rgb_stretch_bounds(tif_file, mtime, indexes, percentiles):
+    """
+    Per-band (lows, highs) percentile stretch for a whole image, from a decimated read.
+    Computed once per image (mtime is part of the cache key) so every tile uses the same stretch.
+    """
+    with rasterio.open(tif_file) as src:
+        data, _ = read_decimated(src, list(indexes), max_size=1024, out_dtype="float32")
+    lows, highs = [], []
+    for band in data:
+        valid = band.compressed()
+        low, high = np.percentile(valid, percentiles) if valid.size else (0.0, 0.0)
+        lows.append(low)
+        highs.append(high)
+    return np.array(lows), np.array(highs)
+
+@lru_cache(maxsize=1)
+def empty_tile():
+    return encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+def render_tile(tif_file, layer, z, x, y, sensor=None):
+    """
+    Render one 256x256 PNG tile of a village raster.
+
+    Parameters:
+    tif_file (str): Path to the GeoTIFF
+    layer (str): Key of TILE_STYLES ('rgb', 'ndvi', 'ndwi')
+    z, x, y (int): XYZ tile coordinates
+    sensor (str): Key of SENSOR_BANDS; detected from the filename if None
+
+    Returns:
+    bytes: PNG data (transparent where the raster has no data)
+    """
+    style = TILE_STYLES[layer]
+    config = SENSOR_BANDS[sensor or detect_sensor(tif_file)]
+
+    if "index" in style:
+        index = compile_index(style["index"])
+        band_names = sorted(index.bands)
+    else:
+        band_names = style["bands"]
+    indexes = [config["bands"][band] for band in band_names]
+
+    with rasterio.open(tif_file) as src:
+        data = read_tile_bands(src, indexes, z, x, y)
+    if data is None:
+        return empty_tile()
+
+    if "index" in style:
+        data *= config["scale"]
+        data += config["offset"]
+        values = index.evaluate(dict(zip(band_names, data)))
+        pixels, _, _ = apply_colormap(values, style["colormap"], style["vmin"], style["vmax"])
+    else:
+        lows, highs = rgb_stretch_bounds(tif_file, os.path.getmtime(tif_file), tuple(indexes),
+                                         tuple(style["percentiles"]))
+        pixels = stretch_to_uint8(data, lows, highs, np.isnan(data).any(axis=0))
+    return encode_png(pixels)
+
+class TileCache:
+    """
+    Size-bounded on-disk PNG tile cache, laid out as {image_key}/{style_key}/{z}/{x}/{y}.png.
+
+    Reads touch the file's mtime, so eviction (oldest mtime first) is least-recently-used.
+    Tiles are written to a temporary file and renamed, so concurrent readers never see partial tiles.
+    """
+
+    def __init__(self, directory, max_bytes=TILE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".png"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def path(self, image_id, style, z, x, y):
+        return os.path.join(self.directory, image_id, style, str(z), str(x), f"{y}.png")
+
+    def get(self, image_id, style, z, x, y):
+        path = self.path(image_id, style, z, x, y)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, image_id, style, z, x, y, data):
+        path = self.path(image_id, style, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop least recently used tiles down to 90% of the budget, so eviction does not run on every put
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        for path, file_size, _ in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                size -= file_size
+            except FileNotFoundError:
+                pass
+        self._size = size
+
+def get_tile(tif_file, layer, z, x, y, cache=None):
+    """Cached render_tile: returns PNG bytes from `cache` or renders and stores them."""
+    style = style_key(layer)
+    tile_bounds(z, x, y)  # validate before touching the cache
+    if cache is None:
+        return render_tile(tif_file, layer, z, x, y)
+
+    image_id = image_key(tif_file)
+    data = cache.get(image_id, style, z, x, y)
+    if data is None:
+        data = render_tile(tif_file, layer, z, x, y)
+        cache.put(image_id, style, z, x, y, data)
+    return data
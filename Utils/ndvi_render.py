@@ -0,0 +1,150 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import rasterio
+from Utils.ndvi_utils import (ndvi_means, normalize_bands, compute_ndvi, BLUE_BAND, GREEN_BAND, RED_BAND, NIR_BAND,
+                              RGB_STRETCH_PERCENTILES)
+from Utils.render_utils import apply_colormap, colormap_lut, encode_png
+from Utils.result_cache import content_hash, cache_reports, merge_cache_reports
+from Utils.band_cache import open_raster
+from Utils.cog_utils import read_decimated
+from Utils.worker_pool import submit_to_pool
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+RENDER_CACHE_DIR = os.path.join(os.path.dirname(script_dir), 'Data', 'render_cache')
+
+# Side-by-side RGB | NDVI preview, the same content as plot_rgb_and_ndvi: percentile-stretched RGB,
+# RdYlGn NDVI scaled to its own min/max (imshow's default) and a colorbar. NaN pixels are transparent.
+# Each panel is at most max_size pixels on its long side, like the bounded matplotlib figure.
+PREVIEW_STYLE = {
+    "colormap": "RdYlGn",
+    "rgb_percentiles": list(RGB_STRETCH_PERCENTILES),
+    "gap": 16,
+    "colorbar_width": 24,
+    "max_size": 800,
+}
+
+def style_hash(style):
+    return hashlib.md5(json.dumps(style, sort_keys=True).encode()).hexdigest()[:8]
+
+def compose_rgb_ndvi(rgb_img, ndvi, style=PREVIEW_STYLE):
+    """
+    Lay out an RGB image and an NDVI array side by side, with a vertical colorbar.
+
+    Parameters:
+    rgb_img (ndarray): (rows, cols, 3) float image in 0-1 (values outside are clipped, like imshow)
+    ndvi (ndarray): 2D NDVI array; NaN pixels are transparent
+    style (dict): Colormap and layout settings (see PREVIEW_STYLE)
+
+    Returns:
+    tuple: ((rows, cols, 4) uint8 RGBA canvas, vmin, vmax)
+    """
+    rgb = np.nan_to_num(np.clip(rgb_img, 0.0, 1.0)) * 255.0
+    ndvi_rgba, vmin, vmax = apply_colormap(ndvi, style["colormap"])
+
+    gap, bar_width = style["gap"], style["colorbar_width"]
+    rows = max(rgb.shape[0], ndvi.shape[0])
+    cols = rgb.shape[1] + gap + ndvi.shape[1] + gap + bar_width
+    canvas = np.zeros((rows, cols, 4), dtype=np.uint8)
+
+    canvas[:rgb.shape[0], :rgb.shape[1], :3] = np.round(rgb)
+    canvas[:rgb.shape[0], :rgb.shape[1], 3] = 255
+
+    left = rgb.shape[1] + gap
+    canvas[:ndvi.shape[0], left:left + ndvi.shape[1]] = ndvi_rgba
+
+    # Colorbar: vmax at the top, vmin at the bottom
+    lut = colormap_lut(style["colormap"])
+    positions = np.linspace(len(lut) - 1, 0, rows).round().astype(np.intp)
+    canvas[:, cols - bar_width:] = lut[positions][:, np.newaxis, :]
+    return canvas, vmin, vmax
+
+def render_ndvi_preview(tif_file, save_path, style=PREVIEW_STYLE):
+    """
+    Render the side-by-side RGB | NDVI preview PNG of a Planet scene to `save_path`.
+
+    Scenes larger than style["max_size"] are read decimated (from the COG overviews), so the
+    PNG size and the worker's memory stay bounded. Outputs are cached under Data/render_cache,
+    keyed by the scene's content hash and the style, so re-processing the same scene only copies
+    the cached PNG.
+
+    Returns:
+    dict: {'path': save_path, 'vmin': float, 'vmax': float, 'cached': bool}
+    """
+    cache_base = os.path.join(RENDER_CACHE_DIR, f"{content_hash(tif_file)}-{style_hash(style)}")
+    cache_path, meta_path = cache_base + ".png", cache_base + ".json"
+
+    cached = os.path.exists(cache_path) and os.path.exists(meta_path)
+    if cached:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    else:
+        indexes = [BLUE_BAND, GREEN_BAND, RED_BAND, NIR_BAND]
+        with open_raster(tif_file) as src:
+            decimate = max(src.width, src.height) > style["max_size"]
+            if not decimate:
+                # One read for all four bands, as float32
+                bands = src.read(indexes, masked=True, out_dtype="float32")
+        if decimate:
+            # Large scenes are read from the COG overviews; the band cache does not resample
+            with rasterio.open(tif_file) as src:
+                bands, _ = read_decimated(src, indexes, max_size=style["max_size"], out_dtype="float32")
+
+        rgb = normalize_bands(bands[[2, 1, 0]], percentiles=tuple(style["rgb_percentiles"]))
+        red_nir = normalize_bands(bands[[2, 3]], fill_value=np.nan)
+        _, ndvi = compute_ndvi(red_nir[1], red_nir[0])
+
+        canvas, vmin, vmax = compose_rgb_ndvi(np.moveaxis(rgb, 0, -1), ndvi, style)
+        meta = {"vmin": vmin, "vmax": vmax}
+
+        # Write to temporary files first so concurrent workers never see a partial entry
+        os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+        suffix = f".{os.getpid()}.tmp"
+        with open(cache_path + suffix, "wb") as f:
+            f.write(encode_png(canvas))
+        with open(meta_path + suffix, "w") as f:
+            json.dump(meta, f)
+        os.replace(cache_path + suffix, cache_path)
+        os.replace(meta_path + suffix, meta_path)
+
+    save_dir = os.path.dirname(save_path)
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+    shutil.copyfile(cache_path, save_path)
+    return {"path": save_path, "vmin": meta["vmin"], "vmax": meta["vmax"], "cached": cached}
+
+def process_scene(tif_file, geom, save_path, style=PREVIEW_STYLE):
+    """
+    All per-scene work of the /view-results pipeline, run in one worker process: the full-scene and
+    clipped NDVI means and the RGB | NDVI preview. Only scalars cross the process boundary.
+
+    Parameters:
+    tif_file (str): Path to the Planet scene
+    geom (dict): GeoJSON geometry or Feature (EPSG:4326) of the plot
+    save_path (str): Where to write the preview PNG
+
+    Returns:
+    dict: {'ndvi_full_mean', 'ndvi_clipped_mean', 'preview': render_ndvi_preview result,
+           'cache_reports': the worker's result cache counters (see Utils/result_cache.py)}
+    """
+    ndvi_full_mean, ndvi_clipped_mean = ndvi_means(tif_file, geom)
+    preview = render_ndvi_preview(tif_file, save_path, style)
+    return {
+        "ndvi_full_mean": ndvi_full_mean,
+        "ndvi_clipped_mean": ndvi_clipped_mean,
+        "preview": preview,
+        "cache_reports": cache_reports(),
+    }
+
+def _merge_scene_reports(future):
+    # The worker's cache counters are added to this process's, so /api/cache/stats sees them
+    if not future.cancelled() and future.exception() is None:
+        merge_cache_reports(future.result()["cache_reports"])
+
+def submit_scene(tif_file, geom, save_path, style=PREVIEW_STYLE):
+    """Run process_scene in the shared process pool and return an awaitable for its result."""
+    future = submit_to_pool(process_scene, str(tif_file), geom, save_path, style)
+    future.add_done_callback(_merge_scene_reports)
+    return future
@@ -4,123 +4,316 @@ import asyncio
 import pathlib
 import rasterio
 import numpy as np
-import geopandas as gpd
-from shapely.geometry import shape
 from rasterio.mask import mask
-import matplotlib.pyplot as plt
 from Utils.api_utils import PlanetData, read_geojson, extract_corner_coordinates
+from Utils.zonal_stats import (DEFAULT_PERCENTILES, reproject_geometries, geometry_window, rasterize_labels,
+                               sort_by_label, label_extrema, zonal_statistics, zone_results)
+from Utils.result_cache import ResultCache, memoize_raster
+from Utils.band_cache import open_raster
+from Utils.geometry_service import transform_geometries
 import warnings
 
 warnings.filterwarnings("ignore")
 
-def normalize_bands(img):
-    normalized_img = np.zeros_like(img, dtype=np.float32)
-    for i in range(img.shape[0]):
-        band = img[i, :, :]
-        min_val = np.min(band)
-        max_val = np.max(band)
-        
-        if min_val == max_val:
-            normalized_img[i, :, :] = 0
+# 1-based band indexes of the Planet ortho_analytic_8b_sr product
+BLUE_BAND = 2
+GREEN_BAND = 4
+RED_BAND = 6
+NIR_BAND = 8
+
+# Percentile stretch used for RGB previews
+RGB_STRETCH_PERCENTILES = (2, 98)
+
+# NDVI results are memoized per (scene, geometry, band configuration); bump "version" whenever
+# the computation changes so older cached results are no longer used
+NDVI_CACHE = ResultCache("ndvi")
+NDVI_CACHE_CONFIG = {"red": RED_BAND, "nir": NIR_BAND, "version": 1}
+
+def dtype_limits(dtype):
+    """(highest, lowest) representable values, used as reduction initials for min/max."""
+    if np.issubdtype(dtype, np.integer):
+        return np.iinfo(dtype).max, np.iinfo(dtype).min
+    return np.inf, -np.inf
+
+def normalize_bands(img, out=None, nodata_mask=None, percentiles=None, bounds=None, fill_value=0.0):
+    """
+    Min-max normalize every band of an image to the 0-1 range in one vectorized pass.
+
+    Parameters:
+    img (ndarray): (bands, ...) array; a numpy masked array is treated as img.data + nodata_mask
+    out (ndarray): Optional float32 buffer of the same shape to write into (may be `img` itself)
+    nodata_mask (ndarray): Boolean mask, True where pixels are nodata. Either per band (same shape
+                           as img) or shared by all bands (img.shape[1:]). Masked pixels are left
+                           out of the min/max and set to `fill_value`
+    percentiles (tuple): Optional (low, high) percentiles to stretch between instead of min/max;
+                         values outside are clipped to 0/1
+    bounds (tuple): Optional precomputed (mins, maxs), broadcastable against img
+    fill_value (float): Output value for nodata pixels (use np.nan for NDVI inputs)
+
+    Returns:
+    ndarray: float32 normalized image (`out` if given). Bands where min equals max are all 0.
+    """
+    if np.ma.isMaskedArray(img):
+        mask = np.ma.getmaskarray(img)
+        nodata_mask = mask if nodata_mask is None else (mask | nodata_mask)
+        img = img.data
+
+    if out is None:
+        out = np.empty(img.shape, dtype=np.float32)
+
+    band_shape = (img.shape[0],) + (1,) * (img.ndim - 1)
+    spatial_axes = tuple(range(1, img.ndim))
+    valid = None if nodata_mask is None else ~nodata_mask
+
+    if bounds is not None:
+        mins, maxs = (np.asarray(bound, dtype=np.float64) for bound in bounds)
+    elif percentiles is not None:
+        mins = np.empty(img.shape[0])
+        maxs = np.empty(img.shape[0])
+        for i in range(img.shape[0]):
+            band = img[i] if valid is None else img[i][valid if valid.ndim == img.ndim - 1 else valid[i]]
+            if band.size:
+                mins[i], maxs[i] = np.percentile(band, percentiles)
+            else:
+                mins[i] = maxs[i] = 0
+        mins, maxs = mins.reshape(band_shape), maxs.reshape(band_shape)
+    else:
+        # where= keeps nodata out of the reduction without building a filled copy; the
+        # initial values only matter for bands with no valid pixel at all
+        highest, lowest = dtype_limits(img.dtype)
+        where = True if valid is None else valid
+        mins = np.min(img, axis=spatial_axes, where=where, initial=highest, keepdims=True).astype(np.float64)
+        maxs = np.max(img, axis=spatial_axes, where=where, initial=lowest, keepdims=True).astype(np.float64)
+
+    ranges = maxs - mins
+    # Bands without any valid pixel end up with min > max and are zeroed like flat bands
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scale = np.where(ranges > 0, 1.0 / ranges, 0.0)
+    mins = np.where(np.isfinite(mins), mins, 0.0)
+
+    np.subtract(img, mins, out=out, casting="unsafe")
+    np.multiply(out, scale, out=out, casting="unsafe")
+    if percentiles is not None:
+        np.clip(out, 0.0, 1.0, out=out)
+    if nodata_mask is not None:
+        if nodata_mask.ndim == out.ndim:
+            out[nodata_mask] = fill_value
         else:
-            normalized_img[i, :, :] = (band - min_val) / (max_val - min_val)
-    return normalized_img
+            out[:, nodata_mask] = fill_value
+    return out
+
+def compute_ndvi(nir, red):
+    """Return (mean_ndvi, ndvi_array) for normalized NIR/red arrays; NaN mean if a band is empty."""
+    # nanmax: nodata pixels are NaN after normalize_bands(..., fill_value=np.nan)
+    if np.nanmax(nir, initial=0) > 0 and np.nanmax(red, initial=0) > 0:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ndvi = np.where((nir + red) == 0, np.nan, (nir - red) / (nir + red))
+        return np.nanmean(ndvi), ndvi
+    return np.nan, np.zeros_like(nir)
+
+def clipped_ndvi(src, geom, indexes=None):
+    """Clip `src` to a GeoJSON geometry and return (mean_ndvi, ndvi_array) for the clipped area."""
+    geometries = transform_geometries([geom], src.crs)
+    indexes = indexes or [RED_BAND, NIR_BAND]
+    # filled=False masks the crop padding and the dataset's nodata so they stay out of the min/max
+    clipped_img, _ = mask(dataset=src, shapes=geometries, crop=True, indexes=indexes, filled=False)
+    normalized_clipped_img = normalize_bands(clipped_img, fill_value=np.nan)
+    red_clipped = normalized_clipped_img[indexes.index(RED_BAND), :, :]
+    nir_clipped = normalized_clipped_img[indexes.index(NIR_BAND), :, :]
+
+    print(f"NIR Clipped min: {np.nanmin(nir_clipped, initial=np.inf)}, max: {np.nanmax(nir_clipped, initial=0)}")
+    print(f"Red Clipped min: {np.nanmin(red_clipped, initial=np.inf)}, max: {np.nanmax(red_clipped, initial=0)}")
+
+    return compute_ndvi(nir_clipped, red_clipped)
+
+@memoize_raster(NDVI_CACHE, NDVI_CACHE_CONFIG)
+def ndvi_time_series(tif_file, geom=None, streaming=False, keep_array=True):
+    """
+    Calculate the NDVI of a full scene and, optionally, of a geometry clipped from it.
+
+    Parameters:
+    tif_file (str): Path to the TIFF file
+    geom (dict): Optional GeoJSON geometry (EPSG:4326) to clip
+    streaming (bool): Read only the red/NIR bands, block by block (see ndvi_time_series_streaming)
+    keep_array (bool): In streaming mode, whether to assemble the full-scene NDVI array
+
+    Results are memoized in NDVI_CACHE (memory and disk), so the returned arrays are read-only.
+
+    Returns:
+    tuple: (ndvi_full_mean, ndvi_full, ndvi_clipped_mean, ndvi_clipped)
+    """
+    if streaming:
+        return ndvi_time_series_streaming(tif_file, geom, keep_array=keep_array)
+
+    with open_raster(tif_file) as src:
+        # Read only the red and NIR bands as float32 and normalize them in place
+        full_img = src.read([RED_BAND, NIR_BAND], masked=True, out_dtype="float32")
+        red_full, nir_full = normalize_bands(full_img, out=full_img.data, fill_value=np.nan)
+
+        print(f"NIR Full min: {np.nanmin(nir_full)}, max: {np.nanmax(nir_full)}")
+        print(f"Red Full min: {np.nanmin(red_full)}, max: {np.nanmax(red_full)}")
+
+        ndvi_full_mean, ndvi_full = compute_ndvi(nir_full, red_full)
+
+        if geom:
+            ndvi_clipped_mean, ndvi_clipped = clipped_ndvi(src, geom)
+            return ndvi_full_mean, ndvi_full, ndvi_clipped_mean, ndvi_clipped
 
-def ndvi_time_series(tif_file, geom=None):
+        return ndvi_full_mean, ndvi_full, None, None
+
+@memoize_raster(NDVI_CACHE, NDVI_CACHE_CONFIG)
+def ndvi_means(tif_file, geom=None):
+    """
+    Full-scene and clipped NDVI means only, for callers that discard the arrays.
+
+    Memoized separately from ndvi_time_series, so only the two floats are cached (and pickled to
+    the disk tier), not the full-scene NDVI arrays.
+
+    Returns:
+    tuple: (ndvi_full_mean, ndvi_clipped_mean), None where not computed
+    """
+    ndvi_full_mean, _, ndvi_clipped_mean, _ = ndvi_time_series.uncached(tif_file, geom)
+    return (None if ndvi_full_mean is None else float(ndvi_full_mean),
+            None if ndvi_clipped_mean is None else float(ndvi_clipped_mean))
+
+def band_extrema_streaming(src, indexes):
+    """Running per-band (min, max) over the dataset's internal block windows, ignoring nodata."""
+    mins = np.full(len(indexes), np.inf)
+    maxs = np.full(len(indexes), -np.inf)
+    for _, window in src.block_windows(1):
+        block = src.read(indexes, window=window, masked=True)
+        valid = ~np.ma.getmaskarray(block)
+        highest, lowest = dtype_limits(block.dtype)
+        block_mins = np.min(block.data, axis=(1, 2), where=valid, initial=highest)
+        block_maxs = np.max(block.data, axis=(1, 2), where=valid, initial=lowest)
+        has_data = valid.any(axis=(1, 2))
+        np.minimum(mins, np.where(has_data, block_mins, np.inf), out=mins)
+        np.maximum(maxs, np.where(has_data, block_maxs, -np.inf), out=maxs)
+    return mins, maxs
+
+def ndvi_time_series_streaming(tif_file, geom=None, keep_array=True):
+    """
+    Streaming variant of ndvi_time_series.
+
+    Only the red and NIR bands are read, one internal block window at a time, in two passes:
+    the first keeps running per-band min/max for the normalization, the second accumulates
+    the NDVI sum and pixel count. Peak memory depends on the block size rather than the scene
+    size, except for the optional full-scene NDVI array (`keep_array=False` skips it and
+    returns None in its place).
+
+    Returns:
+    tuple: (ndvi_full_mean, ndvi_full, ndvi_clipped_mean, ndvi_clipped), as ndvi_time_series
+    """
+    indexes = [RED_BAND, NIR_BAND]
+
+    # rasterio directly rather than open_raster: block_windows needs the GeoTIFF's internal
+    # tiling, which the decoded band cache (CachedRaster) does not provide
     with rasterio.open(tif_file) as src:
-        full_img = src.read()
-        normalized_full_img = normalize_bands(full_img)
-        nir_full = normalized_full_img[7, :, :]
-        red_full = normalized_full_img[5, :, :]
+        mins, maxs = band_extrema_streaming(src, indexes)
+        ranges = maxs - mins
+        # Bands without any valid pixel end up with min > max and are zeroed like flat bands
+        ndvi_full = np.zeros(src.shape, dtype=np.float32) if keep_array else None
 
-        print(f"NIR Full min: {np.min(nir_full)}, max: {np.max(nir_full)}")
-        print(f"Red Full min: {np.min(red_full)}, max: {np.max(red_full)}")
+        if np.all(ranges > 0):
+            ndvi_sum = 0.0
+            ndvi_count = 0
+            bounds = (mins.reshape(-1, 1, 1), maxs.reshape(-1, 1, 1))
+            for _, window in src.block_windows(1):
+                block = src.read(indexes, window=window, masked=True, out_dtype="float32")
+                red, nir = normalize_bands(block, out=block.data, bounds=bounds, fill_value=np.nan)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    ndvi = np.where((nir + red) == 0, np.nan, (nir - red) / (nir + red))
 
-        if np.max(nir_full) > 0 and np.max(red_full) > 0:
-            ndvi_full = np.where((nir_full + red_full) == 0, np.nan, (nir_full - red_full) / (nir_full + red_full))
-            ndvi_full_mean = np.nanmean(ndvi_full)
+                valid = np.isfinite(ndvi)
+                ndvi_sum += ndvi[valid].sum(dtype=np.float64)
+                ndvi_count += int(valid.sum())
+                if keep_array:
+                    ndvi_full[window.toslices()] = ndvi
+
+            ndvi_full_mean = ndvi_sum / ndvi_count if ndvi_count else np.nan
         else:
+            # Flat band: same result as the in-memory path
             ndvi_full_mean = np.nan
-            ndvi_full = np.zeros_like(nir_full)
 
         if geom:
-            gdf = gpd.GeoDataFrame({'geometry': [shape(geom)]}, crs="EPSG:4326")
-            gdf = gdf.to_crs(src.crs)
-            clipped_img, _ = mask(dataset=src, shapes=gdf.geometry, crop=True)
-            normalized_clipped_img = normalize_bands(clipped_img)
-            nir_clipped = normalized_clipped_img[7, :, :]
-            red_clipped = normalized_clipped_img[5, :, :]
-
-            print(f"NIR Clipped min: {np.min(nir_clipped)}, max: {np.max(nir_clipped)}")
-            print(f"Red Clipped min: {np.min(red_clipped)}, max: {np.max(red_clipped)}")
-
-            if np.max(nir_clipped) > 0 and np.max(red_clipped) > 0:
-                ndvi_clipped = np.where((nir_clipped + red_clipped) == 0, np.nan, (nir_clipped - red_clipped) / (nir_clipped + red_clipped))
-                ndvi_clipped_mean = np.nanmean(ndvi_clipped)
-            else:
-                ndvi_clipped_mean = np.nan
-                ndvi_clipped = np.zeros_like(nir_clipped)
-
+            ndvi_clipped_mean, ndvi_clipped = clipped_ndvi(src, geom, indexes)
             return ndvi_full_mean, ndvi_full, ndvi_clipped_mean, ndvi_clipped
 
         return ndvi_full_mean, ndvi_full, None, None
 
-def ndvi_time_series_farm(tif_file, geoms=None):
+@memoize_raster(NDVI_CACHE, NDVI_CACHE_CONFIG)
+def ndvi_time_series_farm(tif_file, geoms=None, farm_ids=None, percentiles=DEFAULT_PERCENTILES):
     """
-    Calculate NDVI values for a list of geometries from a TIFF file.
-    
+    Calculate per-farm NDVI statistics for many geometries from a TIFF file in a single pass.
+
+    The red and NIR bands are read once over the window covering all farms, every geometry
+    is reprojected in one vectorized step and burnt into a shared label grid, and the
+    statistics are reduced per label. Bands are normalized per farm, as before.
+
     Parameters:
     tif_file (str): Path to the TIFF file
-    geoms (list): List of geometry objects
-    
+    geoms (list or dict): List of geometry objects, or a {farm_id: geometry} dict
+    farm_ids (list): Farm ids matching `geoms` when it is a list (defaults to list positions)
+    percentiles (tuple): Percentiles to report next to the median
+
+    Results are memoized in NDVI_CACHE, keyed by the scene, geometries, farm ids and percentiles.
+
     Returns:
-    dict: Dictionary with geometry objects as keys and a tuple of (mean_ndvi, ndvi_array) as values
+    dict: {farm_id: {'mean', 'median', 'std', 'min', 'max', 'pixel_count', 'p<q>'...}}
     """
-    # Initialize results dictionary
-    results = {}
-    
     # If no geometries provided, return empty dictionary
     if not geoms:
-        return results
-        
-    with rasterio.open(tif_file) as src:
-        # Process each geometry
-        for geom in geoms:
-            if geom is None:
-                continue
-                
-            # Convert geometry to GeoDataFrame with correct CRS
-            gdf = gpd.GeoDataFrame({'geometry': [shape(geom)]}, crs="EPSG:4326")
-            gdf = gdf.to_crs(src.crs)
-            
-            # Mask/clip the raster with the geometry
-            clipped_img, _ = mask(dataset=src, shapes=gdf.geometry, crop=True)
-            normalized_clipped_img = normalize_bands(clipped_img)
-            
-            nir_clipped = normalized_clipped_img[7, :, :]
-            red_clipped = normalized_clipped_img[5, :, :]
-            
-            print(f"NIR Clipped min: {np.min(nir_clipped)}, max: {np.max(nir_clipped)}")
-            print(f"Red Clipped min: {np.min(red_clipped)}, max: {np.max(red_clipped)}")
-            
-            if np.max(nir_clipped) > 0 and np.max(red_clipped) > 0:
-                ndvi_clipped = np.where(
-                    (nir_clipped + red_clipped) == 0, 
-                    np.nan, 
-                    (nir_clipped - red_clipped) / (nir_clipped + red_clipped)
-                )
-                ndvi_clipped_mean = np.nanmean(ndvi_clipped)
-            else:
-                ndvi_clipped_mean = np.nan
-                ndvi_clipped = np.zeros_like(nir_clipped)
-            
-            # Add to results dictionary with the geometry as key
-            results[geom] = (ndvi_clipped_mean, ndvi_clipped)
-    
-    return results
+        return {}
+
+    if isinstance(geoms, dict):
+        farm_ids, geoms = list(geoms.keys()), list(geoms.values())
+    elif farm_ids is None:
+        farm_ids = list(range(len(geoms)))
+
+    # Farms without a geometry are skipped, as before
+    farms = [(farm_id, geom) for farm_id, geom in zip(farm_ids, geoms) if geom is not None]
+    if not farms:
+        return {}
+    farm_ids = [farm_id for farm_id, _ in farms]
+    n_zones = len(farm_ids)
+
+    with open_raster(tif_file) as src:
+        geometries = reproject_geometries([geom for _, geom in farms], src.crs, farm_ids=farm_ids)
+        window = geometry_window(src, geometries)
+
+        if window is None:
+            # No farm overlaps the raster
+            red = nir = np.empty((0, 0), dtype=np.float32)
+            labels = np.empty((0, 0), dtype=np.int32)
+        else:
+            bands = src.read([RED_BAND, NIR_BAND], window=window, masked=True, out_dtype="float32")
+            red, nir = bands.data
+            labels = rasterize_labels(geometries, red.shape, src.window_transform(window))
+            # Nodata pixels do not belong to any farm
+            labels[np.ma.getmaskarray(bands).any(axis=0)] = 0
+
+    # Normalize red and NIR per farm using each farm's own min/max
+    lab, (red, nir), starts, counts = sort_by_label(labels, red, nir)
+    pixels = np.stack((red, nir))
+    mins, maxs = zip(*(label_extrema(band, starts, counts) for band in pixels))
+    mins, maxs = np.stack(mins), np.stack(maxs)
+    flat = ~np.all(maxs - mins > 0, axis=0)
+    red, nir = normalize_bands(pixels, out=pixels, bounds=(mins[:, lab], maxs[:, lab]))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ndvi = np.where((nir + red) == 0, np.nan, (nir - red) / (nir + red))
+
+    # Farms where either band is flat get NaN, matching the per-geometry version
+    ndvi[flat[lab]] = np.nan
+
+    stats = zonal_statistics(ndvi, lab, n_zones, percentiles)
+    return zone_results(stats, farm_ids)
 
 def plot_rgb_and_ndvi(rgb_img, ndvi, title, save_path=None):
-    plt.figure(figsize=(14, 6))
+    # Interactive/notebook use; the API renders previews with Utils/ndvi_render.py instead
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure(figsize=(14, 6))
 
     plt.subplot(1, 2, 1)
     plt.imshow(rgb_img)
@@ -136,3 +329,4 @@ def plot_rgb_and_ndvi(rgb_img, ndvi, title, save_path=None):
     plt.tight_layout()
     if save_path:
         plt.savefig(save_path)
+        plt.close(fig)
@@ -0,0 +1,98 @@
+import warnings
+import numpy as np
+from rasterio.io import MemoryFile
+from rasterio.errors import NotGeoreferencedWarning
+
+# ColorBrewer anchors, evenly spaced over 0-1 (the same anchors matplotlib interpolates)
+COLORMAP_ANCHORS = {
+    "RdYlGn": ["#a50026", "#d73027", "#f46d43", "#fdae61", "#fee08b", "#ffffbf",
+               "#d9ef8b", "#a6d96a", "#66bd63", "#1a9850", "#006837"],
+    "RdYlBu": ["#a50026", "#d73027", "#f46d43", "#fdae61", "#fee090", "#ffffbf",
+               "#e0f3f8", "#abd9e9", "#74add1", "#4575b4", "#313695"],
+}
+
+_LUT_CACHE = {}
+
+def colormap_lut(name, n=256):
+    """
+    (n, 4) uint8 RGBA lookup table linearly interpolated between the colormap anchors.
+    Built once per (name, n) and reused.
+    """
+    key = (name, n)
+    if key not in _LUT_CACHE:
+        if name not in COLORMAP_ANCHORS:
+            raise ValueError(f"Unknown colormap {name}. Available: {', '.join(COLORMAP_ANCHORS)}")
+        anchors = np.array([[int(color[i:i + 2], 16) for i in (1, 3, 5)] for color in COLORMAP_ANCHORS[name]],
+                           dtype=np.float64) / 255.0
+        positions = np.linspace(0.0, 1.0, len(anchors))
+        samples = np.linspace(0.0, 1.0, n)
+        lut = np.empty((n, 4), dtype=np.uint8)
+        for channel in range(3):
+            lut[:, channel] = np.round(np.interp(samples, positions, anchors[:, channel]) * 255)
+        lut[:, 3] = 255
+        lut.setflags(write=False)
+        _LUT_CACHE[key] = lut
+    return _LUT_CACHE[key]
+
+def apply_colormap(values, colormap="RdYlGn", vmin=None, vmax=None):
+    """
+    Map a 2D float array to (rows, cols, 4) uint8 RGBA through the colormap lookup table.
+    NaN pixels are fully transparent. vmin/vmax default to the finite data range.
+
+    Returns:
+    tuple: (rgba array, vmin, vmax)
+    """
+    lut = colormap_lut(colormap)
+    finite = np.isfinite(values)
+    if vmin is None or vmax is None:
+        if finite.any():
+            data_min, data_max = float(np.min(values[finite])), float(np.max(values[finite]))
+        else:
+            data_min, data_max = 0.0, 1.0
+        vmin = data_min if vmin is None else vmin
+        vmax = data_max if vmax is None else vmax
+
+    # Same binning as matplotlib: floor((x - vmin) / (vmax - vmin) * n), with vmax in the last bin
+    scale = len(lut) / (vmax - vmin) if vmax > vmin else 0.0
+    index = np.where(finite, values, vmin) - vmin
+    index *= scale
+    np.clip(index, 0, len(lut) - 1, out=index)
+    rgba = lut[index.astype(np.intp)]
+    rgba[~finite] = 0
+    return rgba, vmin, vmax
+
+def stretch_to_uint8(img, lows, highs, nodata_mask=None):
+    """
+    Linearly stretch a (bands, rows, cols) image between per-band lows/highs into
+    (rows, cols, bands + 1) uint8 with an alpha channel (transparent where nodata_mask is True).
+    """
+    lows = np.asarray(lows, dtype=np.float32).reshape(-1, 1, 1)
+    ranges = np.asarray(highs, dtype=np.float32).reshape(-1, 1, 1) - lows
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scaled = (img - lows) * np.where(ranges > 0, 255.0 / ranges, 0.0)
+    np.clip(scaled, 0, 255, out=scaled)
+
+    out = np.empty(img.shape[1:] + (img.shape[0] + 1,), dtype=np.uint8)
+    out[..., :-1] = np.moveaxis(np.nan_to_num(scaled), 0, -1)
+    out[..., -1] = 255
+    if nodata_mask is not None:
+        out[nodata_mask] = 0
+    return out
+
+def encode_png(pixels, zlevel=6):
+    """
+    Encode a (rows, cols, channels) uint8 array (gray, RGB or RGBA) as PNG bytes with
+    GDAL's PNG driver, entirely in memory.
+    """
+    pixels = np.asarray(pixels, dtype=np.uint8)
+    if pixels.ndim == 2:
+        pixels = pixels[..., np.newaxis]
+    rows, cols, channels = pixels.shape
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with MemoryFile() as memfile:
+            with memfile.open(driver="PNG", width=cols, height=rows, count=channels, dtype="uint8",
+                              ZLEVEL=zlevel) as dst:
+                dst.write(np.moveaxis(pixels, -1, 0))
+            return memfile.read()
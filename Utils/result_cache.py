@@ -0,0 +1,261 @@
+import os
+import json
+import uuid
+import pickle
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+RESULT_CACHE_DIR = os.path.join(os.path.dirname(script_dir), 'Data', 'result_cache')
+
+# Every ResultCache registers itself here so the API can report their counters
+CACHES = {}
+
+# Identifies this process in the reports pool workers send back (pids are reused)
+PROCESS_TOKEN = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+_MISSING = object()
+_content_hashes = {}
+
+def content_hash(path, chunk_size=1 << 20):
+    """BLAKE2 hash of a file's bytes, memoized per (path, size, mtime) within the process."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _content_hashes:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        _content_hashes[key] = digest.hexdigest()
+    return _content_hashes[key]
+
+def geometry_hash(geom):
+    """Stable hash of a GeoJSON geometry (Features are reduced to their geometry), list or dict of them."""
+    if isinstance(geom, dict) and geom.get("type") == "Feature":
+        geom = geom.get("geometry")
+    return hashlib.md5(json.dumps(geom, sort_keys=True, default=str).encode()).hexdigest()
+
+def raster_cache_key(name, tif_file, geom=None, config=None, args=(), kwargs=None, content=False):
+    """
+    Cache key of a raster computation: function name, file identity (path + size + mtime, or the
+    content hash), geometry hash, band configuration and the remaining call arguments.
+    """
+    stat = os.stat(tif_file)
+    identity = content_hash(tif_file) if content else (os.path.abspath(tif_file), stat.st_size, stat.st_mtime_ns)
+    parts = [name, identity, geometry_hash(geom), config, list(args), kwargs or {}]
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def _nbytes(value):
+    # Approximate in-memory size: arrays dominate, everything else counts as a small constant
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value) + 64
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values()) + 64
+    return 64
+
+def _freeze(value):
+    # Cached results are shared between callers, so their arrays are made read-only
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _freeze(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _freeze(item)
+    return value
+
+class ResultCache:
+    """
+    Two-tier memoization cache for raster results.
+
+    The memory tier is an LRU bounded by the total size of the cached arrays. The disk tier
+    stores pickles under Data/result_cache/<name>/, evicting the least recently used files
+    (oldest mtime; hits touch the file) beyond `disk_bytes`. Hit/miss counters are kept per tier.
+
+    The memory tier belongs to one process: with the process pool, every worker holds its own,
+    so the memory used in total can reach `memory_bytes` x (workers + 1). Workers send their
+    counters back with their results (see cache_reports), and stats() adds them up.
+    """
+
+    def __init__(self, name, memory_bytes=512 * 1024 * 1024, disk_bytes=4 * 1024 * 1024 * 1024,
+                 directory=None, content_keys=False):
+        self.name = name
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.directory = directory or os.path.join(RESULT_CACHE_DIR, name)
+        self.content_keys = content_keys
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = None
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+                         "memory_evictions": 0, "disk_evictions": 0}
+        self._worker_reports = {}
+        CACHES[name] = self
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pkl")
+
+    def _disk_entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".pkl"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return self._memory[key][0]
+
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            with self._lock:
+                self.counters["misses"] += 1
+            return default
+
+        with self._lock:
+            self.counters["disk_hits"] += 1
+        self._remember(key, _freeze(value))
+        return value
+
+    def put(self, key, value):
+        _freeze(value)
+        self._remember(key, value)
+
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.counters["stores"] += 1
+            if self._disk_size is None:
+                self._disk_size = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_size += os.path.getsize(path)
+            if self._disk_size > self.disk_bytes:
+                self._evict_disk()
+
+    def _remember(self, key, value):
+        size = _nbytes(value)
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= self._memory.pop(key)[1]
+            self._memory[key] = (value, size)
+            self._memory_size += size
+            while self._memory_size > self.memory_bytes:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_size -= evicted_size
+                self.counters["memory_evictions"] += 1
+
+    def _evict_disk(self):
+        # Down to 90% of the budget, least recently used first
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        for path, file_size, _ in entries:
+            if size <= self.disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                size -= file_size
+                self.counters["disk_evictions"] += 1
+            except FileNotFoundError:
+                pass
+        self._disk_size = size
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+
+    def report(self):
+        """Cumulative counters and memory use of this process's copy of the cache."""
+        with self._lock:
+            return {"process": PROCESS_TOKEN, "counters": dict(self.counters), "memory_items": len(self._memory),
+                    "memory_bytes": self._memory_size, "disk_bytes": self._disk_size}
+
+    def merge_report(self, report):
+        """Keep the latest report of another process (a pool worker); stats() includes it."""
+        if report["process"] == PROCESS_TOKEN:
+            return
+        with self._lock:
+            self._worker_reports[report["process"]] = report
+            if report["disk_bytes"] is not None:
+                self._disk_size = report["disk_bytes"]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            for report in self._worker_reports.values():
+                for name, value in report["counters"].items():
+                    counters[name] = counters.get(name, 0) + value
+            lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+            hits = counters["memory_hits"] + counters["disk_hits"]
+            return {
+                **counters,
+                "hit_rate": hits / lookups if lookups else None,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "memory_budget_bytes": self.memory_bytes,
+                "worker_processes": len(self._worker_reports),
+                "worker_memory_items": sum(report["memory_items"] for report in self._worker_reports.values()),
+                "worker_memory_bytes": sum(report["memory_bytes"] for report in self._worker_reports.values()),
+                "disk_bytes": self._disk_size,
+                "disk_budget_bytes": self.disk_bytes,
+            }
+
+def memoize_raster(cache, config=None):
+    """
+    Decorator for functions called as func(tif_file, geom=None, ...): results are cached in `cache`,
+    keyed by raster_cache_key. `config` describes anything else the result depends on (e.g. band
+    indexes); change it to invalidate old entries. The undecorated function stays available as
+    `.uncached`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(tif_file, geom=None, *args, **kwargs):
+            key = raster_cache_key(func.__qualname__, str(tif_file), geom, config, args, kwargs,
+                                   content=cache.content_keys)
+            result = cache.get(key, _MISSING)
+            if result is _MISSING:
+                result = func(tif_file, geom, *args, **kwargs)
+                cache.put(key, result)
+            return result
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+def cache_reports():
+    """Reports of every cache in this process, returned by pool work so the API can count it."""
+    return {name: cache.report() for name, cache in CACHES.items()}
+
+def merge_cache_reports(reports):
+    """Record the cache reports sent back by a pool worker (see cache_reports)."""
+    for name, report in reports.items():
+        if name in CACHES:
+            CACHES[name].merge_report(report)
+
+def cache_stats():
+    """Counters of every registered cache, including those reported by pool workers."""
+    return {name: cache.stats() for name, cache in CACHES.items()}
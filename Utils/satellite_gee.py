@@ -2,13 +2,16 @@ import os
 import sys
 import json
 import asyncio
-import asyncpg
 import logging
 from datetime import datetime, timedelta
 import pytz
 from typing import List, Dict, Any, Tuple
 import ee
-import geemap
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Utils.cog_utils import convert_to_cog
+from Utils.downloader import download_file, mark_verified
+from Utils.db_pool import acquire, close_pools
 
 # Get the satellite type from command line args
 satellite_type = None
@@ -64,14 +67,7 @@ logger.addHandler(console_handler)
 # Remove default handlers if any exist
 logger.propagate = False
 
-# Database connection parameters
-DB_PARAMS = {
-    'user': 'smurfs',
-    'password': 'smurfs123',
-    'database': 'smurf',
-    'host': 'localhost',
-    'port': '5432'
-}
+# Database access goes through the shared pools of Utils/db_pool.py ('smurf' database)
 
 def initialize_gee(service_account_json_path):
 # Initialize Google Earth Engine 
@@ -115,9 +111,14 @@ def download_image(image, roi, output_dir, scale, bands, satellite_type, lat, lo
         'format': 'GEO_TIFF'
     })
     
-    # Download img
-    geemap.download_file(url, output_path)
+    # Download img (resumable; written under its final name only once complete and verified)
+    download_file(url, output_path)
     logger.info(f"Image downloaded to: {output_path}")
+
+    # Store as a COG; the SCL layer is categorical, so its overviews must not average classes
+    convert_to_cog(output_path, overview_resampling='nearest' if 'SCL' in satellite_type else 'average')
+    mark_verified(output_path)
+    logger.info(f"Converted to COG: {output_path}")
     
     return output_path
 
@@ -140,8 +141,6 @@ class SatelliteDataCollector:
     async def get_village_centroids(self) -> List[Dict[str, Any]]:
         # Fetch all village centroids from the database
         try:
-            conn = await asyncpg.connect(**DB_PARAMS)
-            
             query = """
                 SELECT 
                     village_id,
@@ -154,8 +153,8 @@ class SatelliteDataCollector:
                     centroid IS NOT NULL
             """
             
-            rows = await conn.fetch(query)
-            await conn.close()
+            async with acquire() as conn:
+                rows = await conn.fetch(query)
             
             if not rows:
                 logger.warning("No village centroids found in the database")
@@ -553,6 +552,8 @@ async def main():
         logger.error(f"Error in main function: {str(e)}")
         # Print to stderr as well in case logging failed
         print(f"Error in main function: {str(e)}", file=sys.stderr)
+    finally:
+        await close_pools()
         
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
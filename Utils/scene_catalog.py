@@ -0,0 +1,228 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import shapely
+from shapely.geometry import shape, mapping, Polygon, MultiPolygon
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+SCENE_CATALOG_PATH = os.environ.get("PLANET_CATALOG_PATH") or \
+    os.path.join(os.path.dirname(script_dir), 'Data', 'scene_catalog.sqlite')
+
+# Enabled by default; PLANET_CATALOG=0 makes every search go to Planet again
+SCENE_CATALOG_ENABLED = os.environ.get("PLANET_CATALOG", "1").lower() not in ("0", "false", "no")
+
+# Scenes keep being published for a few days after acquisition, so recent days are never
+# recorded as searched: they are asked for again until they are older than this
+CATALOG_SETTLE_DAYS = 3
+
+# Gap polygons smaller than this fraction of the query area are slivers left by subtracting
+# footprints, not unsearched area; they are dropped
+CATALOG_MIN_GAP_FRACTION = 1e-6
+
+_scene_catalog = None
+_catalog_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    item_type TEXT NOT NULL,
+    acquired TEXT NOT NULL,
+    cloud_cover REAL,
+    clear_percent REAL,
+    publishing_stage TEXT,
+    quality_category TEXT,
+    geometry TEXT NOT NULL,
+    properties TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scenes_acquired ON scenes (item_type, acquired);
+CREATE VIRTUAL TABLE IF NOT EXISTS scenes_rtree USING rtree(rowid, min_x, max_x, min_y, max_y);
+CREATE TABLE IF NOT EXISTS coverage (
+    rowid INTEGER PRIMARY KEY,
+    item_types TEXT NOT NULL,
+    filter_key TEXT NOT NULL,
+    gte TEXT NOT NULL,
+    lte TEXT NOT NULL,
+    geometry TEXT NOT NULL,
+    searched_at TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS coverage_rtree USING rtree(rowid, min_x, max_x, min_y, max_y);
+"""
+
+def _timestamp(value):
+    # Datetimes and Planet's ISO strings ("2024-01-05T05:12:30.123Z") compare as plain strings
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%S")
+    return str(value).replace("Z", "")[:19]
+
+def _polygonal_parts(geom, min_area):
+    """Polygon parts of a difference result (collections may also hold lines and points) above min_area."""
+    parts = [part for part in shapely.get_parts(geom) if isinstance(part, (Polygon, MultiPolygon))]
+    polygons = [polygon for part in parts for polygon in shapely.get_parts(part) if polygon.area > min_area]
+    if not polygons:
+        return None
+    return polygons[0] if len(polygons) == 1 else MultiPolygon(polygons)
+
+class SceneCatalog:
+    """
+    Persistent local catalog of Planet scene metadata (footprint, acquisition time, cloud cover,
+    clear percent and the full properties) in SQLite, with R*Tree indexes over the footprints.
+
+    Besides the scenes, it records which (area, date range, filters) have been searched completely,
+    so a search only has to ask Planet for the parts that were never searched (see gaps()).
+    """
+
+    def __init__(self, path=SCENE_CATALOG_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add_items(self, items):
+        """Insert or refresh Planet search results (GeoJSON features)."""
+        rows = []
+        for item in items:
+            properties = item['properties']
+            rows.append((item['id'], properties.get('item_type', ''), _timestamp(properties['acquired']),
+                         properties.get('cloud_cover'), properties.get('clear_percent'),
+                         properties.get('publishing_stage'), properties.get('quality_category'),
+                         json.dumps(item['geometry']), json.dumps(properties), shape(item['geometry']).bounds))
+        with _catalog_lock, self._connect() as conn:
+            for *row, bounds in rows:
+                conn.execute("DELETE FROM scenes_rtree WHERE rowid = (SELECT rowid FROM scenes WHERE id = ?)", (row[0],))
+                conn.execute("DELETE FROM scenes WHERE id = ?", (row[0],))
+                cursor = conn.execute(
+                    "INSERT INTO scenes (id, item_type, acquired, cloud_cover, clear_percent, publishing_stage, "
+                    "quality_category, geometry, properties) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                conn.execute("INSERT INTO scenes_rtree VALUES (?, ?, ?, ?, ?)",
+                             (cursor.lastrowid, bounds[0], bounds[2], bounds[1], bounds[3]))
+        return len(rows)
+
+    def record_coverage(self, windows, item_types, filter_key):
+        """
+        Mark (geometry, gte, lte) windows as completely searched for these item types and filters.
+        The part of a window within CATALOG_SETTLE_DAYS of now is left out.
+        """
+        settled = _timestamp(datetime.utcnow() - timedelta(days=CATALOG_SETTLE_DAYS))
+        now = _timestamp(datetime.utcnow())
+        with _catalog_lock, self._connect() as conn:
+            for geom, gte, lte in windows:
+                gte, lte = _timestamp(gte), min(_timestamp(lte), settled)
+                if gte > lte:
+                    continue
+                geometry = shape(geom) if isinstance(geom, dict) else geom
+                cursor = conn.execute(
+                    "INSERT INTO coverage (item_types, filter_key, gte, lte, geometry, searched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (",".join(sorted(item_types)), filter_key, gte, lte, json.dumps(mapping(geometry)), now))
+                min_x, min_y, max_x, max_y = geometry.bounds
+                conn.execute("INSERT INTO coverage_rtree VALUES (?, ?, ?, ?, ?)",
+                             (cursor.lastrowid, min_x, max_x, min_y, max_y))
+
+    def gaps(self, geom, gte, lte, item_types, filter_key):
+        """
+        Parts of the (geometry, date range) query that were never searched with these filters.
+
+        The date range is cut at every boundary of the overlapping coverage records; for each piece,
+        the area not covered by a record spanning it is a gap. Only its Polygon/MultiPolygon parts
+        are kept (lines and points left by the difference are dropped, as are slivers below
+        CATALOG_MIN_GAP_FRACTION of the area). Adjacent pieces with the same gap area are merged.
+
+        Returns:
+        list: (shapely geometry, gte, lte) windows to search remotely; empty if fully covered
+        """
+        aoi = shape(geom) if isinstance(geom, dict) else geom
+        gte, lte = _timestamp(gte), _timestamp(lte)
+        min_x, min_y, max_x, max_y = aoi.bounds
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT c.gte, c.lte, c.geometry FROM coverage c JOIN coverage_rtree r ON r.rowid = c.rowid "
+                "WHERE r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ? "
+                "AND c.item_types = ? AND c.filter_key = ? AND c.lte >= ? AND c.gte <= ?",
+                (min_x, max_x, min_y, max_y, ",".join(sorted(item_types)), filter_key, gte, lte)).fetchall()
+        records = [(start, end, shape(json.loads(geometry))) for start, end, geometry in rows]
+
+        boundaries = sorted({gte, lte} | {t for start, end, _ in records for t in (start, end) if gte < t < lte})
+        gaps = []
+        for start, end in zip(boundaries, boundaries[1:]):
+            covering = [geometry for record_start, record_end, geometry in records
+                        if record_start <= start and record_end >= end]
+            remaining = aoi.difference(shapely.union_all(covering)) if covering else aoi
+            if aoi.area:
+                # Planet only accepts (Multi)Polygon geometry filters
+                remaining = _polygonal_parts(remaining, aoi.area * CATALOG_MIN_GAP_FRACTION)
+            if remaining is None or remaining.is_empty:
+                continue
+            if gaps and gaps[-1][2] == start and gaps[-1][0].equals(remaining):
+                gaps[-1] = (remaining, gaps[-1][1], end)
+            else:
+                gaps.append((remaining, start, end))
+        return gaps
+
+    def query(self, geom, windows, item_types, clear_percent=None, publishing_stages=('finalized',),
+              quality_categories=('standard',), limit=None):
+        """
+        Scenes intersecting `geom` acquired within any of the (gte, lte) windows and passing the same
+        filters as the Planet search (clear_percent is an exclusive (min, max) range), newest first.
+
+        Returns:
+        list: Planet-style features with id, geometry and properties
+        """
+        aoi = shape(geom) if isinstance(geom, dict) else geom
+        min_x, min_y, max_x, max_y = aoi.bounds
+        sql = ("SELECT s.id, s.geometry, s.properties FROM scenes s JOIN scenes_rtree r ON r.rowid = s.rowid "
+               "WHERE r.max_x >= ? AND r.min_x <= ? AND r.max_y >= ? AND r.min_y <= ?")
+        params = [min_x, max_x, min_y, max_y]
+        sql += f" AND s.item_type IN ({', '.join('?' * len(item_types))})"
+        params += list(item_types)
+        sql += " AND (" + " OR ".join("s.acquired BETWEEN ? AND ?" for _ in windows) + ")"
+        params += [_timestamp(t) for window in windows for t in window]
+        if clear_percent:
+            sql += " AND s.clear_percent > ? AND s.clear_percent < ?"
+            params += [clear_percent[0], clear_percent[1]]
+        if publishing_stages:
+            sql += f" AND s.publishing_stage IN ({', '.join('?' * len(publishing_stages))})"
+            params += list(publishing_stages)
+        if quality_categories:
+            sql += f" AND s.quality_category IN ({', '.join('?' * len(quality_categories))})"
+            params += list(quality_categories)
+        sql += " ORDER BY s.acquired DESC"
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        items = []
+        for item_id, geometry, properties in rows:
+            geometry = json.loads(geometry)
+            if shape(geometry).intersects(aoi):
+                items.append({'type': 'Feature', 'id': item_id, 'geometry': geometry,
+                              'properties': json.loads(properties)})
+                if limit and len(items) >= limit:
+                    break
+        return items
+
+    def stats(self):
+        with self._connect() as conn:
+            scenes = conn.execute("SELECT COUNT(*) FROM scenes").fetchone()[0]
+            coverage = conn.execute("SELECT COUNT(*) FROM coverage").fetchone()[0]
+        return {"scenes": scenes, "coverage_records": coverage, "path": self.path}
+
+def get_scene_catalog():
+    """Shared catalog, or None when PLANET_CATALOG=0."""
+    global _scene_catalog
+    if not SCENE_CATALOG_ENABLED:
+        return None
+    if _scene_catalog is None:
+        _scene_catalog = SceneCatalog()
+    return _scene_catalog
@@ -0,0 +1,89 @@
+import os
+import re
+import numpy as np
+import rasterio
+from rasterio.warp import reproject, Resampling
+
+# Sentinel-2 Scene Classification Layer classes treated as not clear:
+# 0 no data, 1 saturated/defective, 3 cloud shadow, 8 cloud (medium), 9 cloud (high), 10 thin cirrus
+SCL_MASKED_CLASSES = (0, 1, 3, 8, 9, 10)
+
+# Suffix of the SCL layer resampled to the image grid, cached next to the image
+SCL_CACHE_SUFFIX = "_scl10m.npy"
+
+# S2_v{village_id}_{lat}_{lon}_{image_date}_{download_date}_{download_time}.tif
+S2_FILENAME = re.compile(r"^S2_(v\d+_[\d.]+[NS]_[\d.]+[EW]_\d{8})_\d{8}_\d{6}\.tif$")
+
+def find_scl_companion(image_path):
+    """
+    Find the S2_SCL file downloaded next to a Sentinel-2 image (same village, centroid and
+    acquisition date). Returns None if there is none.
+    """
+    directory, filename = os.path.split(image_path)
+    match = S2_FILENAME.match(filename)
+    if not match:
+        return None
+
+    prefix = f"S2_SCL_{match.group(1)}_"
+    candidates = sorted(
+        name for name in os.listdir(directory or ".")
+        if name.startswith(prefix) and name.endswith(".tif")
+    )
+    # Latest download wins
+    return os.path.join(directory, candidates[-1]) if candidates else None
+
+def scl_cache_path(image_path):
+    return os.path.splitext(image_path)[0] + SCL_CACHE_SUFFIX
+
+def scl_on_image_grid(image_path, scl_path=None):
+    """
+    Return the SCL classes resampled (nearest neighbour) from 20 m to the image's 10 m grid.
+
+    The resampled layer is computed once and cached as a .npy file next to the image; the cache
+    is rebuilt when either the image or the SCL file is newer. Returns a read-only memory-mapped
+    uint8 array of the image's (rows, cols), or None if no SCL layer exists.
+    """
+    scl_path = scl_path or find_scl_companion(image_path)
+    if scl_path is None:
+        return None
+
+    cache_path = scl_cache_path(image_path)
+    if os.path.exists(cache_path):
+        cache_mtime = os.path.getmtime(cache_path)
+        if cache_mtime >= os.path.getmtime(scl_path) and cache_mtime >= os.path.getmtime(image_path):
+            return np.load(cache_path, mmap_mode="r")
+
+    with rasterio.open(image_path) as image, rasterio.open(scl_path) as scl:
+        resampled = np.zeros((image.height, image.width), dtype=np.uint8)
+        reproject(
+            source=rasterio.band(scl, 1),
+            destination=resampled,
+            dst_transform=image.transform,
+            dst_crs=image.crs,
+            dst_nodata=0,
+            resampling=Resampling.nearest,
+        )
+
+    # Write to a temporary file first so concurrent readers never see a partial cache
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, resampled)
+    os.replace(tmp_path, cache_path)
+
+    return np.load(cache_path, mmap_mode="r")
+
+def load_clear_mask(image_path, window=None, out_shape=None):
+    """
+    Boolean mask (True = clear) on the image grid, optionally for a window only or sampled
+    (nearest) onto a decimated (rows, cols) grid. Returns None when the image has no SCL companion.
+    """
+    scl = scl_on_image_grid(image_path)
+    if scl is None:
+        return None
+    if window is not None:
+        scl = scl[window.toslices()]
+    if out_shape is not None and tuple(out_shape) != scl.shape:
+        rows = (np.arange(out_shape[0]) * scl.shape[0]) // out_shape[0]
+        cols = (np.arange(out_shape[1]) * scl.shape[1]) // out_shape[1]
+        scl = scl[np.ix_(rows, cols)]
+    return ~np.isin(scl, SCL_MASKED_CLASSES)
@@ -0,0 +1,243 @@
+import os
+import ast
+from functools import lru_cache
+import numpy as np
+import rasterio
+from Utils.zonal_stats import (DEFAULT_PERCENTILES, reproject_geometries, geometry_window, rasterize_labels,
+                               zonal_statistics, zone_results)
+from Utils.scl_mask import load_clear_mask
+from Utils.cog_utils import read_decimated
+
+# Band name -> 1-based band index in the GeoTIFFs we download, plus the reflectance scaling
+# that turns stored digital numbers into surface reflectance.
+SENSOR_BANDS = {
+    # Planet ortho_analytic_8b_sr
+    "PS8": {
+        "bands": {"coastal_blue": 1, "blue": 2, "green_i": 3, "green": 4, "yellow": 5,
+                  "red": 6, "rededge": 7, "nir": 8},
+        "scale": 0.0001,
+        "offset": 0.0,
+    },
+    # Sentinel-2 SR download from satellite_gee (B2, B3, B4, B5, B6, B7, B8, B11, B12)
+    "S2": {
+        "bands": {"blue": 1, "green": 2, "red": 3, "rededge": 4, "rededge1": 4, "rededge2": 5,
+                  "rededge3": 6, "nir": 7, "swir1": 8, "swir2": 9,
+                  "B2": 1, "B3": 2, "B4": 3, "B5": 4, "B6": 5, "B7": 6, "B8": 7, "B11": 8, "B12": 9},
+        "scale": 0.0001,
+        "offset": 0.0,
+    },
+    # Landsat 9 C2 L2 download from satellite_gee (SR_B2..SR_B7, QA_PIXEL)
+    "L9": {
+        "bands": {"blue": 1, "green": 2, "red": 3, "nir": 4, "swir1": 5, "swir2": 6,
+                  "SR_B2": 1, "SR_B3": 2, "SR_B4": 3, "SR_B5": 4, "SR_B6": 5, "SR_B7": 6},
+        "scale": 0.0000275,
+        "offset": -0.2,
+    },
+}
+
+# Named index formulas over band names. LAI follows the simplified model used by
+# SugarcaneHarvestReadinessCalculator.calculate_lai.
+INDEX_FORMULAS = {
+    "NDVI": "(nir - red) / (nir + red)",
+    "NDWI": "(green - nir) / (green + nir)",
+    "NDRE": "(nir - rededge) / (nir + rededge)",
+    "EVI": "2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)",
+    "LAI": "4.5 * (nir - red) / (nir + red) - 0.5",
+    "SWIR": "swir1",
+}
+
+# Functions allowed inside formulas
+FORMULA_FUNCTIONS = {
+    "sqrt": np.sqrt,
+    "log": np.log,
+    "exp": np.exp,
+    "abs": np.abs,
+    "minimum": np.minimum,
+    "maximum": np.maximum,
+    "clip": np.clip,
+}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load, ast.Call,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd,
+)
+
+class _FloatConstants(ast.NodeTransformer):
+    """
+    Replace numeric constants by float64 values bound to names. Integer arithmetic on user
+    constants (e.g. 9**9**9) would build arbitrarily large ints on the API thread; as floats it
+    overflows to inf, and compile() cannot fold it either.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def visit_Constant(self, node):
+        try:
+            value = np.float64(node.value)
+        except OverflowError:
+            raise ValueError("Numeric constant too large")
+        name = f"_const{len(self.values)}"
+        self.values[name] = value
+        return ast.copy_location(ast.Name(id=name, ctx=ast.Load()), node)
+
+class SpectralIndex:
+    """A band-algebra formula parsed and compiled once, evaluated over whole band arrays."""
+
+    def __init__(self, name, expression):
+        self.name = name
+        self.expression = expression
+        tree = ast.parse(expression, mode="eval")
+
+        bands = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, _ALLOWED_NODES):
+                raise ValueError(f"Unsupported syntax in index {name}: {type(node).__name__}")
+            if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+                raise ValueError(f"Only numeric constants are allowed in index {name}")
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id not in FORMULA_FUNCTIONS:
+                    raise ValueError(f"Unsupported function in index {name}")
+                if node.keywords:
+                    raise ValueError(f"Keyword arguments are not allowed in index {name}")
+            if isinstance(node, ast.Name) and node.id not in FORMULA_FUNCTIONS:
+                bands.add(node.id)
+
+        if not bands:
+            raise ValueError(f"Index {name} does not reference any band")
+        self.bands = frozenset(bands)
+        constants = _FloatConstants()
+        tree = ast.fix_missing_locations(constants.visit(tree))
+        self.constants = constants.values
+        self.code = compile(tree, f"<index {name}>", "eval")
+
+    def evaluate(self, band_arrays):
+        """Evaluate over a {band_name: array} dict; non-finite results become NaN."""
+        namespace = dict(FORMULA_FUNCTIONS)
+        namespace.update(self.constants)
+        namespace.update({band: band_arrays[band] for band in self.bands})
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            result = eval(self.code, {"__builtins__": {}}, namespace)
+            result = np.asarray(result, dtype=np.float32)
+        result[~np.isfinite(result)] = np.nan
+        return result
+
+@lru_cache(maxsize=256)
+def compile_index(name, expression=None):
+    """Compile a named index (or a custom expression), caching the compiled formula."""
+    if expression is None:
+        key = name.upper()
+        if key not in INDEX_FORMULAS:
+            raise ValueError(f"Unknown index {name}. Available: {', '.join(INDEX_FORMULAS)}")
+        return SpectralIndex(key, INDEX_FORMULAS[key])
+    return SpectralIndex(name, expression)
+
+def resolve_indices(names=None, custom=None):
+    """Build the list of compiled indices from named indices and {name: expression} custom formulas."""
+    indices = [compile_index(name) for name in (names or [])]
+    indices += [compile_index(name, expression) for name, expression in (custom or {}).items()]
+    if not indices:
+        raise ValueError("No indices requested")
+    return indices
+
+def detect_sensor(tif_file):
+    """Guess the sensor from our file naming (S2_/L9_ from satellite_gee, Planet scenes otherwise)."""
+    filename = os.path.basename(str(tif_file))
+    if filename.startswith("S1_"):
+        raise ValueError("Sentinel-1 images (VV/VH/angle) have no optical bands")
+    if filename.startswith("S2_") and not filename.startswith("S2_SCL"):
+        return "S2"
+    if filename.startswith("L9_") and not filename.startswith("L9_thermal"):
+        return "L9"
+    return "PS8"
+
+def read_index_bands(src, sensor, band_names, window=None, max_size=None):
+    """
+    Read every band needed by a set of indices in one call and convert to reflectance.
+    With max_size, the bands are read decimated (from the COG overviews) instead of a window.
+
+    Returns:
+    tuple: ({band_name: float32 array}, nodata mask shared by all bands)
+    """
+    config = SENSOR_BANDS[sensor]
+    missing = [band for band in band_names if band not in config["bands"]]
+    if missing:
+        raise ValueError(f"Bands {missing} are not available for sensor {sensor}")
+
+    band_indexes = sorted({config["bands"][band] for band in band_names})
+    if max_size:
+        data, _ = read_decimated(src, band_indexes, max_size=max_size, out_dtype="float32")
+    else:
+        data = src.read(band_indexes, window=window, masked=True, out_dtype="float32")
+    nodata = np.ma.getmaskarray(data).any(axis=0)
+
+    reflectance = data.data
+    reflectance *= config["scale"]
+    reflectance += config["offset"]
+
+    position = {band_index: i for i, band_index in enumerate(band_indexes)}
+    arrays = {band: reflectance[position[config["bands"][band]]] for band in band_names}
+    return arrays, nodata
+
+def index_statistics(tif_file, indices, sensor=None, geoms=None, zone_ids=None, percentiles=DEFAULT_PERCENTILES,
+                     cloud_mask=True, max_size=None):
+    """
+    Evaluate several spectral indices over one raster read and summarise them per zone.
+
+    Parameters:
+    tif_file (str): Path to the GeoTIFF
+    indices (list): Compiled indices (see resolve_indices)
+    sensor (str): Key of SENSOR_BANDS; detected from the filename if None
+    geoms (list): Optional GeoJSON geometries (EPSG:4326). Without geometries the whole scene
+                  is one zone, keyed 'scene'
+    zone_ids (list): Ids matching `geoms` (defaults to list positions)
+    cloud_mask (bool): For Sentinel-2 scenes, drop cloud/shadow pixels using the S2_SCL layer
+                       downloaded next to the image (see Utils/scl_mask.py)
+    max_size (int): Scene-level only: compute from a decimated read (COG overview) at most
+                    max_size pixels on the long side instead of the full resolution
+
+    Returns:
+    dict: {zone_id: {index_name: {'mean', 'median', 'std', ..., 'pixel_count'}, 'clear_fraction': float}}
+          clear_fraction is the share of the zone's pixels left after SCL masking (NaN without SCL)
+    """
+    sensor = sensor or detect_sensor(tif_file)
+    band_names = sorted(set().union(*(index.bands for index in indices)))
+
+    with rasterio.open(tif_file) as src:
+        if geoms:
+            zone_ids = zone_ids if zone_ids is not None else list(range(len(geoms)))
+            geometries = reproject_geometries(geoms, src.crs, farm_ids=zone_ids)
+            window = geometry_window(src, geometries)
+            if window is None:
+                # No zone overlaps the raster
+                arrays = {band: np.empty((0, 0), dtype=np.float32) for band in band_names}
+                nodata = np.empty((0, 0), dtype=bool)
+                labels = np.empty((0, 0), dtype=np.int32)
+            else:
+                arrays, nodata = read_index_bands(src, sensor, band_names, window)
+                labels = rasterize_labels(geometries, nodata.shape, src.window_transform(window))
+        else:
+            zone_ids = ["scene"]
+            window = None
+            arrays, nodata = read_index_bands(src, sensor, band_names, max_size=max_size)
+            labels = np.ones(nodata.shape, dtype=np.int32)
+
+    labels[nodata] = 0
+
+    n_zones = len(zone_ids)
+    clear_fraction = np.full(n_zones, np.nan)
+    clear = load_clear_mask(tif_file, window, labels.shape) if (cloud_mask and sensor == "S2" and labels.size) else None
+    if clear is not None:
+        zone_pixels = np.bincount(labels.ravel(), minlength=n_zones + 1)[1:n_zones + 1]
+        labels[~clear] = 0
+        clear_pixels = np.bincount(labels.ravel(), minlength=n_zones + 1)[1:n_zones + 1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            clear_fraction = clear_pixels / zone_pixels
+
+    results = {zone_id: {"clear_fraction": float(clear_fraction[i])} for i, zone_id in enumerate(zone_ids)}
+    for index in indices:
+        values = index.evaluate(arrays)
+        stats = zone_results(zonal_statistics(values, labels, n_zones, percentiles), zone_ids)
+        for zone_id, zone_stats in stats.items():
+            results[zone_id][index.name] = zone_stats
+    return results
@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Every function here works on a dense (farms, dates) float matrix with NaN for missing
+# (cloudy) observations, and processes all farms in the same NumPy operations.
+
+def indicator_matrix(history, indicator, dates=None, step_days=None):
+    """
+    Pivot long-format indicator history (see Utils/indicator_store.py) into a farms x dates matrix.
+
+    Parameters:
+    history (DataFrame): Rows with farm_id, date, indicator, value
+    indicator (str): Indicator to pivot, e.g. 'ndvi'
+    dates (array-like): Optional date columns to use (observations on other dates are dropped)
+    step_days (int): Optional regular grid step; observations are averaged into step_days bins
+                     starting at the first date. Needed for the Savitzky-Golay/Whittaker smoothers,
+                     which assume evenly spaced columns
+
+    Returns:
+    tuple: (farm_ids array, DatetimeIndex of dates, float64 matrix with NaN where missing)
+    """
+    rows = history[history["indicator"] == indicator.lower()]
+    day = pd.to_datetime(rows["date"])
+    if step_days:
+        origin = day.min() if dates is None else pd.Timestamp(pd.DatetimeIndex(dates).min())
+        day = origin + pd.to_timedelta((day - origin).dt.days // step_days * step_days, unit="D")
+
+    farm_ids, farm_pos = np.unique(rows["farm_id"].to_numpy(), return_inverse=True)
+    if dates is None:
+        dates = pd.DatetimeIndex(np.unique(day.to_numpy()))
+        if step_days and len(dates):
+            dates = pd.date_range(dates[0], dates[-1], freq=f"{step_days}D")
+    dates = pd.DatetimeIndex(dates)
+
+    date_pos = dates.get_indexer(day)
+    keep = date_pos >= 0
+    farm_pos, date_pos = farm_pos[keep], date_pos[keep]
+    values = rows["value"].to_numpy(dtype=np.float64)[keep]
+    present = np.isfinite(values)
+
+    # Mean of the observations falling in each cell
+    shape = (len(farm_ids), len(dates))
+    flat = np.ravel_multi_index((farm_pos[present], date_pos[present]), shape)
+    sums = np.bincount(flat, weights=values[present], minlength=shape[0] * shape[1])
+    counts = np.bincount(flat, minlength=shape[0] * shape[1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        matrix = (sums / counts).reshape(shape)
+    return farm_ids, dates, matrix
+
+def linear_gap_fill(matrix, x=None, max_gap=None, extrapolate=True):
+    """
+    Fill NaN gaps in every row by linear interpolation between the neighbouring observations.
+
+    Parameters:
+    matrix (ndarray): (farms, dates) values with NaN gaps
+    x (array-like): Column positions (e.g. day numbers) for unevenly spaced dates; defaults to 0..n-1
+    max_gap (float): Leave gaps wider than this (in units of x) unfilled
+    extrapolate (bool): Hold the first/last observation constant over leading/trailing gaps
+
+    Returns:
+    ndarray: Filled copy (rows without any observation stay NaN)
+    """
+    values = np.asarray(matrix, dtype=np.float64)
+    n_rows, n_cols = values.shape
+    x = np.arange(n_cols, dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+    valid = np.isfinite(values)
+    columns = np.arange(n_cols)
+
+    # Index of the previous / next valid column for every cell (-1 / n_cols when there is none)
+    prev_idx = np.maximum.accumulate(np.where(valid, columns, -1), axis=1)
+    next_idx = np.minimum.accumulate(np.where(valid, columns, n_cols)[:, ::-1], axis=1)[:, ::-1]
+    has_prev, has_next = prev_idx >= 0, next_idx < n_cols
+
+    rows = np.arange(n_rows)[:, np.newaxis]
+    prev_val = values[rows, np.clip(prev_idx, 0, n_cols - 1)]
+    next_val = values[rows, np.clip(next_idx, 0, n_cols - 1)]
+    prev_x = x[np.clip(prev_idx, 0, n_cols - 1)]
+    next_x = x[np.clip(next_idx, 0, n_cols - 1)]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(next_x > prev_x, (x - prev_x) / (next_x - prev_x), 0.0)
+    filled = np.where(valid, values, prev_val + (next_val - prev_val) * frac)
+
+    inside = has_prev & has_next
+    if max_gap is not None:
+        inside &= (next_x - prev_x) <= max_gap
+    if extrapolate:
+        filled = np.where(~has_prev & has_next, next_val, filled)
+        filled = np.where(has_prev & ~has_next, prev_val, filled)
+        inside |= has_prev ^ has_next
+    return np.where(valid | inside, filled, np.nan)
+
+def savgol_coefficients(window_length, polyorder):
+    """
+    Savitzky-Golay least-squares coefficients.
+
+    Returns:
+    ndarray: (window_length, window_length) matrix whose row j evaluates, at window position j,
+             the polynomial fitted to the window (row window_length // 2 is the usual centre filter)
+    """
+    if window_length % 2 == 0 or window_length <= polyorder:
+        raise ValueError("window_length must be odd and greater than polyorder")
+    positions = np.arange(window_length, dtype=np.float64) - window_length // 2
+    vander = np.vander(positions, polyorder + 1, increasing=True)
+    fit = np.linalg.pinv(vander)  # (polyorder + 1, window) least-squares fit
+    return vander @ fit
+
+def savitzky_golay(matrix, window_length=5, polyorder=2):
+    """
+    Savitzky-Golay smoothing of every row of an evenly spaced (farms, dates) matrix.
+
+    Interior points use the centred filter; the first/last window_length // 2 points are
+    evaluated from the polynomial fitted to the first/last window (scipy's mode='interp').
+    Gaps must be filled first (see linear_gap_fill): NaN propagates through the window.
+
+    Returns:
+    ndarray: Smoothed copy, same shape
+    """
+    values = np.asarray(matrix, dtype=np.float64)
+    n_cols = values.shape[1]
+    if n_cols < window_length:
+        # Too few dates for the window: shrink it to the largest valid odd length
+        window_length = n_cols if n_cols % 2 else n_cols - 1
+        if window_length <= polyorder:
+            return values.copy()
+
+    coefficients = savgol_coefficients(window_length, polyorder)
+    half = window_length // 2
+
+    smoothed = np.empty_like(values)
+    windows = sliding_window_view(values, window_length, axis=1)  # (farms, n - w + 1, w), no copy
+    smoothed[:, half:n_cols - half] = windows @ coefficients[half]
+    smoothed[:, :half] = values[:, :window_length] @ coefficients[:half].T
+    smoothed[:, n_cols - half:] = values[:, -window_length:] @ coefficients[half + 1:].T
+    return smoothed
+
+def difference_penalty_bands(n, order=2):
+    """Lower bands of D'D for the order-`order` difference matrix D: (order + 1, n), band k = diagonal -k."""
+    difference = np.diff(np.eye(n), n=order, axis=0)
+    penalty = difference.T @ difference
+    bands = np.zeros((order + 1, n))
+    for k in range(order + 1):
+        bands[k, k:] = np.diagonal(penalty, offset=-k)
+    return bands
+
+def whittaker_smooth(matrix, lam=10.0, order=2, weights=None):
+    """
+    Whittaker-Eilers smoothing of every row: minimises sum(w * (y - z)^2) + lam * sum(diff(z, order)^2).
+
+    Missing (NaN) observations get weight 0, so the smoother fills gaps by itself. The banded
+    system (W + lam * D'D) z = W y of every farm is solved at once with a batched banded Cholesky
+    factorisation, so the cost is O(dates * order^2) NumPy operations over all farms.
+
+    Parameters:
+    matrix (ndarray): Evenly spaced (farms, dates) values with NaN gaps
+    lam (float): Smoothness; larger is smoother
+    order (int): Difference order of the penalty (2 penalises curvature)
+    weights (ndarray): Optional per-observation weights (e.g. clear fraction), same shape
+
+    Returns:
+    ndarray: Smoothed values; rows with order or fewer observations fall back to linear_gap_fill
+    """
+    values = np.asarray(matrix, dtype=np.float64)
+    n_rows, n = values.shape
+    valid = np.isfinite(values)
+    w = valid.astype(np.float64) if weights is None else np.where(valid, np.asarray(weights, dtype=np.float64), 0.0)
+
+    # Dates-major layout, so every step below is a contiguous operation over all farms
+    y = np.ascontiguousarray((np.where(valid, values, 0.0) * w).T)
+    w = np.ascontiguousarray(w.T)
+
+    # bands[k, i] holds A[i, i - k]; the diagonal adds the weights
+    bands = np.repeat(lam * difference_penalty_bands(n, order)[:, :, np.newaxis], n_rows, axis=2)
+    bands[0] += w
+
+    # Underdetermined rows (the penalty's null space is not pinned down) are solved on a
+    # neutral system and replaced afterwards
+    solvable = (w > 0).sum(axis=0) > order
+    bands[0][:, ~solvable] += 1.0
+
+    # Batched banded Cholesky: chol[k, i] = L[i, i - k]
+    chol = np.zeros_like(bands)
+    for i in range(n):
+        for k in range(min(order, i), -1, -1):
+            j = i - k
+            total = bands[k, i].copy()
+            for m in range(max(0, i - order), j):
+                total -= chol[i - m, i] * chol[j - m, j]
+            if k == 0:
+                chol[0, i] = np.sqrt(total)
+            else:
+                chol[k, i] = total / chol[0, j]
+
+    # Forward substitution L u = W y, then back substitution L' z = u
+    u = np.empty_like(y)
+    for i in range(n):
+        total = y[i].copy()
+        for k in range(1, min(order, i) + 1):
+            total -= chol[k, i] * u[i - k]
+        u[i] = total / chol[0, i]
+    z = np.empty_like(y)
+    for i in range(n - 1, -1, -1):
+        total = u[i].copy()
+        for k in range(1, min(order, n - 1 - i) + 1):
+            total -= chol[k, i + k] * z[i + k]
+        z[i] = total / chol[0, i]
+
+    z = z.T.copy()
+    if not solvable.all():
+        z[~solvable] = linear_gap_fill(values[~solvable])
+    return z
+
+def smooth_matrix(matrix, method="savgol", x=None, max_gap=None, window_length=5, polyorder=2, lam=10.0,
+                  weights=None):
+    """
+    Gap-fill and smooth a (farms, dates) indicator matrix in one call.
+
+    Parameters:
+    method (str): 'savgol' (linear gap fill, then Savitzky-Golay) or 'whittaker' (weighted
+                  Whittaker smoother, which fills gaps itself)
+    x (array-like): Column positions for the linear gap fill (Savitzky-Golay assumes even spacing)
+    max_gap (float): Gaps wider than this stay NaN (savgol) / are masked back to NaN (whittaker)
+
+    Returns:
+    ndarray: Smoothed matrix
+    """
+    values = np.asarray(matrix, dtype=np.float64)
+    # Cells left NaN: rows without observations and, with max_gap, the inside of long gaps
+    keep = np.isfinite(linear_gap_fill(values, x=x, max_gap=max_gap))
+    if method == "savgol":
+        # Smooth over the fully filled series so long gaps do not leak into their neighbours
+        filled = linear_gap_fill(values, x=x)
+        smoothed = savitzky_golay(np.where(np.isfinite(filled), filled, 0.0), window_length, polyorder)
+        return np.where(keep, smoothed, np.nan)
+    if method == "whittaker":
+        smoothed = whittaker_smooth(values, lam=lam, weights=weights)
+        return np.where(keep, smoothed, np.nan)
+    raise ValueError(f"Unknown smoothing method {method}. Use 'savgol' or 'whittaker'")
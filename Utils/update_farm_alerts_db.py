@@ -2,14 +2,18 @@ import os
 import sys
 import json
 import asyncio
-import asyncpg
 import logging
-import psycopg2
 from datetime import datetime, timedelta
 import pytz
 from typing import List, Dict, Any, Tuple
+import warnings
 import ee
 import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Utils.indicator_store import IndicatorStore
+from Utils.db_pool import acquire, close_pools
 
 # Set up logging configuration
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -35,11 +39,56 @@ class ISTFormatter(logging.Formatter):
             return ist_time.strftime('%Y-%m-%d %H:%M:%S')
 
 class BaseEarthEngineCalculator:
-    def __init__(self, service_account_json_path: str, logger=None):
+    def __init__(self, service_account_json_path: str, logger=None, indicator_store=None):
         self.service_account_json_path = service_account_json_path
         self.ee_initialized = False
         self.logger = logger or logging.getLogger("default_ee")
+        self.indicator_store = indicator_store or IndicatorStore()
+
+    def record_indicators(self, records: List[Dict[str, Any]], village_id):
+        # Append this village's per-farm, per-date values to the indicator history store.
+        # A failure here is logged but must not stop the farm_data updates.
+        try:
+            written = self.indicator_store.append(records, source="gee_s2")
+            self.logger.info(f"Recorded {written} indicator values for village {village_id}")
+        except Exception as e:
+            self.logger.error(f"Error recording indicator history for village {village_id}: {e}")
     
+    async def write_farm_updates(self, columns: Dict[str, str], rows: List[Tuple], village_id) -> int:
+        """Write one village's results to farm_data in a short transaction of its own:
+        COPY into a temporary staging table, then a single UPDATE ... FROM.
+
+        Args:
+            columns (dict): farm_data columns to set and their SQL types, e.g. {"health": "integer"}
+            rows (list): (plot_number, value, ...) tuples, values in the order of `columns`
+            village_id: Village the rows belong to (for logging)
+
+        Returns:
+            int: Number of farm_data rows updated (0 if the write failed)
+        """
+        if not rows:
+            return 0
+        column_defs = ", ".join(f"{name} {sql_type}" for name, sql_type in columns.items())
+        assignments = ", ".join(f"{name} = s.{name}" for name in columns)
+        try:
+            async with acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(f"CREATE TEMP TABLE farm_updates_staging (plot_number bigint, {column_defs}) ON COMMIT DROP")
+                    await conn.copy_records_to_table("farm_updates_staging", records=rows,
+                                                     columns=["plot_number", *columns])
+                    status = await conn.execute(f"""
+                        UPDATE farm_data f
+                        SET {assignments}
+                        FROM farm_updates_staging s
+                        WHERE f.plot_number = s.plot_number
+                    """)
+            updated = int(status.split()[-1])
+            self.logger.info(f"Wrote {updated} farm updates for village {village_id}")
+            return updated
+        except Exception as e:
+            self.logger.error(f"Error writing farm updates for village {village_id}: {e}")
+            return 0
+
     def _init_earth_engine(self):
         # Initialize Google Earth Engine if not already initialized
         if not self.ee_initialized:
@@ -71,8 +120,6 @@ class BaseEarthEngineCalculator:
     async def get_farm_data(self) -> List[Dict[str, Any]]:
         # Fetch farm data with geometries and planting dates
         try:
-            conn = await asyncpg.connect(**DB_PARAMS)
-            
             query = """
                 SELECT 
                     plot_number, 
@@ -88,8 +135,8 @@ class BaseEarthEngineCalculator:
                     village_id
             """
             
-            rows = await conn.fetch(query)
-            await conn.close()
+            async with acquire() as conn:
+                rows = await conn.fetch(query)
             
             if not rows:
                 self.logger.warning("No farms with both geometry and planting date found")
@@ -148,23 +195,7 @@ waterlogging_logger.addHandler(waterlogging_file_handler)
 waterlogging_logger.addHandler(waterlogging_console_handler)
 waterlogging_logger.propagate = False
 
-# Database connection parameters for asyncpg (async operations)
-DB_PARAMS = {
-    'user': 'smurfs',
-    'password': 'smurfs123',
-    'database': 'smurf',
-    'host': 'localhost',
-    'port': '5432'
-}
-
-# Database connection parameters for psycopg2 (sync operations)
-DB_PARAMS_SYNC = {
-    'dbname': 'smurf',
-    'user': 'smurfs',
-    'password': 'smurfs123',
-    'host': 'localhost',
-    'port': 5432
-}
+# Database access goes through the shared pools of Utils/db_pool.py ('smurf' database)
 
 def initialize_gee(service_account_json_path, logger=None):
     """Initialize Google Earth Engine with service account"""
@@ -330,6 +361,94 @@ class SugarcaneHarvestReadinessCalculator(BaseEarthEngineCalculator):
             'reason': "; ".join(reason)
         }
     
+    def assess_harvest_readiness_series(self, dates, lai_series, swir_series):
+        """
+        Harvest readiness from a farm's (smoothed) LAI and SWIR time series, with the same criteria
+        as check_harvest_readiness: LAI > 3.5 and stable (< 0.3 change) between the last two
+        two-week windows, and SWIR rising 5-10% over the last 3 observations.
+
+        Args:
+            dates (array-like): Observation dates, ascending
+            lai_series (array-like): LAI per date (NaN where missing)
+            swir_series (array-like): SWIR reflectance per date (NaN where missing)
+
+        Returns:
+            dict: Same keys as check_harvest_readiness()
+        """
+        dates = pd.DatetimeIndex(dates)
+        lai_series = np.asarray(lai_series, dtype=float)
+        swir_series = np.asarray(swir_series, dtype=float)
+
+        # Two-week windows relative to the latest date of the series
+        age_days = (dates[-1] - dates).days if len(dates) else np.array([])
+        recent = lai_series[(age_days < 14) & np.isfinite(lai_series)]
+        previous = lai_series[(age_days >= 14) & (age_days < 28) & np.isfinite(lai_series)]
+        recent_lai = float(recent.mean()) if recent.size else None
+        previous_lai = float(previous.mean()) if previous.size else None
+        lai_ready = bool(recent_lai is not None and previous_lai is not None
+                         and recent_lai > 3.5 and abs(recent_lai - previous_lai) < 0.3)
+
+        valid_swir = np.isfinite(swir_series)
+        swir_values = [(date.strftime("%Y-%m-%d"), float(value))
+                       for date, value in zip(dates[valid_swir][-3:], swir_series[valid_swir][-3:])]
+        swir_ready = False
+        percent_increase = None
+        if len(swir_values) >= 3 and swir_values[0][1] > 0:
+            percent_increase = (swir_values[-1][1] - swir_values[0][1]) / swir_values[0][1] * 100
+            swir_ready = 5 <= percent_increase <= 10
+
+        reason = ["LAI > 3.5 and stable" if lai_ready else
+                  f"LAI criteria not met (value: {recent_lai if recent_lai is not None else float('nan'):.2f})"]
+        if swir_ready:
+            reason.append("SWIR reflectance indicates optimal sugar accumulation")
+        elif percent_increase is not None:
+            reason.append(f"SWIR increase ({percent_increase:.2f}%) not in optimal range (5-10%)")
+        else:
+            reason.append("Not enough observations for SWIR analysis")
+
+        return {
+            'harvest_ready': lai_ready and swir_ready,
+            'lai_ready': lai_ready,
+            'swir_ready': swir_ready,
+            'confidence': 50 * lai_ready + 50 * swir_ready,
+            'lai_value': recent_lai,
+            'swir_trend': swir_values,
+            'reason': "; ".join(reason)
+        }
+
+    def harvest_readiness_matrix(self, dates, lai_matrix, swir_matrix):
+        """
+        Vectorized harvest readiness for many farms from gap-filled, smoothed (farms, dates)
+        LAI and SWIR matrices (see Utils/timeseries_smoothing.py).
+
+        Args:
+            dates (array-like): Evenly spaced column dates, ascending
+            lai_matrix (ndarray): (farms, dates) LAI
+            swir_matrix (ndarray): (farms, dates) SWIR reflectance
+
+        Returns:
+            ndarray: Database codes per farm, as convert_harvest_readiness_to_int (3 ready, 2 approaching, 1 not ready)
+        """
+        dates = pd.DatetimeIndex(dates)
+        lai_matrix = np.asarray(lai_matrix, dtype=float)
+        swir_matrix = np.asarray(swir_matrix, dtype=float)
+        age_days = np.asarray((dates[-1] - dates).days)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)  # farms without data -> NaN means
+            recent_lai = np.nanmean(lai_matrix[:, age_days < 14], axis=1)
+            previous_lai = np.nanmean(lai_matrix[:, (age_days >= 14) & (age_days < 28)], axis=1)
+        lai_ready = (recent_lai > 3.5) & (np.abs(recent_lai - previous_lai) < 0.3)
+
+        swir_ready = np.zeros(len(swir_matrix), dtype=bool)
+        if swir_matrix.shape[1] >= 3:
+            first, last = swir_matrix[:, -3], swir_matrix[:, -1]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                percent_increase = (last - first) / first * 100
+            swir_ready = (first > 0) & (percent_increase >= 5) & (percent_increase <= 10)
+
+        return np.where(lai_ready & swir_ready, 3, np.where(lai_ready | swir_ready, 2, 1))
+
     def _calculate_mean_indicator_ready(self, image_collection, geometry, band_name):
         """Calculate mean value of an indicator for a collection"""
         # Check if collection is empty
@@ -370,10 +489,6 @@ class SugarcaneHarvestReadinessCalculator(BaseEarthEngineCalculator):
         
         self.logger.info(f"Processing {len(villages)} villages for harvest readiness")
         
-        # Connect to database for updates
-        conn = psycopg2.connect(**DB_PARAMS_SYNC)
-        cur = conn.cursor()
-        
         try:
             # Create harvest_readiness column if it doesn't exist
             # cur.execute("""
@@ -393,6 +508,8 @@ class SugarcaneHarvestReadinessCalculator(BaseEarthEngineCalculator):
                 
                 # Process each farm in the village
                 processed_count = 0
+                history = []
+                updates = []
                 for farm in village_farms:
                     try:
                         plot_number = farm['plot_number']
@@ -414,13 +531,17 @@ class SugarcaneHarvestReadinessCalculator(BaseEarthEngineCalculator):
 
                         #obtain lai value from harvest assessment
                         lai_value = harvest_assessment.get('lai_value', None)
+
+                        # LAI is the mean of the last two weeks, recorded on the assessment date
+                        if lai_value is not None:
+                            history.append({'farm_id': plot_number, 'village_id': village_id, 'date': datetime.now().date(),
+                                            'indicator': 'lai', 'value': lai_value})
+                        history.extend({'farm_id': plot_number, 'village_id': village_id, 'date': swir_date,
+                                        'indicator': 'swir', 'value': swir_value}
+                                       for swir_date, swir_value in harvest_assessment.get('swir_trend', []))
                         
-                        # Update harvest readiness in database
-                        cur.execute("""
-                            UPDATE farm_data
-                            SET harvest_readiness = %s, lai_value = %s
-                            WHERE plot_number = %s
-                        """, (readiness_int, lai_value, plot_number))
+                        # Buffered; written for the whole village below
+                        updates.append((plot_number, readiness_int, None if lai_value is None else float(lai_value)))
                         
                         # Log result
                         status_map = {3: "Ready", 2: "Approaching", 1: "Not ready"}
@@ -431,18 +552,14 @@ class SugarcaneHarvestReadinessCalculator(BaseEarthEngineCalculator):
                         self.logger.error(f"Error processing farm plot {farm['plot_number']} for harvest readiness: {e}")
                 
                 self.logger.info(f"Processed {processed_count} farms in village {village_id} for harvest readiness")
+                await self.write_farm_updates({"harvest_readiness": "integer", "lai_value": "double precision"},
+                                              updates, village_id)
+                self.record_indicators(history, village_id)
             
-            # Commit all changes
-            conn.commit()
             self.logger.info("\nHarvest readiness update completed successfully")
             
         except Exception as e:
-            conn.rollback()
             self.logger.error(f"Error updating harvest readiness: {e}")
-        finally:
-            # Close connection
-            cur.close()
-            conn.close()
 
 class GEENDVICalculator(BaseEarthEngineCalculator):
     
@@ -710,10 +827,6 @@ class GEENDVICalculator(BaseEarthEngineCalculator):
         
         self.logger.info(f"Processing {len(villages)} villages")
         
-        # Connect to database for updates (using psycopg2 for simplicity in the loop)
-        conn = psycopg2.connect(**DB_PARAMS_SYNC)
-        cur = conn.cursor()
-        
         try:
             # Process each village
             for village_id, village_farms in villages.items():
@@ -741,6 +854,8 @@ class GEENDVICalculator(BaseEarthEngineCalculator):
                 
                 # Process each farm in the village
                 processed_count = 0
+                history = []
+                updates = []
                 for farm in village_farms:
                     try:
                         plot_number = farm['plot_number']
@@ -758,6 +873,8 @@ class GEENDVICalculator(BaseEarthEngineCalculator):
                             continue
                         
                         ndvi_value = ndvi_result['ndvi']
+                        history.append({'farm_id': plot_number, 'village_id': village_id, 'date': ndvi_result['date'],
+                                        'indicator': 'ndvi', 'value': ndvi_value})
                         
                         # Current date for health assessment
                         current_date = datetime.now()
@@ -779,12 +896,8 @@ class GEENDVICalculator(BaseEarthEngineCalculator):
                         # Convert to integer value for database
                         health_int = self.convert_health_status_to_int(health_status)
                         
-                        # Update health in database
-                        cur.execute("""
-                            UPDATE farm_data
-                            SET health = %s, ndvi_value = %s
-                            WHERE plot_number = %s
-                        """, (health_int, ndvi_value, plot_number))
+                        # Buffered; written for the whole village below
+                        updates.append((plot_number, health_int, float(ndvi_value)))
                         
                         self.logger.info(f"Updated plot {plot_number} health to {health_status} ({health_int}) and NDVI to {ndvi_value:.4f}")
                         processed_count += 1
@@ -793,18 +906,14 @@ class GEENDVICalculator(BaseEarthEngineCalculator):
                         self.logger.error(f"Error processing farm plot {farm['plot_number']}: {e}")
                 
                 self.logger.info(f"Processed {processed_count} farms in village {village_id}")
+                await self.write_farm_updates({"health": "integer", "ndvi_value": "double precision"},
+                                              updates, village_id)
+                self.record_indicators(history, village_id)
             
-            # Commit all changes
-            conn.commit()
             self.logger.info("\nHealth and NDVI value columns update completed successfully")
             
         except Exception as e:
-            conn.rollback()
             self.logger.error(f"Error updating health or NDVI: {e}")
-        finally:
-            # Close connection
-            cur.close()
-            conn.close()
 
 class WaterLoggingCalculator(BaseEarthEngineCalculator):
 
@@ -902,6 +1011,41 @@ class WaterLoggingCalculator(BaseEarthEngineCalculator):
             "recommendations": recommendations
         }
     
+    def assess_waterlogging_series(self, dates, ndwi_series):
+        """
+        Assess waterlogging from a farm's (smoothed, gap-filled) NDWI time series instead of raw passes
+
+        Args:
+            dates (array-like): Observation dates
+            ndwi_series (array-like): NDWI per date (NaN where missing)
+
+        Returns:
+            dict: Same as assess_waterlogging_condition()
+        """
+        ndwi_values = [(pd.Timestamp(date).strftime("%Y-%m-%d"), float(value))
+                       for date, value in zip(dates, ndwi_series) if np.isfinite(value)]
+        return self.assess_waterlogging_condition(ndwi_values)
+
+    def waterlogging_status_matrix(self, ndwi_matrix):
+        """
+        Vectorized waterlogging status for many farms from a gap-filled, smoothed (farms, dates) NDWI
+        matrix (see Utils/timeseries_smoothing.py), using the two most recent dates and the
+        thresholds of assess_waterlogging_condition
+
+        Args:
+            ndwi_matrix (ndarray): (farms, dates) NDWI, dates ascending
+
+        Returns:
+            ndarray: Database codes per farm, as convert_waterlogging_status_to_int (3 waterlogged, 2 at risk, 1 normal)
+        """
+        ndwi_matrix = np.asarray(ndwi_matrix, dtype=float)
+        if ndwi_matrix.shape[1] < 2:
+            return np.ones(len(ndwi_matrix), dtype=int)  # Insufficient data -> normal
+        recent, previous = ndwi_matrix[:, -1], ndwi_matrix[:, -2]
+        waterlogged = (recent > 0.3) & (previous > 0.3)
+        at_risk = (recent > 0.3) | (previous > 0.3) | (recent > 0.2)
+        return np.where(waterlogged, 3, np.where(at_risk, 2, 1))
+
     async def update_waterlogging_with_gee(self):
         """Update waterlogging indicators for all farms using NDWI from Google Earth Engine"""
         self._init_earth_engine()
@@ -922,10 +1066,6 @@ class WaterLoggingCalculator(BaseEarthEngineCalculator):
         
         self.logger.info(f"Processing {len(villages)} villages for waterlogging assessment")
         
-        # Connect to database for updates
-        conn = psycopg2.connect(**DB_PARAMS_SYNC)
-        cur = conn.cursor()
-        
         try:
             # Create waterlogging column if it doesn't exist
             # cur.execute("""
@@ -949,6 +1089,8 @@ class WaterLoggingCalculator(BaseEarthEngineCalculator):
                 
                 # Process each farm in the village
                 processed_count = 0
+                history = []
+                updates = []
                 for farm in village_farms:
                     try:
                         plot_number = farm['plot_number']
@@ -986,6 +1128,11 @@ class WaterLoggingCalculator(BaseEarthEngineCalculator):
                             image_date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
                             ndwi_values.append((image_date, ndwi_value))
                         
+                        # Keep every pass in the indicator history
+                        history.extend({'farm_id': plot_number, 'village_id': village_id, 'date': ndwi_date,
+                                        'indicator': 'ndwi', 'value': ndwi_value}
+                                       for ndwi_date, ndwi_value in ndwi_values)
+
                         # Get the most recent NDWI value for the database
                         latest_ndwi = sorted(ndwi_values, key=lambda x: x[0], reverse=True)[0][1]
                         
@@ -996,12 +1143,8 @@ class WaterLoggingCalculator(BaseEarthEngineCalculator):
                         # Convert to integer value for database
                         waterlogging_int = self.convert_waterlogging_status_to_int(waterlogging_status)
                         
-                        # Update waterlogging status in database
-                        cur.execute("""
-                            UPDATE farm_data
-                            SET waterlogging = %s, ndwi_value = %s
-                            WHERE plot_number = %s
-                        """, (waterlogging_int, latest_ndwi, plot_number))
+                        # Buffered; written for the whole village below
+                        updates.append((plot_number, waterlogging_int, None if latest_ndwi is None else float(latest_ndwi)))
                         
                         self.logger.info(f"Updated plot {plot_number} waterlogging status to {waterlogging_status} ({waterlogging_int}) and NDWI to {latest_ndwi:.4f}")
                         processed_count += 1
@@ -1010,18 +1153,14 @@ class WaterLoggingCalculator(BaseEarthEngineCalculator):
                         self.logger.error(f"Error processing farm plot {farm['plot_number']} for waterlogging assessment: {e}")
                 
                 self.logger.info(f"Processed {processed_count} farms in village {village_id} for waterlogging assessment")
+                await self.write_farm_updates({"waterlogging": "integer", "ndwi_value": "double precision"},
+                                              updates, village_id)
+                self.record_indicators(history, village_id)
             
-            # Commit all changes
-            conn.commit()
             self.logger.info("\nWaterlogging assessment update completed successfully")
             
         except Exception as e:
-            conn.rollback()
             self.logger.error(f"Error updating waterlogging assessment: {e}")
-        finally:
-            # Close connection
-            cur.close()
-            conn.close()    
 
 async def main():
     try:
@@ -1066,6 +1205,8 @@ async def main():
         waterlogging_logger.error(f"Error in main function: {str(e)}")
         # Print to stderr as well in case logging failed
         print(f"Error in main function: {str(e)}", file=sys.stderr)
+    finally:
+        await close_pools()
         
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
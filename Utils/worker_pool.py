@@ -0,0 +1,36 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Size of the shared pool for CPU-bound raster work (NDVI, previews). Defaults to one worker per core;
+# set RASTER_WORKERS to leave cores free for the API's own threads or other services.
+RASTER_WORKERS = int(os.environ.get("RASTER_WORKERS", 0)) or os.cpu_count() or 1
+
+_process_pool = None
+
+def get_process_pool():
+    """
+    Process pool shared by all CPU-bound raster work. Workers are spawned (not forked), so they
+    are safe next to the event loop's threads, and are started lazily on first use.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=RASTER_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+def submit_to_pool(func, *args):
+    """
+    Run func(*args) in the process pool and return an awaitable for its result. `func` must be a
+    module-level function and its arguments and result picklable.
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(get_process_pool(), func, *args)
+
+def shutdown_process_pool():
+    """Stop the pool's workers (e.g. at application shutdown); it is recreated on next use."""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
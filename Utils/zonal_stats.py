@@ -0,0 +1,158 @@
+import math
+import numpy as np
+import geopandas as gpd
+from Utils.geometry_service import transform_geometries, farm_geometries
+from rasterio import features
+from rasterio.windows import Window, from_bounds
+
+DEFAULT_PERCENTILES = (10, 25, 75, 90)
+
+def reproject_geometries(geoms, dst_crs, src_crs="EPSG:4326", farm_ids=None):
+    """
+    Reproject a list of GeoJSON-like geometries in a single vectorized step.
+
+    Parameters:
+    geoms (list): List of GeoJSON geometry dicts (None entries are kept as empty geometries)
+    dst_crs: Target CRS (usually the raster's src.crs)
+    src_crs: CRS of the input geometries
+    farm_ids (list): Optional farm ids matching `geoms`; the reprojected geometries are then
+                     cached per farm and CRS (see Utils/geometry_service.py)
+
+    Returns:
+    GeoSeries: Reprojected geometries, in the same order as the input
+    """
+    if farm_ids is not None:
+        geometries = farm_geometries(farm_ids, geoms, dst_crs, src_crs=src_crs)
+    else:
+        geometries = transform_geometries(geoms, dst_crs, src_crs)
+    return gpd.GeoSeries(geometries, crs=dst_crs)
+
+def geometry_window(src, geometries):
+    """
+    Compute the pixel window of `src` that covers the total bounds of the geometries,
+    clipped to the raster extent. Returns None if the geometries fall outside the raster.
+    """
+    valid = geometries[~(geometries.isna() | geometries.is_empty)]
+    if valid.empty:
+        return None
+
+    window = from_bounds(*valid.total_bounds, transform=src.transform)
+    col_off = max(0, math.floor(window.col_off))
+    row_off = max(0, math.floor(window.row_off))
+    col_end = min(src.width, math.ceil(window.col_off + window.width))
+    row_end = min(src.height, math.ceil(window.row_off + window.height))
+
+    if col_end <= col_off or row_end <= row_off:
+        return None
+    return Window(col_off, row_off, col_end - col_off, row_end - row_off)
+
+def rasterize_labels(geometries, out_shape, transform):
+    """
+    Burn geometries into a single int32 label grid. Zone i (0-based) gets label i + 1,
+    0 is background. Where farms overlap, the later geometry wins.
+    """
+    shapes = [
+        (geom, idx + 1) for idx, geom in enumerate(geometries)
+        if geom is not None and not geom.is_empty
+    ]
+    if not shapes:
+        return np.zeros(out_shape, dtype=np.int32)
+    return features.rasterize(shapes, out_shape=out_shape, transform=transform, fill=0, dtype="int32")
+
+def sort_by_label(labels, *arrays):
+    """
+    Flatten the labelled (label > 0) pixels and sort them by label, so every zone is a
+    contiguous run. Returns (sorted_labels, [sorted arrays], starts, counts) where
+    starts/counts are indexed by label.
+    """
+    selected = labels > 0
+    lab = labels[selected]
+    order = np.argsort(lab, kind="stable")
+    lab = lab[order]
+    sorted_arrays = [array[selected][order] for array in arrays]
+
+    n_labels = int(labels.max()) if labels.size else 0
+    counts = np.bincount(lab, minlength=n_labels + 1)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return lab, sorted_arrays, starts, counts
+
+def label_extrema(sorted_values, starts, counts):
+    """Per-label (min, max) of label-sorted values. Empty labels get NaN."""
+    n = len(counts)
+    mins = np.full(n, np.nan, dtype=np.float64)
+    maxs = np.full(n, np.nan, dtype=np.float64)
+    nonempty = np.flatnonzero(counts)
+    if nonempty.size:
+        mins[nonempty] = np.minimum.reduceat(sorted_values, starts[nonempty])
+        maxs[nonempty] = np.maximum.reduceat(sorted_values, starts[nonempty])
+    return mins, maxs
+
+def zonal_statistics(values, labels, n_zones, percentiles=DEFAULT_PERCENTILES):
+    """
+    Compute per-zone statistics of a 2D array against a label grid in one pass.
+
+    Parameters:
+    values (ndarray): 2D array of pixel values; NaN pixels are ignored
+    labels (ndarray): 2D int label grid of the same shape (0 = background)
+    n_zones (int): Number of zones (labels 1..n_zones)
+    percentiles (tuple): Extra percentiles to report next to the median
+
+    Returns:
+    dict: Arrays of length n_zones for 'mean', 'median', 'std', 'min', 'max',
+          'pixel_count' and 'p<q>' for each requested percentile
+    """
+    selected = (labels > 0) & np.isfinite(values)
+    lab = labels[selected]
+    vals = values[selected].astype(np.float64)
+
+    # Sort by label, then by value within each label: every zone becomes a contiguous,
+    # ordered run, so quantiles can be read off directly
+    order = np.lexsort((vals, lab))
+    lab = lab[order]
+    vals = vals[order]
+
+    counts = np.bincount(lab, minlength=n_zones + 1)[:n_zones + 1]
+    sums = np.bincount(lab, weights=vals, minlength=n_zones + 1)[:n_zones + 1]
+    squares = np.bincount(lab, weights=vals * vals, minlength=n_zones + 1)[:n_zones + 1]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / counts
+        std = np.sqrt(np.maximum(squares / counts - mean * mean, 0.0))
+
+    mins, maxs = label_extrema(vals, starts, counts)
+
+    def quantile(q):
+        # Same linear interpolation as np.percentile
+        result = np.full(n_zones + 1, np.nan)
+        nonempty = counts > 0
+        position = starts[nonempty] + (counts[nonempty] - 1) * (q / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        frac = position - lower
+        result[nonempty] = vals[lower] + (vals[upper] - vals[lower]) * frac
+        return result
+
+    stats = {
+        "mean": mean,
+        "median": quantile(50),
+        "std": std,
+        "min": mins,
+        "max": maxs,
+        "pixel_count": counts,
+    }
+    for q in percentiles:
+        stats[f"p{q}"] = quantile(q)
+
+    # Drop the background label
+    return {key: value[1:] for key, value in stats.items()}
+
+def zone_results(stats, zone_ids):
+    """Turn the arrays from zonal_statistics into {zone_id: {stat: value}}."""
+    results = {}
+    for idx, zone_id in enumerate(zone_ids):
+        results[zone_id] = {
+            key: (int(value[idx]) if key == "pixel_count" else float(value[idx]))
+            for key, value in stats.items()
+        }
+    return results
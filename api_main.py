@@ -1,24 +1,42 @@
 import os
 import pathlib
-import rasterio
 import numpy as np
 import pandas as pd
 from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from Utils.ndvi_utils import normalize_bands, ndvi_time_series, plot_rgb_and_ndvi
+from Utils.ndvi_render import submit_scene
 from Utils.farm_level_alerts import generate_sugarcane_alerts
 from Utils.api_utils import PlanetData, get_sugarcane_stage, get_stage_thresholds, fetch_forecast_data
 from fastapi.middleware.cors import CORSMiddleware
 from Utils.satellite_gee import SatelliteDataCollector
+from Utils.spectral_indices import resolve_indices, index_statistics, INDEX_FORMULAS, SENSOR_BANDS
+from Utils.map_tiles import TileCache, get_tile, TILE_STYLES
+from Utils.indicator_store import IndicatorStore
+from Utils.result_cache import cache_stats
+from Utils.band_cache import BAND_CACHE_ENABLED, get_band_cache
+from Utils.db_pool import acquire, init_pools, close_pools, pool_stats
+from Utils.worker_pool import shutdown_process_pool
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 import pickle
-import asyncpg
-from typing import Dict
+import re
+import asyncio
+from typing import Dict, List, Optional
 import json
 from datetime import datetime, timedelta
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # Database pools are opened once at startup and shared by every request
+    await init_pools("smurf")
+    try:
+        yield
+    finally:
+        await close_pools()
+        shutdown_process_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 OPENWEATHER_API_KEY = None
 openweather_key_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_key/openweather.json')
@@ -31,6 +49,12 @@ try:
 except Exception as e:
     raise RuntimeError(f"Failed to load OpenWeather API key: {e}")
 
+# Append-only per-farm indicator history written by the GEE calculators
+indicator_store = IndicatorStore()
+
+# Rendered map tiles, evicted least-recently-used beyond the cache budget
+tile_cache = TileCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data', 'tile_cache'))
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Frontend URL
@@ -71,6 +95,12 @@ class SatelliteImage(BaseModel):
     village_id: int
     bands: str
 
+class IndexRequest(BaseModel):
+    indices: List[str] = ["NDVI"]
+    custom: Dict[str, str] = {}  # name -> band-algebra expression, e.g. "(nir - swir1) / (nir + swir1)"
+    satellite_type: str = "S2"
+    image_path: Optional[str] = None  # defaults to the latest village image
+
 @app.post("/sugarcane-forecast")
 async def analyze_sugarcane_forecast(request: WeatherRequestFarm):
     try:
@@ -443,6 +473,167 @@ async def get_all_village_satellite_images():
             status_code=500
         )
 
+def json_safe(value):
+    # Replace NaN/inf (e.g. zones without valid pixels) with None so the result is valid JSON
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+# Image directories of the optical sensors that have band mappings in SENSOR_BANDS. Sentinel-1
+# (VV/VH/angle) has no optical bands, so tiles and indices are not available for it.
+OPTICAL_SATELLITE_DIRS = {"S2": "sentinel2", "L9": "landsat"}
+
+def optical_satellite_dir(satellite_type: str) -> str:
+    if satellite_type not in OPTICAL_SATELLITE_DIRS or satellite_type not in SENSOR_BANDS:
+        raise HTTPException(status_code=400, detail=f"Satellite type {satellite_type} is not supported here. Use S2 or L9.")
+    return OPTICAL_SATELLITE_DIRS[satellite_type]
+
+def find_latest_village_image(village_id: int, satellite_type: str = "S2") -> Optional[str]:
+    # Latest downloaded optical image of a village, e.g. Images/sentinel2/v2/S2_v2_..._20240415_20240419_123456.tif
+    sat_dir = optical_satellite_dir(satellite_type)
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    village_dir = os.path.join(script_dir, 'Images', sat_dir, f'v{village_id}')
+    if not os.path.exists(village_dir):
+        return None
+
+    # Standard band files only (skip S2_SCL / L9_thermal companions)
+    pattern = re.compile(rf"^{satellite_type}_v{village_id}_.*_(\d{{8}})_\d{{8}}_\d{{6}}\.tif$")
+    latest_path, latest_date = None, None
+    for filename in os.listdir(village_dir):
+        match = pattern.match(filename)
+        if match and (latest_date is None or match.group(1) > latest_date):
+            latest_date = match.group(1)
+            latest_path = os.path.join(village_dir, filename)
+    return latest_path
+
+def resolve_image_path(image_path: Optional[str]) -> Optional[str]:
+    # Only serve rasters from the local Images/ tree
+    if not image_path:
+        return None
+    images_dir = os.path.realpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Images'))
+    resolved = os.path.realpath(image_path)
+    if os.path.commonpath([images_dir, resolved]) != images_dir:
+        raise ValueError("image_path must point to a file under Images/")
+    return resolved
+
+def find_village_image(village_id: int, satellite_type: str = "S2", image_id: Optional[str] = None) -> Optional[str]:
+    # A specific image of the village by file name (without .tif), or the latest one
+    if not image_id:
+        return find_latest_village_image(village_id, satellite_type)
+    sat_dir = optical_satellite_dir(satellite_type)
+    if os.path.basename(image_id) != image_id:
+        raise ValueError("image must be a file name")
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    image_path = os.path.join(script_dir, 'Images', sat_dir, f'v{village_id}', f'{image_id}.tif')
+    return image_path if os.path.exists(image_path) else None
+
+@app.get("/tiles/{layer}/{z}/{x}/{y}.png")
+async def map_tile_endpoint(
+    layer: str,
+    z: int,
+    x: int,
+    y: int,
+    village_id: int = Query(..., description="Village whose imagery is rendered"),
+    satellite_type: str = Query("S2", description="S2 or L9"),
+    image: Optional[str] = Query(None, description="Image file name without .tif; defaults to the latest image")
+):
+    # XYZ (Web Mercator) PNG tile of a village raster, rendered on demand and cached on disk
+    try:
+        if layer not in TILE_STYLES:
+            raise ValueError(f"Unknown tile layer {layer}. Available: {', '.join(TILE_STYLES)}")
+        tif_file = find_village_image(village_id, satellite_type, image)
+        if not tif_file:
+            return JSONResponse(content={"status": "error", "message": f"No {satellite_type} image found for village {village_id}"}, status_code=404)
+
+        png = await asyncio.to_thread(get_tile, tif_file, layer, z, x, y, tile_cache)
+        return Response(content=png, media_type="image/png", headers={"Cache-Control": "public, max-age=86400"})
+    except HTTPException:
+        raise
+    except ValueError as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.get("/api/cache/stats")
+async def result_cache_stats():
+    # Hit/miss counters and sizes of the NDVI result caches (API process and pool workers), for sizing the budgets
+    band_cache = get_band_cache().stats() if BAND_CACHE_ENABLED else None
+    return {"status": "success", "caches": cache_stats(), "band_cache": band_cache}
+
+@app.get("/api/db/stats")
+async def db_pool_stats():
+    # Size, utilisation and acquire wait times of the shared asyncpg pools
+    return {"status": "success", "pools": pool_stats()}
+
+@app.get("/api/indices")
+async def list_spectral_indices():
+    # Named index formulas available to the index endpoints
+    return {"status": "success", "indices": INDEX_FORMULAS}
+
+@app.post("/api/indices/village/{village_id}")
+async def village_indices_endpoint(village_id: int, request: IndexRequest):
+    # Several spectral indices over a village scene, from a single raster read
+    try:
+        indices = resolve_indices(request.indices, request.custom)
+        tif_file = resolve_image_path(request.image_path) or find_latest_village_image(village_id, request.satellite_type)
+        if not tif_file or not os.path.exists(tif_file):
+            return JSONResponse(content={"status": "error", "message": f"No {request.satellite_type} image found for village {village_id}"}, status_code=404)
+
+        stats = await asyncio.to_thread(index_statistics, tif_file, indices)
+        return JSONResponse(content={
+            "status": "success",
+            "village_id": village_id,
+            "image_path": tif_file,
+            "data": json_safe(stats["scene"])
+        })
+    except HTTPException:
+        raise
+    except (ValueError, SyntaxError) as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.post("/api/indices/farm/{farm_id}")
+async def farm_indices_endpoint(farm_id: int, request: IndexRequest):
+    # Several spectral indices over one farm, from a single windowed raster read
+    try:
+        indices = resolve_indices(request.indices, request.custom)
+
+        async with acquire() as conn:
+            row = await conn.fetchrow("SELECT village_id, geometry FROM farm_data WHERE plot_number = $1", farm_id)
+
+        if not row or row['geometry'] is None:
+            return JSONResponse(content={"status": "error", "message": f"Farm with ID {farm_id} not found."}, status_code=404)
+
+        geometry = row['geometry']
+        if isinstance(geometry, str):
+            geometry = json.loads(geometry)
+
+        tif_file = resolve_image_path(request.image_path) or find_latest_village_image(row['village_id'], request.satellite_type)
+        if not tif_file or not os.path.exists(tif_file):
+            return JSONResponse(content={"status": "error", "message": f"No {request.satellite_type} image found for village {row['village_id']}"}, status_code=404)
+
+        stats = await asyncio.to_thread(index_statistics, tif_file, indices, None, [geometry], [farm_id])
+        return JSONResponse(content={
+            "status": "success",
+            "farm_id": farm_id,
+            "village_id": row['village_id'],
+            "image_path": tif_file,
+            "data": json_safe(stats[farm_id])
+        })
+    except HTTPException:
+        raise
+    except (ValueError, SyntaxError) as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
 @app.post("/view-results")
 async def view_results():
     try:
@@ -465,6 +656,7 @@ async def view_results():
         return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
 
 async def fetch_and_process_data():
+    planet_data = None
     try:
         # Load the processing data from the pickle file
         processing_data_path = "Data/processing_data.pkl"
@@ -512,69 +704,63 @@ async def fetch_and_process_data():
         plot_results = []  # To store results for each plot
         ndvi_results = [] # Storing the clipped mean values
         dates = []  # Local list to store dates
+        scene_tasks = []  # Per-scene NDVI + preview jobs running in the process pool, in submission order
 
-        # Loop over geometries (GeoJSON data)
-        for geom_idx, geom in enumerate(geojson_data['features']):
+        # Plots with a geometry; scenes are searched and downloaded once for all of them
+        plots = []
+        for geom in geojson_data['features']:
             plot_number = geom['properties'].get('Plot Number')
-            print(f"Processing geometry for Plot Number: {plot_number}...")
-
-            # Extract the geometry data
-            geometry = geom.get('geometry')
-            if not geometry:
+            if not geom.get('geometry'):
                 print(f"No geometry found for plot: {plot_number}")
                 continue
+            plots.append((plot_number, geom))
+
+        plot_paths, selection = await planet_data.download_for_plots(
+            [geom['geometry'] for _, geom in plots], asset_type_id='ortho_analytic_8b_sr')
+
+        for (plot_number, geom), results in zip(plots, plot_paths):
+            print(f"Processing geometry for Plot Number: {plot_number}...")
+            geometry = geom['geometry']
 
-            # Pass the geometry to download_multiple_assets
-            results, item_list, search_df = await planet_data.download_multiple_assets(geom=geometry, asset_type_id='ortho_analytic_8b_sr')
-            if results:
-                tif_files = [result for result in results if pathlib.Path(result).suffix == '.tif']
-            else:
+            tif_files = [result for result in results if pathlib.Path(result).suffix == '.tif']
+            if not tif_files:
                 print(f"No results found for plot: {plot_number}")
                 continue
 
             # Loop over TIFF files and process them
             for idx, tif_file in enumerate(tif_files):
-                filename = str(tif_file)
-                date_str = filename[7:15]  # Extract date from filename
+                date_str = pathlib.Path(tif_file).name[:8]  # Scene ids start with the acquisition date
 
                 # Save the date for later use
                 dates.append(date_str)
 
-                # Open and process the TIFF file
-                with rasterio.open(tif_file) as src:
-                    ndvi_full_mean, ndvi_full, ndvi_clipped_mean, ndvi_clipped = ndvi_time_series(tif_file, geom)
-
-                    ndvi_results.append({
-                        'plot_number': plot_number,
-                        'ndvi_clipped_mean': ndvi_clipped_mean
-                    })
-
-                    # Normalize and plot RGB and NDVI for the full image
-                    full_img = src.read()
-                    normalized_full_img = normalize_bands(full_img)
-                    blue = normalized_full_img[1, :, :]
-                    green = normalized_full_img[3, :, :]
-                    red = normalized_full_img[5, :, :]
-                    rgb_img_full = np.dstack((red, green, blue))
-
-                    # Save the full image NDVI plot
-                    full_image_path = f'plots/{plot_number}_{date_str}_full_image_{idx + 1}.png'
-                    plot_rgb_and_ndvi(rgb_img_full, ndvi_full, "Full Image", save_path=full_image_path)
-
-                    # Add the full image path and plot number to the image data
-                    image_data.append({
-                        'plot_number': plot_number,
-                        'image_path': full_image_path,
-                        'date': date_str
-                    })
-
-                    # Add data to CSV list
-                    csv_data.append({
-                        'plot_number': plot_number,
-                        'date': date_str,
-                        'ndvi_image_path': full_image_path,
-                        'polygon_coordinates': json.dumps(geometry)  # Save polygon as JSON string
-                    })
+                # NDVI and the full image RGB | NDVI preview run in the process pool, so the event loop
+                # stays free while the scenes are processed
+                full_image_path = f'plots/{plot_number}_{date_str}_full_image_{idx + 1}.png'
+                scene_tasks.append((plot_number, submit_scene(tif_file, geom, full_image_path)))
+
+                # Add the full image path and plot number to the image data
+                image_data.append({
+                    'plot_number': plot_number,
+                    'image_path': full_image_path,
+                    'date': date_str
+                })
+
+                # Add data to CSV list
+                csv_data.append({
+                    'plot_number': plot_number,
+                    'date': date_str,
+                    'ndvi_image_path': full_image_path,
+                    'polygon_coordinates': json.dumps(geometry)  # Save polygon as JSON string
+                })
+
+        # Collect the scene results in submission order
+        scene_results = await asyncio.gather(*(task for _, task in scene_tasks))
+        for (plot_number, _), scene in zip(scene_tasks, scene_results):
+            ndvi_results.append({
+                'plot_number': plot_number,
+                'ndvi_clipped_mean': scene['ndvi_clipped_mean']
+            })
 
         # Sorting polygons based on NDVI values
         ranked_polygons = sorted(ndvi_results, key=lambda x: x['ndvi_clipped_mean'], reverse=True)
@@ -592,6 +778,10 @@ async def fetch_and_process_data():
     except Exception as e:
         print(f"Error during fetch and process: {e}")
         return {"status": "error", "message": str(e)}
+    finally:
+        # Release the pooled Planet HTTP session
+        if planet_data is not None:
+            await planet_data.close()
 
 @app.post("/start-processing")
 async def start_processing(request: ProcessingRequest):
@@ -637,46 +827,37 @@ async def get_village_boundaries_by_officer(field_officer_id: int) -> dict:
     # Retrieve village boundaries for a specific field officer.
 
     try:
-        conn = await asyncpg.connect(
-            user='smurfs',
-            password='smurfs123',
-            database='smurf',
-            host='localhost',
-            port='5432'
-        )
+        async with acquire() as conn:
+            # First, check if the field officer exists
+            check_query = """
+                SELECT EXISTS(
+                    SELECT 1 FROM field_officer_credentials 
+                    WHERE field_officer_id = $1
+                )
+            """
+            officer_exists = await conn.fetchval(check_query, field_officer_id)
         
-        # First, check if the field officer exists
-        check_query = """
-            SELECT EXISTS(
-                SELECT 1 FROM field_officer_credentials 
-                WHERE field_officer_id = $1
-            )
-        """
-        officer_exists = await conn.fetchval(check_query, field_officer_id)
-        
-        if not officer_exists:
-            await conn.close()
-            raise Exception(f"Field officer with ID {field_officer_id} not found in the database.")
-        
-        # Query to get village boundaries - now including centroid
-        query = """
-            SELECT 
-                v.village_id,
-                v.village_name,
-                v.field_officer_id,
-                v.village_size,
-                ST_AsGeoJSON(v.geometry) as geometry,
-                ST_AsGeoJSON(v.centroid) as centroid
-            FROM 
-                village_data v
-            WHERE 
-                v.field_officer_id = $1
-            ORDER BY 
-                v.village_id
-        """
-        
-        rows = await conn.fetch(query, field_officer_id)
-        await conn.close()
+            if not officer_exists:
+                raise Exception(f"Field officer with ID {field_officer_id} not found in the database.")
+        
+            # Query to get village boundaries - now including centroid
+            query = """
+                SELECT 
+                    v.village_id,
+                    v.village_name,
+                    v.field_officer_id,
+                    v.village_size,
+                    ST_AsGeoJSON(v.geometry) as geometry,
+                    ST_AsGeoJSON(v.centroid) as centroid
+                FROM 
+                    village_data v
+                WHERE 
+                    v.field_officer_id = $1
+                ORDER BY 
+                    v.village_id
+            """
+        
+            rows = await conn.fetch(query, field_officer_id)
         
         # If no villages are found for a valid field officer, return an appropriate message
         if not rows:
@@ -729,98 +910,94 @@ async def village_boundaries_endpoint(field_officer_id: int):
             status_code=404 if "not found" in str(e) or "No villages found" in str(e) else 500
         )
 
-async def get_farm_data_by_village(village_id: int) -> Dict:
-    # Retrieve farm data for a specific village.
+# Response body of /village/{village_id}/farms, built entirely in SQL. Boundaries are the stored
+# jsonb (JSON-encoded strings are unwrapped), so the output matches the former Python-built shape.
+FARMS_BY_VILLAGE_QUERY = """
+    SELECT
+        json_build_object(
+            'village_id', v.village_id,
+            'village_name', v.village_name,
+            'no_of_farms', v.village_size,
+            'farms', farms.list
+        )::text AS data,
+        farms.list IS NULL AS no_farms
+    FROM
+        village_data v
+    LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+            'farm_id', f.plot_number,
+            'farmer_name', f.farmer_name,
+            'father_name', f.father_name,
+            'area', f.area,
+            'croptype', f.croptype,
+            'variety_group', f.variety_group,
+            'date_of_planting', f.date_of_planting,
+            'phone_number', f.phone_number,
+            'health', f.health,
+            'farmer_code', f.farmer_code,
+            'geometry', CASE WHEN jsonb_typeof(f.geometry) = 'string'
+                             THEN (f.geometry #>> '{}')::jsonb ELSE f.geometry END
+        ) ORDER BY f.plot_number) AS list
+        FROM farm_data f
+        WHERE f.village_id = v.village_id
+    ) farms ON true
+    WHERE
+        v.village_id = $1
+"""
+
+# GeoJSON FeatureCollection of a village's farms from the PostGIS columns maintained by
+# migrations/002_farm_data_geom.sql; $2..$5 optionally restrict it to a bounding box (GiST index)
+FARMS_GEOJSON_QUERY = """
+    SELECT
+        EXISTS(SELECT 1 FROM village_data WHERE village_id = $1) AS village_exists,
+        json_build_object(
+            'type', 'FeatureCollection',
+            'features', COALESCE(json_agg(json_build_object(
+                'type', 'Feature',
+                'id', f.plot_number,
+                'bbox', f.bbox,
+                'geometry', ST_AsGeoJSON(f.geom)::json,
+                'properties', json_build_object(
+                    'farm_id', f.plot_number,
+                    'farmer_name', f.farmer_name,
+                    'farmer_code', f.farmer_code,
+                    'croptype', f.croptype,
+                    'variety_group', f.variety_group,
+                    'date_of_planting', f.date_of_planting,
+                    'area', f.area,
+                    'area_m2', f.area_m2,
+                    'centroid', ST_AsGeoJSON(f.centroid)::json,
+                    'health', f.health,
+                    'ndvi_value', f.ndvi_value,
+                    'harvest_readiness', f.harvest_readiness,
+                    'waterlogging', f.waterlogging,
+                    'ndwi_value', f.ndwi_value
+                )
+            ) ORDER BY f.plot_number), '[]'::json)
+        )::text AS collection
+    FROM
+        farm_data f
+    WHERE
+        f.village_id = $1
+        AND f.geom IS NOT NULL
+        AND ($2::float8 IS NULL OR f.geom && ST_MakeEnvelope($2, $3, $4, $5, 4326))
+"""
+
+async def get_farm_data_by_village(village_id: int) -> str:
+    # Retrieve farm data for a specific village, as JSON text built by the database.
     try:
-        conn = await asyncpg.connect(
-            user='smurfs',
-            password='smurfs123',
-            database='smurf',
-            host='localhost',
-            port='5432'
-        )
-        
-        # First check if the village exists and get basic info
-        village_query = """
-            SELECT 
-                village_id,
-                village_name,
-                village_size
-            FROM 
-                village_data
-            WHERE 
-                village_id = $1
-        """
-        
-        village_row = await conn.fetchrow(village_query, village_id)
-        
-        if not village_row:
-            await conn.close()
+        async with acquire() as conn:
+            row = await conn.fetchrow(FARMS_BY_VILLAGE_QUERY, village_id)
+
+        if not row:
             raise Exception(f"Village with ID {village_id} not found.")
-        
-        # Get all farms for this village
-        farms_query = """
-            SELECT 
-                plot_number,
-                farmer_name,
-                father_name,
-                area,
-                croptype,
-                variety_group,
-                date_of_planting,
-                phone_number,
-                health,
-                farmer_code,
-                geometry as farm_boundaries
-            FROM 
-                farm_data
-            WHERE 
-                village_id = $1
-            ORDER BY 
-                plot_number
-        """
-        
-        farm_rows = await conn.fetch(farms_query, village_id)
-        await conn.close()
-        
+
         # If no farms found, return an appropriate message
-        if not farm_rows:
+        if row['no_farms']:
             raise Exception(f"No farms found for village with ID {village_id}.")
-        
-        # Format the results
-        farms = []
-        for row in farm_rows:
-            # Process the farm geometry (stored as JSONB)
-            farm_geometry = row['farm_boundaries']
-            
-            # If farm_geometry is a string, parse it
-            if isinstance(farm_geometry, str):
-                farm_geometry = json.loads(farm_geometry)
-            
-            farm_data = {
-                "farm_id": row['plot_number'],
-                "farmer_name": row['farmer_name'],
-                "father_name": row['father_name'],
-                "area": row['area'],
-                "croptype": row['croptype'],
-                "variety_group": row['variety_group'],
-                "date_of_planting": row['date_of_planting'].isoformat() if row['date_of_planting'] else None,
-                "phone_number": row['phone_number'],
-                "health": row['health'],
-                "farmer_code": row['farmer_code'],
-                "geometry": farm_geometry
-            }
-            
-            farms.append(farm_data)
-        
-        # Return only the village ID, name and farms
-        return {
-            "village_id": village_row['village_id'],
-            "village_name": village_row['village_name'],
-            "no_of_farms": village_row['village_size'],
-            "farms": farms
-        }
-        
+
+        return row['data']
+
     except Exception as e:
         print(f"Error in get_farm_data_by_village: {e}")
         raise Exception(f"Database error: {str(e)}")
@@ -829,14 +1006,11 @@ async def get_farm_data_by_village(village_id: int) -> Dict:
 async def farm_boundaries_by_village_endpoint(village_id: int):
     # API endpoint to retrieve farm boundaries for a specific village.
     try:
-        result = await get_farm_data_by_village(village_id)
-        return JSONResponse(
-            content={
-                "status": "success",
-                "data": result,
-                "message": f"Farm boundaries for village ID {village_id} retrieved successfully!"
-            }
-        )
+        data = await get_farm_data_by_village(village_id)
+        # The data JSON is passed through as is; only the envelope is added around it
+        message = json.dumps(f"Farm boundaries for village ID {village_id} retrieved successfully!")
+        body = f'{{"status": "success", "data": {data}, "message": {message}}}'
+        return Response(content=body.encode(), media_type="application/json")
     except Exception as e:
         return JSONResponse(
             content={
@@ -845,6 +1019,25 @@ async def farm_boundaries_by_village_endpoint(village_id: int):
             },
             status_code=404 if "not found" in str(e) or "No farms found" in str(e) else 500
         )
+
+@app.get("/village/{village_id}/farms.geojson")
+async def farm_geojson_by_village_endpoint(village_id: int, bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat")):
+    # GeoJSON FeatureCollection of a village's farms, built in SQL and returned as raw bytes.
+    try:
+        bounds = [float(value) for value in bbox.split(",")] if bbox else [None] * 4
+        if len(bounds) != 4:
+            raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+
+        async with acquire() as conn:
+            row = await conn.fetchrow(FARMS_GEOJSON_QUERY, village_id, *bounds)
+
+        if not row['village_exists']:
+            return JSONResponse(content={"status": "error", "message": f"Village with ID {village_id} not found."}, status_code=404)
+        return Response(content=row['collection'].encode(), media_type="application/geo+json")
+    except ValueError as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
     
 @app.get("/api/farm/{farm_id}/alerts")
 async def get_farm_alerts(farm_id: int, ndvi_value: float, sowing_date: str, current_date: str = None):
@@ -890,6 +1083,47 @@ async def get_farm_alerts(farm_id: int, ndvi_value: float, sowing_date: str, cur
             status_code=500
         )
 
+def indicator_history_response(history: pd.DataFrame) -> list:
+    # Long-format rows -> JSON records with ISO dates and NaN as null
+    history = history.astype({"date": "datetime64[ns]"})
+    history["date"] = history["date"].dt.strftime("%Y-%m-%d")
+    records = history[["farm_id", "date", "indicator", "value", "source"]].to_dict("records")
+    return json_safe(records)
+
+@app.get("/api/farm/{farm_id}/indicators")
+async def farm_indicator_history(
+    farm_id: int,
+    start_date: Optional[str] = Query(None, description="YYYY-MM-DD, inclusive"),
+    end_date: Optional[str] = Query(None, description="YYYY-MM-DD, inclusive"),
+    indicators: Optional[str] = Query(None, description="Comma separated, e.g. ndvi,ndwi")
+):
+    # NDVI/NDWI/LAI/SWIR history of one farm from the indicator store
+    try:
+        names = indicators.split(",") if indicators else None
+        history = await asyncio.to_thread(indicator_store.read_farm, farm_id, start_date, end_date, names)
+        return JSONResponse(content={"status": "success", "farm_id": farm_id, "data": indicator_history_response(history)})
+    except ValueError as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.get("/api/village/{village_id}/indicators")
+async def village_indicator_history(
+    village_id: int,
+    start_date: Optional[str] = Query(None, description="YYYY-MM-DD, inclusive"),
+    end_date: Optional[str] = Query(None, description="YYYY-MM-DD, inclusive"),
+    indicators: Optional[str] = Query(None, description="Comma separated, e.g. ndvi,ndwi")
+):
+    # Indicator history of every farm in a village from the indicator store
+    try:
+        names = indicators.split(",") if indicators else None
+        history = await asyncio.to_thread(indicator_store.read_village, village_id, start_date, end_date, names)
+        return JSONResponse(content={"status": "success", "village_id": village_id, "data": indicator_history_response(history)})
+    except ValueError as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,10 @@
+-- Indexes for the batched image coverage lookup (Utils/database_utils.find_covering_images).
+-- Run once against the imagery database: psql -d postgres -f migrations/001_satellite_images_indexes.sql
+
+CREATE INDEX IF NOT EXISTS satellite_images_geometry_gist
+    ON satellite_images USING GIST (geometry);
+
+CREATE INDEX IF NOT EXISTS satellite_images_acquisition_date
+    ON satellite_images (acquisition_date);
+
+ANALYZE satellite_images;
@@ -0,0 +1,60 @@
+-- Native PostGIS geometry for farm_data, kept in sync with the jsonb `geometry` column by a trigger.
+-- Run once against the smurf database: psql -d smurf -f migrations/002_farm_data_geom.sql
+
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+ALTER TABLE farm_data
+    ADD COLUMN IF NOT EXISTS geom geometry(Geometry, 4326),
+    ADD COLUMN IF NOT EXISTS area_m2 double precision,
+    ADD COLUMN IF NOT EXISTS centroid geometry(Point, 4326),
+    ADD COLUMN IF NOT EXISTS bbox double precision[];  -- GeoJSON order: [min_lon, min_lat, max_lon, max_lat]
+
+-- Derives geom, area (square metres on the spheroid), centroid and bbox from the jsonb boundary,
+-- which may be a GeoJSON geometry, a Feature, or a JSON-encoded string of either
+CREATE OR REPLACE FUNCTION farm_data_sync_geom() RETURNS trigger AS $$
+DECLARE
+    boundary jsonb := NEW.geometry;
+BEGIN
+    IF boundary IS NOT NULL AND jsonb_typeof(boundary) = 'string' THEN
+        boundary := (boundary #>> '{}')::jsonb;
+    END IF;
+    IF boundary IS NOT NULL AND boundary->>'type' = 'Feature' THEN
+        boundary := boundary->'geometry';
+    END IF;
+
+    IF boundary IS NULL OR jsonb_typeof(boundary) <> 'object' THEN
+        NEW.geom := NULL;
+    ELSE
+        BEGIN
+            NEW.geom := ST_SetSRID(ST_GeomFromGeoJSON(boundary::text), 4326);
+        EXCEPTION WHEN others THEN
+            RAISE WARNING 'farm_data %: invalid geometry (%)', NEW.plot_number, SQLERRM;
+            NEW.geom := NULL;
+        END;
+    END IF;
+
+    IF NEW.geom IS NULL THEN
+        NEW.area_m2 := NULL;
+        NEW.centroid := NULL;
+        NEW.bbox := NULL;
+    ELSE
+        NEW.area_m2 := ST_Area(NEW.geom::geography);
+        NEW.centroid := ST_Centroid(NEW.geom);
+        NEW.bbox := ARRAY[ST_XMin(NEW.geom), ST_YMin(NEW.geom), ST_XMax(NEW.geom), ST_YMax(NEW.geom)];
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS farm_data_sync_geom ON farm_data;
+CREATE TRIGGER farm_data_sync_geom
+    BEFORE INSERT OR UPDATE OF geometry ON farm_data
+    FOR EACH ROW EXECUTE FUNCTION farm_data_sync_geom();
+
+-- Backfill existing rows through the trigger
+UPDATE farm_data SET geometry = geometry WHERE geometry IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS farm_data_geom_gist ON farm_data USING GIST (geom);
+CREATE INDEX IF NOT EXISTS farm_data_village_id ON farm_data (village_id);
+
+ANALYZE farm_data;
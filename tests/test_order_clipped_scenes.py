@@ -0,0 +1,129 @@
+import json
+import uuid
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+import planet.specs
+import planet.clients.data
+import Utils.api_utils as api_utils
+from Utils.api_utils import PlanetData
+
+ITEM_IDS = ["20240101_050000_00_abcd", "20240102_050000_00_eeee"]
+AOI = {"type": "Polygon", "coordinates": [[[78.0, 29.0], [78.01, 29.0], [78.01, 29.01], [78.0, 29.01], [78.0, 29.0]]]}
+
+class OrdersStub(BaseHTTPRequestHandler):
+    """Minimal Orders API: create (POST), order status/results (GET) and result files."""
+    order_id = None
+    state = "success"
+    tif_bytes = b""
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.requests.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+        self._send(json.dumps({"id": self.order_id, "state": "queued"}).encode(), "application/json")
+
+    def do_GET(self):
+        if self.path.startswith("/files/"):
+            self._send(self.tif_bytes, "image/tiff")
+            return
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        names = [f"{ITEM_IDS[0]}_3B_AnalyticMS_SR_8b_clip.tif", f"{ITEM_IDS[0]}_3B_udm2_clip.tif",
+                 f"{ITEM_IDS[0]}_metadata.json"]
+        results = [{"name": f"{self.order_id}/PSScene/{name}", "location": f"{base}/files/{name}"} for name in names]
+        order = {"id": self.order_id, "state": self.state,
+                 "_links": {"results": results if self.state == "success" else []}}
+        self._send(json.dumps(order).encode(), "application/json")
+
+@pytest.fixture
+def orders_server(tmp_path, monkeypatch):
+    # The SDK validates item types and bundles against specs fetched from Planet; no network here
+    monkeypatch.setattr(planet.clients.data, "validate_data_item_type", lambda item_type: item_type)
+    monkeypatch.setattr(planet.specs, "validate_item_type", lambda item_type: item_type)
+    monkeypatch.setattr(planet.specs, "validate_bundle", lambda item_type, bundle: bundle)
+
+    tif_path = tmp_path / "scene.tif"
+    with rasterio.open(tif_path, "w", driver="GTiff", width=16, height=16, count=8, dtype="uint16",
+                       crs="EPSG:4326", transform=from_origin(78.0, 29.01, 0.000625, 0.000625)) as dst:
+        dst.write(np.arange(8 * 16 * 16, dtype="uint16").reshape(8, 16, 16))
+
+    handler = type("Handler", (OrdersStub,), {"order_id": str(uuid.uuid4()), "state": "success",
+                                              "tif_bytes": tif_path.read_bytes(), "requests": []})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, handler
+    server.shutdown()
+    server.server_close()
+
+def planet_data(server, directory):
+    return PlanetData(credentials={"API_KEY": "test"}, clear_percent_filter_value=(0, 100), date_range=None,
+                      directory=str(directory), ingest_cog=False, download_mode="clip", catalog=False,
+                      orders_base_url=f"http://127.0.0.1:{server.server_port}/compute/ops",
+                      clip_bands=["b2", "b4", "b6", "b8"])
+
+async def order(server, directory):
+    async with planet_data(server, directory) as planet:
+        return await planet.order_clipped_scenes(ITEM_IDS, AOI)
+
+def test_clip_order_downloads_scene_files(orders_server, tmp_path):
+    server, handler = orders_server
+    delivered = asyncio.run(order(server, tmp_path / "out"))
+
+    # Only the scene GeoTIFF is kept; the UDM2 mask and metadata are skipped
+    assert list(delivered) == [ITEM_IDS[0]]
+    assert delivered[ITEM_IDS[0]].read_bytes() == handler.tif_bytes
+    assert delivered[ITEM_IDS[0]].parent == tmp_path / "out" / handler.order_id / "PSScene"
+
+    request = handler.requests[0]
+    assert request["products"][0]["item_ids"] == ITEM_IDS
+    assert request["products"][0]["product_bundle"] == "analytic_8b_sr_udm2"
+    assert [list(tool) for tool in request["tools"]] == [["clip"], ["bandmath"]]
+    assert request["tools"][0]["clip"]["aoi"] == AOI
+
+def test_failed_order_raises(orders_server, tmp_path):
+    server, handler = orders_server
+    handler.state = "failed"
+    with pytest.raises(Exception, match="finished in state failed"):
+        asyncio.run(order(server, tmp_path / "out"))
+
+def test_download_scenes_reports_undelivered_scenes(orders_server, tmp_path, monkeypatch):
+    server, handler = orders_server
+    registered = []
+
+    async def no_images(requests):
+        return [None] * len(requests)
+
+    async def register(**kwargs):
+        registered.append(kwargs["tile_id"])
+
+    monkeypatch.setattr(api_utils, "find_covering_images", no_images)
+    monkeypatch.setattr(api_utils, "add_new_image", register)
+
+    async def run():
+        async with planet_data(server, tmp_path / "out") as planet:
+            planet.geom = AOI
+            scenes = [{"id": item_id, "date": item_id[:8], "polygon": AOI} for item_id in ITEM_IDS]
+            return await planet.download_scenes(scenes, "ortho_analytic_8b_sr", "test")
+
+    results = asyncio.run(run())
+    assert str(results[0]).endswith(f"{ITEM_IDS[0]}_3B_AnalyticMS_SR_8b_clip.tif")
+    assert isinstance(results[1], Exception) and ITEM_IDS[1] in str(results[1])
+    assert registered == [ITEM_IDS[0]]
+
+    # A failed order is reported per scene, like failed downloads
+    handler.state = "failed"
+    results = asyncio.run(run())
+    assert all(isinstance(result, Exception) for result in results)